@@ -0,0 +1,121 @@
+import asyncio
+import json
+import math
+import os
+import time
+
+from app.metrics import counter, gauge, histogram
+
+# Concurrent chat turns and waiting turns per model, the keys are the models accepted by the chat endpoints
+DEFAULT_MODEL_CONCURRENCY = int(os.environ.get("MODEL_CONCURRENCY", "16"))
+DEFAULT_MODEL_QUEUE_SIZE = int(os.environ.get("MODEL_QUEUE_SIZE", "64"))
+MODEL_LIMITS = {
+    "gemma-3-27b-it": {"concurrency": DEFAULT_MODEL_CONCURRENCY, "queue": DEFAULT_MODEL_QUEUE_SIZE},
+    "llama-3.3-70b-instruct": {"concurrency": DEFAULT_MODEL_CONCURRENCY, "queue": DEFAULT_MODEL_QUEUE_SIZE},
+    "llama-3.1-sauerkrautlm-70b-instruct": {"concurrency": DEFAULT_MODEL_CONCURRENCY, "queue": DEFAULT_MODEL_QUEUE_SIZE},
+    "qwq-32b": {"concurrency": DEFAULT_MODEL_CONCURRENCY, "queue": DEFAULT_MODEL_QUEUE_SIZE},
+    "mistral-large-instruct": {"concurrency": DEFAULT_MODEL_CONCURRENCY, "queue": DEFAULT_MODEL_QUEUE_SIZE},
+    "qwen3-235b-a22b": {"concurrency": DEFAULT_MODEL_CONCURRENCY, "queue": DEFAULT_MODEL_QUEUE_SIZE},
+}
+# Overrides as JSON object, e.g. MODEL_LIMITS='{"qwq-32b": {"concurrency": 4, "queue": 16}}'
+for _model, _limits in json.loads(os.environ.get("MODEL_LIMITS", "{}")).items():
+    MODEL_LIMITS.setdefault(_model, {"concurrency": DEFAULT_MODEL_CONCURRENCY, "queue": DEFAULT_MODEL_QUEUE_SIZE}).update(_limits)
+ALLOWED_MODELS = list(MODEL_LIMITS)
+
+# Max. seconds a turn waits for a free slot before it is rejected
+ADMISSION_TIMEOUT = float(os.environ.get("ADMISSION_TIMEOUT", "30"))
+
+QUEUE_SECONDS = histogram("admission_queue_seconds", "Time a chat turn waited for a free model slot", ("model",))
+REJECTED = counter("admission_rejected", "Chat turns rejected because the model was saturated", ("model", "reason"))
+IN_FLIGHT = gauge("admission_in_flight", "Chat turns holding a model slot", ("model",))
+WAITING = gauge("admission_waiting", "Chat turns waiting for a model slot", ("model",))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a model has no free slot and its wait queue is full."""
+
+    def __init__(self, model: str, reason: str, retry_after: int):
+        super().__init__(f"Model {model} is busy ({reason})")
+        self.model = model
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ModelLimiter:
+    """Concurrency limit with a bounded wait queue for one model."""
+
+    def __init__(self, model: str, concurrency: int, queue: int):
+        self.model = model
+        self.concurrency = concurrency
+        self.max_queue = queue
+        self.in_flight = 0
+        self.waiting = 0
+        # Moving average of the time a slot is held, used for Retry-After
+        self.mean_hold = 5.0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._acquired = {}
+
+    def retry_after(self) -> int:
+        """Estimated seconds until the waiting turns are served."""
+        return max(1, min(60, math.ceil(self.mean_hold * (self.waiting / self.concurrency + 1))))
+
+    async def acquire(self, timeout: float = ADMISSION_TIMEOUT) -> object:
+        """Wait for a free slot and return a token for release(), raises AdmissionRejected."""
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            REJECTED.inc(model=self.model, reason="queue_full")
+            raise AdmissionRejected(self.model, "queue full", self.retry_after())
+
+        started = time.perf_counter()
+        self.waiting += 1
+        WAITING.set(self.waiting, model=self.model)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            REJECTED.inc(model=self.model, reason="timeout")
+            raise AdmissionRejected(self.model, "queue timeout", self.retry_after())
+        finally:
+            self.waiting -= 1
+            WAITING.set(self.waiting, model=self.model)
+        QUEUE_SECONDS.observe(time.perf_counter() - started, model=self.model)
+
+        self.in_flight += 1
+        IN_FLIGHT.set(self.in_flight, model=self.model)
+        token = object()
+        self._acquired[token] = time.perf_counter()
+        return token
+
+    def release(self, token: object):
+        """Free the slot of a token, releasing a token twice has no effect."""
+        acquired = self._acquired.pop(token, None)
+        if acquired is None:
+            return
+        self.mean_hold = 0.9 * self.mean_hold + 0.1 * (time.perf_counter() - acquired)
+        self.in_flight -= 1
+        IN_FLIGHT.set(self.in_flight, model=self.model)
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "mean_hold_seconds": round(self.mean_hold, 3),
+        }
+
+
+_limiters = {}
+
+
+def get_model_limiter(model: str) -> ModelLimiter:
+    """Get the limiter of an allowed model."""
+    limiter = _limiters.get(model)
+    if limiter is None:
+        limits = MODEL_LIMITS[model]
+        limiter = _limiters[model] = ModelLimiter(model, limits["concurrency"], limits["queue"])
+    return limiter
+
+
+def admission_stats() -> dict:
+    """Return slot usage per model."""
+    return {model: limiter.stats() for model, limiter in _limiters.items()}
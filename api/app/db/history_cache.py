@@ -0,0 +1,106 @@
+import os
+from typing import NamedTuple
+
+from langchain_core.messages import AIMessage, HumanMessage
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import ChatMessage, ChatSummary
+from chains.cache import LRUCache
+
+# Ready-made LangChain histories keyed by session_id
+HISTORY_CACHE_SIZE = int(os.environ.get("HISTORY_CACHE_SIZE", "1000"))
+HISTORY_CACHE_TTL = float(os.environ.get("HISTORY_CACHE_TTL", "1800"))
+HISTORY_CACHE_MAX_CHARS = int(os.environ.get("HISTORY_CACHE_MAX_CHARS", "50000000"))
+
+
+class SessionHistory(NamedTuple):
+    messages: tuple
+    summary: str
+    summarized_count: int
+
+
+def _history_chars(history: SessionHistory) -> int:
+    return len(history.summary) + sum(len(msg.content) for msg in history.messages)
+
+
+_history_cache = LRUCache(
+    maxsize=HISTORY_CACHE_SIZE,
+    ttl=HISTORY_CACHE_TTL,
+    weigher=_history_chars,
+    max_weight=HISTORY_CACHE_MAX_CHARS,
+)
+
+
+def to_langchain_message(role: str, content: str):
+    """Convert a stored chat message into a LangChain message, or None for unknown roles."""
+    if role == "user":
+        return HumanMessage(content=content)
+    elif role == "patient":
+        return AIMessage(content=content)
+    return None
+
+
+def get_cached_history(session_id: str):
+    """Return the cached history of a session, or None on a miss."""
+    return _history_cache.get(session_id)
+
+
+async def load_session_history(db: AsyncSession, session_id: str) -> SessionHistory:
+    """
+    Load the history of a session from the cache, falling back to the database.
+    Only messages that are not folded into the running summary are loaded.
+    """
+    history = _history_cache.get(session_id)
+    if history is not None:
+        return history
+
+    chat_summary = await db.get(ChatSummary, session_id)
+    summary = chat_summary.content if chat_summary else ""
+    summarized_count = chat_summary.message_count if chat_summary else 0
+
+    chat_history = (await db.execute(
+        select(ChatMessage).where(
+            ChatMessage.session_id == session_id
+        ).order_by(ChatMessage.timestamp.asc()).offset(summarized_count)
+    )).scalars().all()
+    messages = tuple(
+        msg for msg in (to_langchain_message(row.role, row.content) for row in chat_history) if msg
+    )
+
+    history = SessionHistory(messages, summary, summarized_count)
+    _history_cache.set(session_id, history)
+    return history
+
+
+def cache_empty_history(session_id: str) -> None:
+    """Cache the history of a newly created session."""
+    _history_cache.set(session_id, SessionHistory((), "", 0))
+
+
+def append_cached_message(session_id: str, role: str, content: str) -> None:
+    """Append a persisted message to the cached history, if the session is cached."""
+    history = _history_cache.get(session_id)
+    message = to_langchain_message(role, content)
+    if history is None or message is None:
+        return
+    _history_cache.set(session_id, history._replace(messages=history.messages + (message,)))
+
+
+def update_cached_summary(session_id: str, summary: str, summarized_count: int) -> None:
+    """Replace folded messages of the cached history by the persisted summary."""
+    history = _history_cache.get(session_id)
+    if history is None:
+        return
+    folded = summarized_count - history.summarized_count
+    _history_cache.set(session_id, SessionHistory(history.messages[folded:], summary, summarized_count))
+
+
+def invalidate_history(session_id: str) -> None:
+    """Drop the cached history of a session."""
+    _history_cache.pop(session_id)
+
+
+def history_cache_stats() -> dict:
+    """Return size, memory weight and eviction counters of the history cache."""
+    return _history_cache.stats()
@@ -0,0 +1,103 @@
+# Schema migrations for tables that already exist in the database.
+# New tables are created by create_all, changes to existing tables are applied here.
+# Each migration is recorded in schema_migrations, and its statements are idempotent
+# so an interrupted migration can be run again. Run manually: python -m app.db.migrations
+import asyncio
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Set up logging
+logger = logging.getLogger('migrations')
+
+
+def _to_timestamptz(table: str, column: str) -> str:
+    """Convert a UTC 'timestamp without time zone' column to timestamptz, once."""
+    return f"""
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = '{table}' AND column_name = '{column}'
+                AND data_type = 'timestamp without time zone'
+            ) THEN
+                ALTER TABLE {table} ALTER COLUMN "{column}" TYPE timestamptz USING "{column}" AT TIME ZONE 'UTC';
+            END IF;
+        END $$;
+    """
+
+
+def _fk_on_delete_cascade(table: str, column: str, ref_table: str, ref_column: str) -> list[str]:
+    """Recreate the foreign key of a column with ON DELETE CASCADE."""
+    constraint = f"{table}_{column}_fkey"
+    return [
+        f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {constraint}",
+        f"ALTER TABLE {table} ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) "
+        f"REFERENCES {ref_table} ({ref_column}) ON DELETE CASCADE",
+    ]
+
+
+# Ordered list of (version, statements)
+MIGRATIONS = [
+    ("0001_timestamptz", [
+        _to_timestamptz("chat_sessions", "created_at"),
+        _to_timestamptz("chat_messages", "timestamp"),
+        _to_timestamptz("chat_summaries", "updated_at"),
+    ]),
+    ("0002_chat_messages_session_timestamp_index", [
+        # Built concurrently so writes to chat_messages are not blocked on large tables
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chat_messages_session_id_timestamp "
+        "ON chat_messages (session_id, timestamp, id)",
+    ]),
+    ("0003_session_fk_on_delete_cascade", [
+        *_fk_on_delete_cascade("chat_messages", "session_id", "chat_sessions", "id"),
+        *_fk_on_delete_cascade("chat_summaries", "session_id", "chat_sessions", "id"),
+    ]),
+    ("0004_chat_messages_truncated", [
+        "ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS truncated BOOLEAN NOT NULL DEFAULT false",
+    ]),
+]
+
+
+async def run_migrations(engine: AsyncEngine) -> list[str]:
+    """Apply all pending migrations and return their versions."""
+    if engine.dialect.name != "postgresql":
+        # Other databases are only used for fresh schemas created by create_all
+        return []
+
+    applied = []
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR PRIMARY KEY, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        ))
+        done = set((await conn.execute(text("SELECT version FROM schema_migrations"))).scalars())
+
+        for version, statements in MIGRATIONS:
+            if version in done:
+                continue
+            logger.info("Applying migration %s", version)
+            for statement in statements:
+                await conn.execute(text(statement))
+            await conn.execute(
+                text("INSERT INTO schema_migrations (version) VALUES (:version)"),
+                {"version": version},
+            )
+            applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    from app.db.db import engine, init_db
+    from app.db import models  # noqa: F401 register tables
+
+    async def main():
+        await init_db()
+        applied = await run_migrations(engine)
+        print(f"Applied migrations: {', '.join(applied) or 'none'}")
+        await engine.dispose()
+
+    asyncio.run(main())
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Date, Float
+from sqlalchemy import Boolean, Column, Integer, String, Text, DateTime, ForeignKey, Date, Float, Index
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import false
 from app.db.db import Base
 import datetime
 
@@ -8,19 +9,47 @@ class ChatSession(Base):
 
     id = Column(String, primary_key=True, index=True)
     patient_file_id = Column(Integer, ForeignKey('patient_files.id'))
-    created_at = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
-    messages = relationship("ChatMessage", back_populates="session")
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan", passive_deletes=True)
+    summary = relationship("ChatSummary", back_populates="session", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+
+class ChatSummary(Base):
+    __tablename__ = "chat_summaries"
+
+    session_id = Column(String, ForeignKey('chat_sessions.id', ondelete="CASCADE"), primary_key=True)
+    content = Column(Text)
+    message_count = Column(Integer, default=0)
+    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    session = relationship("ChatSession", back_populates="summary")
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # History is always read per session in timestamp order
+        Index("ix_chat_messages_session_id_timestamp", "session_id", "timestamp", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String, ForeignKey('chat_sessions.id'))
+    session_id = Column(String, ForeignKey('chat_sessions.id', ondelete="CASCADE"))
     role = Column(String)
     content = Column(Text)
-    timestamp = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    timestamp = Column(DateTime(timezone=True), default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    # Reply cut off because the client disconnected
+    truncated = Column(Boolean, default=False, server_default=false(), nullable=False)
     session = relationship("ChatSession", back_populates="messages")
 
+class Evaluation(Base):
+    __tablename__ = "evaluations"
+    __table_args__ = (
+        Index("ix_evaluations_session_id_content_hash", "session_id", "content_hash", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String, ForeignKey('chat_sessions.id', ondelete="CASCADE"))
+    content_hash = Column(String(64))
+    content = Column(Text)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
 class PatientFile(Base):
     __tablename__ = "patient_files"
 
@@ -33,7 +62,9 @@ class PatientFile(Base):
     gender_identity = Column(String)
     gender_medical = Column(String)
     ethnic_origin = Column(String)
-    anamneses = relationship("Anamnesis", back_populates="patient_file")
+    # Ordered, so profiles and prompts are rendered the same way on every load
+    anamneses = relationship("Anamnesis", back_populates="patient_file", order_by="Anamnesis.id")
+    docs = relationship("AnamDoc", back_populates="patient_file", order_by="AnamDoc.id")
 
 class Anamnesis(Base):
     __tablename__ = "anamneses"
@@ -50,5 +81,5 @@ class AnamDoc(Base):
     file_path = Column(String)
     type = Column(String)
     patient_file_id = Column(Integer, ForeignKey("patient_files.id"))
-    patient_file = relationship("PatientFile", back_populates="anamneses")
+    patient_file = relationship("PatientFile", back_populates="docs")
     description = Column(Text)
@@ -0,0 +1,69 @@
+import os
+from typing import NamedTuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.db.models import PatientFile
+from chains.cache import LRUCache
+from chains.formatting import format_patient_details
+from chains.prompts import invalidate_prompt_cache
+
+# Formatted patient profiles keyed by patient_file_id
+PATIENT_PROFILE_TTL = float(os.environ.get("PATIENT_PROFILE_TTL", "300"))
+PATIENT_PROFILE_CACHE_SIZE = int(os.environ.get("PATIENT_PROFILE_CACHE_SIZE", "256"))
+_profile_cache = LRUCache(maxsize=PATIENT_PROFILE_CACHE_SIZE, ttl=PATIENT_PROFILE_TTL)
+
+
+class PatientProfile(NamedTuple):
+    patient_file_id: int
+    details: str
+    docs: list
+
+
+async def load_patient_profile(db: AsyncSession, patient_file_id: int):
+    """
+    Load the formatted profile of a patient file, or None if it does not exist.
+
+    The patient file, its anamneses and its docs are fetched with eager loading,
+    and the result is cached per patient_file_id for PATIENT_PROFILE_TTL seconds.
+    """
+    profile = _profile_cache.get(patient_file_id)
+    if profile is not None:
+        return profile
+
+    result = await db.execute(
+        select(PatientFile).options(
+            selectinload(PatientFile.anamneses),
+            selectinload(PatientFile.docs),
+        ).where(PatientFile.id == patient_file_id)
+    )
+    patient_file = result.scalars().first()
+    if not patient_file:
+        return None
+
+    # Copy docs into plain dicts so the cached profile does not depend on the session
+    docs = [
+        {"file_path": doc.file_path, "type": doc.type, "description": doc.description}
+        for doc in patient_file.docs
+    ]
+    profile = PatientProfile(patient_file_id, format_patient_details(patient_file), docs)
+    _profile_cache.set(patient_file_id, profile)
+    return profile
+
+
+def invalidate_patient_profile(patient_file_id: int = None) -> None:
+    """Drop the cached profile of a patient file (or all profiles) and its prompt templates."""
+    if patient_file_id is None:
+        _profile_cache.invalidate()
+        invalidate_prompt_cache()
+        return
+    profile = _profile_cache.pop(patient_file_id)
+    if profile is not None:
+        invalidate_prompt_cache(profile.details)
+
+
+def profile_cache_stats() -> dict:
+    """Return size and hit/miss counters of the patient profile cache."""
+    return _profile_cache.stats()
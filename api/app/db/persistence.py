@@ -0,0 +1,216 @@
+import asyncio
+import datetime
+import logging
+import os
+import time
+from collections import deque
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from app.db.db import SessionLocal
+from app.db.models import ChatMessage
+from app.metrics import COUNT_BUCKETS, gauge, histogram
+
+# Set up logging
+logger = logging.getLogger('persistence')
+
+# Store chat messages asynchronously in batches instead of one transaction per message
+MESSAGE_WRITE_BEHIND = os.environ.get("MESSAGE_WRITE_BEHIND", "false").lower() == "true"
+MESSAGE_FLUSH_INTERVAL_MS = float(os.environ.get("MESSAGE_FLUSH_INTERVAL_MS", "50"))
+MESSAGE_FLUSH_MAX_ROWS = int(os.environ.get("MESSAGE_FLUSH_MAX_ROWS", "100"))
+# Producers wait when this many messages are queued
+MESSAGE_QUEUE_MAX_SIZE = int(os.environ.get("MESSAGE_QUEUE_MAX_SIZE", "10000"))
+# Seconds to wait after a failed flush, and max. seconds to drain the queue on shutdown
+MESSAGE_FLUSH_RETRY_DELAY = float(os.environ.get("MESSAGE_FLUSH_RETRY_DELAY", "1"))
+MESSAGE_DRAIN_TIMEOUT = float(os.environ.get("MESSAGE_DRAIN_TIMEOUT", "30"))
+
+QUEUE_DEPTH = gauge("message_queue_depth", "Chat messages waiting to be stored")
+FLUSH_SECONDS = histogram("message_flush_seconds", "Duration of a batched message insert")
+FLUSH_ROWS = histogram("message_flush_rows", "Messages stored per batched insert", buckets=COUNT_BUCKETS)
+
+
+class MessageWriter:
+    """
+    Write-behind queue for chat messages.
+
+    Messages are stored by a single background task in multi-row INSERTs, flushed
+    every MESSAGE_FLUSH_INTERVAL_MS or as soon as MESSAGE_FLUSH_MAX_ROWS are queued.
+    Rows are inserted in queue order, so messages of a session keep their order.
+    """
+
+    def __init__(
+        self,
+        flush_interval_ms: float = MESSAGE_FLUSH_INTERVAL_MS,
+        max_rows: int = MESSAGE_FLUSH_MAX_ROWS,
+        max_queue: int = MESSAGE_QUEUE_MAX_SIZE,
+    ):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_rows = max_rows
+        self.max_queue = max_queue
+        self._rows = deque()
+        self._enqueued = 0
+        self._flushed = 0
+        # Sequence number of the latest queued message per session
+        self._session_seq = {}
+        self._condition = asyncio.Condition()
+        self._full = asyncio.Event()
+        self._closing = False
+        self._task = None
+        self.flushes = 0
+        self.errors = 0
+        self.dropped = 0
+
+    def start(self):
+        """Start the background flush task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = MESSAGE_DRAIN_TIMEOUT):
+        """Store all queued messages and stop the flush task."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._full.set()
+        async with self._condition:
+            self._condition.notify_all()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.error("Could not store %d queued messages before shutdown", len(self._rows))
+        self._task = None
+
+    async def put(self, session_id: str, role: str, content: str, truncated: bool = False):
+        """Queue a message, waits while the queue is full."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: len(self._rows) < self.max_queue)
+            self._rows.append({
+                "session_id": session_id,
+                "role": role,
+                "content": content,
+                "truncated": truncated,
+                # Timestamp of the turn, not of the flush
+                "timestamp": datetime.datetime.now(datetime.timezone.utc),
+            })
+            self._enqueued += 1
+            self._session_seq[session_id] = self._enqueued
+            QUEUE_DEPTH.set(len(self._rows))
+            if len(self._rows) >= self.max_rows:
+                self._full.set()
+            self._condition.notify_all()
+
+    async def wait_flushed(self, session_id: str):
+        """Wait until all queued messages of a session are stored."""
+        async with self._condition:
+            target = self._session_seq.get(session_id)
+            if target is not None:
+                await self._condition.wait_for(lambda: self._flushed >= target)
+
+    async def _run(self):
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self._rows or self._closing)
+                if not self._rows:
+                    return
+            # Collect more messages for up to one flush interval
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if not await self._flush():
+                await asyncio.sleep(MESSAGE_FLUSH_RETRY_DELAY)
+
+    async def _flush(self) -> bool:
+        """Store the oldest queued messages, returns False if the rest of them has to be retried."""
+        batch = [self._rows[index] for index in range(min(len(self._rows), self.max_rows))]
+        started = time.perf_counter()
+        try:
+            try:
+                async with SessionLocal() as db:
+                    await db.execute(insert(ChatMessage).values(batch))
+                    await db.commit()
+                await self._mark_stored(batch)
+            except IntegrityError:
+                # E.g. a session deleted while its messages were queued, store the others one by one
+                logger.warning("Batched insert of %d messages failed, storing them one by one", len(batch))
+                await self._insert_each(batch)
+        except Exception as e:
+            self.errors += 1
+            logger.error("Error storing %d queued messages: %s", len(batch), str(e))
+            return False
+        FLUSH_SECONDS.observe(time.perf_counter() - started)
+        FLUSH_ROWS.observe(len(batch))
+        self.flushes += 1
+        return True
+
+    async def _insert_each(self, batch: list):
+        # Each row leaves the queue once it is committed or dropped, so a retry after
+        # a failure (e.g. a lost connection) does not insert committed rows again
+        for row in batch:
+            try:
+                async with SessionLocal() as db:
+                    await db.execute(insert(ChatMessage).values(row))
+                    await db.commit()
+            except IntegrityError as e:
+                self.dropped += 1
+                logger.error("Dropping message of session %s: %s", row["session_id"], str(e))
+            await self._mark_stored([row])
+
+    async def _mark_stored(self, rows: list):
+        """Remove stored rows from the front of the queue and wake up waiting producers and readers."""
+        async with self._condition:
+            for _ in rows:
+                self._rows.popleft()
+            self._flushed += len(rows)
+            for session_id in {row["session_id"] for row in rows}:
+                if self._session_seq.get(session_id, 0) <= self._flushed:
+                    del self._session_seq[session_id]
+            QUEUE_DEPTH.set(len(self._rows))
+            # close() sets the event to drain the queue without waiting for the flush interval
+            if len(self._rows) < self.max_rows and not self._closing:
+                self._full.clear()
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        """Return queue depth and flush counters."""
+        return {
+            "queued": len(self._rows),
+            "flushed": self._flushed,
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "dropped": self.dropped,
+        }
+
+
+# Process-wide message writer, None if messages are stored on the request path
+message_writer = MessageWriter() if MESSAGE_WRITE_BEHIND else None
+
+
+async def save_message(session_id: str, role: str, content: str, truncated: bool = False, db=None):
+    """
+    Store a chat message, queued if write-behind is enabled.
+    Otherwise it is committed with the given session, or a new one.
+    """
+    if message_writer:
+        await message_writer.put(session_id, role, content, truncated)
+        return
+    if db is not None:
+        db.add(ChatMessage(session_id=session_id, role=role, content=content, truncated=truncated))
+        await db.commit()
+        return
+    async with SessionLocal() as db:
+        db.add(ChatMessage(session_id=session_id, role=role, content=content, truncated=truncated))
+        await db.commit()
+
+
+async def wait_for_session_writes(session_id: str):
+    """Wait until queued messages of a session are stored, before it is read from the database."""
+    if message_writer:
+        await message_writer.wait_flushed(session_id)
+
+
+def message_writer_stats() -> dict:
+    """Return write-behind queue statistics."""
+    if not message_writer:
+        return {"enabled": False}
+    return {"enabled": True, **message_writer.stats()}
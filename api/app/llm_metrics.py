@@ -0,0 +1,109 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+from app.metrics import COUNT_BUCKETS, counter, histogram
+
+UPSTREAM_SECONDS = histogram(
+    "llm_upstream_seconds",
+    "Duration of ChatAI calls until the last token",
+    ("model",),
+)
+UPSTREAM_FIRST_TOKEN_SECONDS = histogram(
+    "llm_upstream_first_token_seconds",
+    "Time until the first token of ChatAI calls",
+    ("model",),
+)
+UPSTREAM_TOKENS = histogram(
+    "llm_upstream_tokens",
+    "Streamed chunks per ChatAI call",
+    ("model",),
+    buckets=COUNT_BUCKETS,
+)
+UPSTREAM_ERRORS = counter(
+    "llm_upstream_errors",
+    "Failed ChatAI calls",
+    ("model", "condition", "talkativeness"),
+)
+UPSTREAM_CANCELLED = counter(
+    "llm_upstream_cancelled",
+    "ChatAI calls cancelled before they finished (disconnects, lost hedged requests)",
+    ("model",),
+)
+
+
+class _Call:
+    __slots__ = ("model", "condition", "talkativeness", "started", "tokens")
+
+    def __init__(self, model: str, condition: str, talkativeness: str):
+        self.model = model
+        self.condition = condition
+        self.talkativeness = talkativeness
+        self.started = time.perf_counter()
+        self.tokens = 0
+
+
+class UpstreamMetricsHandler(BaseCallbackHandler):
+    """
+    Records latency, tokens and errors of ChatAI calls from LangChain callbacks.
+    Wrapper models (routing, cassettes) are skipped, only calls of OpenAI clients are counted.
+    Condition and talkativeness are taken from the run metadata, where set.
+    """
+
+    # Called in the event loop, not in an executor thread
+    run_inline = True
+    # Only model runs are of interest, skip the callbacks of graph nodes and runnables
+    ignore_chain = True
+    ignore_retriever = True
+    ignore_agent = True
+
+    def __init__(self):
+        self._calls = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata: Optional[dict] = None, **kwargs):
+        metadata = metadata or {}
+        if metadata.get("ls_provider") != "openai":
+            return
+        self._calls[run_id] = _Call(
+            metadata.get("ls_model_name", ""),
+            metadata.get("condition", ""),
+            metadata.get("talkativeness", ""),
+        )
+
+    def on_llm_new_token(self, token: str, *, run_id, **kwargs):
+        call = self._calls.get(run_id)
+        if call is None or not token:
+            return
+        if not call.tokens:
+            UPSTREAM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - call.started, model=call.model)
+        call.tokens += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        call = self._calls.pop(run_id, None)
+        if call is None:
+            return
+        UPSTREAM_SECONDS.observe(time.perf_counter() - call.started, model=call.model)
+        if call.tokens:
+            UPSTREAM_TOKENS.observe(call.tokens, model=call.model)
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs):
+        call = self._calls.pop(run_id, None)
+        if call is None:
+            return
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            UPSTREAM_CANCELLED.inc(model=call.model)
+        else:
+            UPSTREAM_ERRORS.inc(model=call.model, condition=call.condition, talkativeness=call.talkativeness)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+upstream_metrics = UpstreamMetricsHandler()
+# A context variable with a default handler adds the handler to every LangChain run
+_upstream_metrics_var = ContextVar("upstream_metrics", default=upstream_metrics)
+register_configure_hook(_upstream_metrics_var, inheritable=True)
@@ -1,21 +1,78 @@
 # API entry point
+import time
+# Import time of the API, chain modules with LangGraph and ChatOpenAI are imported on first use or by the warm-up
+_import_started = time.perf_counter()
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.routers import chat
-from app.db.db import engine
+from app.routers import chat, health, metrics, stats
+from app.db.persistence import message_writer
 from app.db import models
+from app import llm_metrics  # noqa: F401 registers the upstream call metrics
+from chains.llm_pool import aclose_pool
+from chains.checkpointer import checkpointer, CHECKPOINT_PRUNE_INTERVAL
+from chains.observability import configure_logging
+from app.startup import WARMUP_ON_STARTUP, record_phase, setup_schema, warmup
+
+logger = logging.getLogger('uvicorn.error')
+# Log levels from LOG_LEVEL and LOG_LEVELS
+configure_logging()
+
+async def prune_checkpoints():
+    """Periodically drop old checkpoints and idle checkpoint threads"""
+    while True:
+        await asyncio.sleep(CHECKPOINT_PRUNE_INTERVAL)
+        try:
+            await checkpointer.prune()
+        except Exception as e:
+            logger.error("Error pruning checkpoints: %s", str(e))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    # Init database schema and migrate existing tables, retried while the database starts
+    await setup_schema()
+
+    # Open graph state storage
+    prune_task = None
+    if checkpointer:
+        await checkpointer.open()
+        prune_task = asyncio.create_task(prune_checkpoints())
+    # Start batched message writes
+    if message_writer:
+        message_writer.start()
+    record_phase("lifespan", time.perf_counter() - started)
+    warmup_task = asyncio.create_task(warmup()) if WARMUP_ON_STARTUP else None
+    yield
+    if warmup_task:
+        warmup_task.cancel()
+    # Store queued messages before connections are closed
+    if message_writer:
+        await message_writer.close()
+    if checkpointer:
+        prune_task.cancel()
+        await checkpointer.close()
+    # Release pooled upstream connections on shutdown
+    await aclose_pool()
 
 app = FastAPI(
     title="Symptex LangChain Server",
     version="1.0",
     description="API server for Symptex, a LangChain-based chat application for patient simulation",
+    lifespan=lifespan,
 )
 
 @app.get("/")
 def read_root():
     return {"message": "Hello, World!"}
 
-# Include chat router
+# Include chat, stats and readiness routers
 app.include_router(chat.router, prefix="/api/v1")
+app.include_router(stats.router, prefix="/api/v1")
+app.include_router(health.router, prefix="/api/v1")
+# Prometheus scrape endpoint
+app.include_router(metrics.router)
 
-# Init database schema
-models.Base.metadata.create_all(bind=engine)
+record_phase("import", time.perf_counter() - _import_started)
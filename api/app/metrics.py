@@ -0,0 +1,165 @@
+import threading
+
+# Default histogram buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+# Default histogram buckets for counts (tokens, chunks, ...)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class Metric:
+    """Base class of metrics with a fixed set of label names."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> dict:
+        """Return a copy of all values keyed by label values."""
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][index] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def mean(self, **labels):
+        """Return the mean of all observed values, or None if nothing was observed."""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry["sum"] / entry["count"] if entry and entry["count"] else None
+
+    def _copy(self, value):
+        return {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(cls, name: str, description: str, labelnames=(), **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, description, labelnames, **kwargs)
+        return metric
+
+
+def counter(name: str, description: str, labelnames=()) -> Counter:
+    """Get or create a counter."""
+    return _get_or_create(Counter, name, description, labelnames)
+
+
+def gauge(name: str, description: str, labelnames=()) -> Gauge:
+    """Get or create a gauge."""
+    return _get_or_create(Gauge, name, description, labelnames)
+
+
+def histogram(name: str, description: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    """Get or create a histogram."""
+    return _get_or_create(Histogram, name, description, labelnames, buckets=buckets)
+
+
+def metrics_snapshot() -> dict:
+    """Return all metrics with their values keyed by joined label values."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {
+        metric.name: {
+            ",".join(f"{name}={value}" for name, value in zip(metric.labelnames, key)): value
+            for key, value in metric.samples().items()
+        }
+        for metric in metrics
+    }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, key, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        # Counters get the conventional _total suffix
+        name = f"{metric.name}_total" if metric.kind == "counter" and not metric.name.endswith("_total") else metric.name
+        lines.append(f"# HELP {name} {_escape(metric.description)}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for key, value in sorted(metric.samples().items()):
+            if metric.kind != "histogram":
+                lines.append(f"{name}{_format_labels(metric.labelnames, key)} {_format_value(value)}")
+                continue
+            # Bucket counts are already cumulative
+            for bound, count in zip(metric.buckets, value["buckets"]):
+                labels = _format_labels(metric.labelnames, key, (("le", _format_value(float(bound))),))
+                lines.append(f"{name}_bucket{labels} {count}")
+            labels = _format_labels(metric.labelnames, key, (("le", "+Inf"),))
+            lines.append(f"{name}_bucket{labels} {value['count']}")
+            lines.append(f"{name}_sum{_format_labels(metric.labelnames, key)} {_format_value(value['sum'])}")
+            lines.append(f"{name}_count{_format_labels(metric.labelnames, key)} {value['count']}")
+    return "\n".join(lines) + "\n"
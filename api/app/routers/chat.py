@@ -1,20 +1,135 @@
-from fastapi import (APIRouter, Depends)
+from fastapi import (APIRouter, Depends, Query, Request)
 from fastapi.responses import StreamingResponse, PlainTextResponse
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import AIMessage, HumanMessage
 from pydantic import BaseModel
+from sse_starlette.sse import EventSourceResponse
+import asyncio
 import logging
-from typing import AsyncGenerator
-from chains.chat_chain import symptex_model
-from chains.eval_chain import eval_history
-from chains.formatting import format_patient_details
+import datetime
+import hashlib
+import json
+import time
+from typing import AsyncGenerator, Awaitable, Callable, NamedTuple, Optional
+from chains.checkpointer import checkpointer
+from chains.llm_pool import upstream_connect_times
+from chains.prompts import CONDITIONS, TALKATIVENESS_LEVELS
+from chains.observability import sample_trace, tracing_enabled, tracing_scope, truncate
 
-from app.db.db import get_db
-from sqlalchemy.orm import Session
-from app.db.models import ChatSession, ChatMessage, PatientFile, AnamDoc
+from app.db.db import get_db, SessionLocal
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.models import ChatSession, ChatMessage, ChatSummary, Evaluation
+from app.metrics import COUNT_BUCKETS, counter, histogram
+from app.streaming import (
+    SSE_HEARTBEAT_INTERVAL,
+    ResponseBuffer,
+    ThinkTagFilter,
+    cancel_on_disconnect,
+    coalesce_chunks,
+    filter_think_tags,
+    get_response_buffer,
+    start_response_buffer,
+)
+from app.admission import ALLOWED_MODELS, AdmissionRejected, get_model_limiter
+from app.timing import PromptTimingHandler, RequestTimer
+from app.db.persistence import save_message, wait_for_session_writes
+from app.db.patient_profiles import load_patient_profile, invalidate_patient_profile
+from app.db.history_cache import (
+    append_cached_message,
+    cache_empty_history,
+    get_cached_history,
+    invalidate_history,
+    load_session_history,
+    to_langchain_message,
+    update_cached_summary,
+)
 
 # Set up logging
-logger = logging.getLogger('uvicorn.error')
-logger.setLevel(logging.DEBUG)
+logger = logging.getLogger('chat')
+
+# Streaming metrics
+FIRST_TOKEN_SECONDS = histogram(
+    "chat_time_to_first_token_seconds",
+    "Time until the first token from the model, including hidden thinking",
+    ("model",),
+)
+FIRST_VISIBLE_TOKEN_SECONDS = histogram(
+    "chat_time_to_first_visible_token_seconds",
+    "Time until the first token sent to the client",
+    ("model",),
+)
+RESPONSE_TOKENS = histogram(
+    "chat_response_tokens",
+    "Tokens streamed by the model per response",
+    ("model",),
+    buckets=COUNT_BUCKETS,
+)
+ANSWER_TOKENS = histogram(
+    "chat_answer_tokens",
+    "Tokens per patient answer by talkativeness and condition",
+    ("talkativeness", "condition"),
+    buckets=COUNT_BUCKETS,
+)
+ANSWERS_AT_BUDGET = counter(
+    "chat_answers_at_budget",
+    "Patient answers cut off at their max. token budget",
+    ("talkativeness", "condition"),
+)
+PROMPT_TOKENS = counter(
+    "chat_prompt_tokens",
+    "Prompt tokens of patient answers, as reported by the backend",
+    ("model",),
+)
+CACHED_PROMPT_TOKENS = counter(
+    "chat_cached_prompt_tokens",
+    "Prompt tokens of patient answers served from the backend's prefix cache",
+    ("model",),
+)
+RESPONSE_CHUNKS = histogram(
+    "chat_response_chunks",
+    "Chunks written to the client per response after coalescing",
+    ("model",),
+    buckets=COUNT_BUCKETS,
+)
+CANCELLED_RESPONSES = counter(
+    "chat_cancelled_responses",
+    "Responses cancelled because the client disconnected",
+    ("model",),
+)
+CANCELLED_TOKENS_SAVED = counter(
+    "chat_cancelled_tokens_saved",
+    "Estimated tokens not generated because of cancelled responses",
+    ("model",),
+)
+STREAM_SECONDS = histogram(
+    "chat_stream_seconds",
+    "Duration of streamed patient answers until the last token",
+    ("model",),
+)
+CHAT_ERRORS = counter(
+    "chat_errors",
+    "Chat turns that failed while streaming",
+    ("model", "condition", "talkativeness"),
+)
+EVAL_SECONDS = histogram(
+    "eval_seconds",
+    "Duration of streamed session evaluations",
+)
+EVAL_ERRORS = counter(
+    "eval_errors",
+    "Session evaluations that failed",
+)
+TRACE_DECISIONS = counter(
+    "trace_sampling_decisions",
+    "Requests traced to LangSmith or skipped by head-based sampling",
+    ("endpoint", "sampled"),
+)
+HIDDEN_TOKENS = histogram(
+    "chat_hidden_tokens",
+    "Tokens per response hidden in think blocks",
+    ("model",),
+    buckets=COUNT_BUCKETS,
+)
 
 router = APIRouter()
 
@@ -32,127 +147,393 @@ class ChatRequest(BaseModel):
 class RateRequest(BaseModel):
     messages: list
 
-# Chat endpoint
-@router.post("/chat")
-async def chat_with_llm(request: ChatRequest, db: Session = Depends(get_db)):
-    """Endpoint to chat with the LLM"""
-    logger.debug("Received chat request: %s", request)
-   
+# Message history response schemas
+class HistoryMessage(BaseModel):
+    id: int
+    role: str
+    content: str
+    timestamp: datetime.datetime
+    truncated: bool = False
+
+class MessagePage(BaseModel):
+    session_id: str
+    messages: list[HistoryMessage]
+    next_after_timestamp: Optional[datetime.datetime] = None
+    next_after_id: Optional[int] = None
+
+# Prepared chat turn, the user message is already stored
+class ChatTurn(NamedTuple):
+    request: ChatRequest
+    patient_details: str
+    patient_doc_md: list
+    previous_messages: list
+    summary: str
+    summarized_count: int
+    # Model slot held until the response is generated
+    slot: object
+    # Phase durations, the phases of prepare_turn go into the Server-Timing header
+    timer: RequestTimer
+
+async def prepare_turn(request: ChatRequest, db: AsyncSession):
+    """Validate a chat request, wait for a model slot, load profile and history and store the user message.
+    Returns a ChatTurn, or an error response. The slot is released by generate_turn, or by
+    release_turn if the response ends before generate_turn starts."""
     # Validate message, condition and talkativeness first
     if not request.message:
         logger.error("Empty message received")
-        raise PlainTextResponse("Message cannot be empty", status_code=400)
-    if request.model not in ["gemma-3-27b-it", "llama-3.3-70b-instruct", "llama-3.1-sauerkrautlm-70b-instruct", "qwq-32b", "mistral-large-instruct", "qwen3-235b-a22b"]:
+        return PlainTextResponse("Message cannot be empty", status_code=400)
+    if request.model not in ALLOWED_MODELS:
         logger.error("Invalid model: %s", request.model)
-        raise PlainTextResponse(f"Invalid model: {request.model}", status_code=400)
-    if request.condition not in ["default", "alzheimer", "schwerhörig", "verdrängung"]:
+        return PlainTextResponse(f"Invalid model: {request.model}", status_code=400)
+    if request.condition not in CONDITIONS:
         logger.error("Invalid condition: %s", request.condition)
-        raise PlainTextResponse(f"Invalid condition: {request.condition}", status_code=400)
-    if request.talkativeness not in ["kurz angebunden", "ausgewogen", "ausschweifend"]:
+        return PlainTextResponse(f"Invalid condition: {request.condition}", status_code=400)
+    if request.talkativeness not in TALKATIVENESS_LEVELS:
         logger.error("Invalid talkativeness: %s", request.talkativeness)
-        raise PlainTextResponse(f"Invalid talkativeness: {request.talkativeness}", status_code=400)
+        return PlainTextResponse(f"Invalid talkativeness: {request.talkativeness}", status_code=400)
+    timer = RequestTimer("chat", request.session_id, request.model)
     
-    # Get patient profile from database
-    patient_file = db.query(PatientFile).filter(PatientFile.id == request.patient_file_id).first()
-    if not patient_file:
+    # Get patient profile (details and docs) from cache or database
+    with timer.phase("profile"):
+        patient_profile = await load_patient_profile(db, request.patient_file_id)
+    if not patient_profile:
         return PlainTextResponse("Patient not found", status_code=404)
-    patient_details = format_patient_details(patient_file)
-
-    patient_doc_md = db.query(AnamDoc).filter(AnamDoc.patient_file_id == patient_file.id).all()
     #todo format patient docs update prompt, check that the LLM is aware of the new context
     
-    # Create or get chat session
-    session = db.query(ChatSession).filter(
-        ChatSession.id == request.session_id
-    ).first()
-    if not session:
-        session = ChatSession(
-            id=request.session_id,
-            patient_file_id=request.patient_file_id
+    # Wait for a free slot of the model, fail fast if too many turns are waiting
+    limiter = get_model_limiter(request.model)
+    try:
+        with timer.phase("admission"):
+            slot = await limiter.acquire()
+    except AdmissionRejected as e:
+        logger.warning("Rejected chat request: %s", str(e))
+        return PlainTextResponse(
+            f"Model {request.model} is busy, please retry later",
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)}
         )
-        db.add(session)
-        db.commit()
-        db.refresh(session)
-
-     # Get previous messages from database
-    previous_messages = []
-    chat_history = db.query(ChatMessage).filter(
-        ChatMessage.session_id == session.id
-    ).order_by(ChatMessage.timestamp.asc()).all()
-    
-    for msg in chat_history:
-        if msg.role == "user":
-            previous_messages.append(HumanMessage(content=msg.content))
-        elif msg.role == "patient":
-            previous_messages.append(AIMessage(content=msg.content))
-
-
-    # Store message
-    message = ChatMessage(
-        session_id=session.id,
-        role="user",
-        content=request.message
+
+    try:
+        # Get history from cache, a cached session is known to exist
+        with timer.phase("history"):
+            history = get_cached_history(request.session_id)
+            if history is None:
+                # Create or get chat session
+                session = await db.get(ChatSession, request.session_id)
+                if not session:
+                    session = ChatSession(
+                        id=request.session_id,
+                        patient_file_id=request.patient_file_id
+                    )
+                    db.add(session)
+                    await db.commit()
+                    cache_empty_history(session.id)
+
+                # Get previous messages and running summary of older turns
+                await wait_for_session_writes(session.id)
+                history = await load_session_history(db, session.id)
+
+        # Store message, write through to the history cache
+        with timer.phase("persist"):
+            await save_message(request.session_id, "user", request.message, db=db)
+            append_cached_message(request.session_id, "user", request.message)
+    except BaseException:
+        limiter.release(slot)
+        raise
+
+    return ChatTurn(
+        request=request,
+        patient_details=patient_profile.details,
+        patient_doc_md=patient_profile.docs,
+        previous_messages=list(history.messages),
+        summary=history.summary,
+        summarized_count=history.summarized_count,
+        slot=slot,
+        timer=timer,
     )
-    db.add(message)
-    db.commit()
+
+def release_turn(turn: ChatTurn):
+    """Free the model slot of a turn, releasing it again has no effect."""
+    get_model_limiter(turn.request.model).release(turn.slot)
+
+class TurnStreamingResponse(StreamingResponse):
+    """
+    Streaming response that frees the model slot of its turn however the response ends.
+    If the client is already gone, the body iterator may be cancelled before generate_turn
+    starts, and the finally block of generate_turn never runs.
+    """
+
+    def __init__(self, content, turn: ChatTurn, **kwargs):
+        super().__init__(content, **kwargs)
+        self.turn = turn
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            release_turn(self.turn)
+
+async def store_reply(session_id: str, content: str, summary_update: Optional[tuple] = None, truncated: bool = False):
+    """Store the patient reply and the updated summary, and write both through to the history cache."""
+    # Store the updated summary of older turns
+    if summary_update:
+        async with SessionLocal() as db:
+            await db.merge(ChatSummary(
+                session_id=session_id,
+                content=summary_update[0],
+                message_count=summary_update[1],
+                updated_at=datetime.datetime.now(datetime.timezone.utc)
+            ))
+            await db.commit()
+    await save_message(session_id, "patient", content, truncated)
+
+    # Write through to the history cache
+    if summary_update:
+        update_cached_summary(session_id, *summary_update)
+    append_cached_message(session_id, "patient", content)
+
+async def generate_turn(turn: ChatTurn, stream_stats: Optional[dict] = None) -> AsyncGenerator[str, None]:
+    """Stream the patient response of a prepared turn and store it afterwards.
+    Uses its own database session, so it may outlive the request.
+    If the stream is cancelled, the partial response is stored as truncated.
+    The phases of the turn are logged when it is done."""
+    request = turn.request
+    stream_stats = {} if stream_stats is None else stream_stats
+    chunks = []
+    summary_update = None
+    cancelled = False
+
+    async def store_summary(new_summary: str, new_summarized_count: int):
+        nonlocal summary_update
+        summary_update = (new_summary, new_summarized_count)
 
     try:
-        llm_response = ""
+        try:
+            # Merge single tokens into fewer writes to the client
+            async for chunk in coalesce_chunks(stream_response(
+                message=request.message,
+                model=request.model,
+                condition=request.condition,
+                talkativeness=request.talkativeness,
+                patient_details=turn.patient_details,
+                patient_doc_md=turn.patient_doc_md,
+                session_id=request.session_id,
+                previous_messages=turn.previous_messages,
+                summary=turn.summary,
+                summarized_count=turn.summarized_count,
+                on_summary=store_summary,
+                stream_stats=stream_stats,
+                timer=turn.timer
+            )):
+                chunks.append(chunk)
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            # The upstream generation was aborted together with the stream
+            cancelled = True
+            partial_response = "".join(chunks)
+            record_cancelled_response(request.model, stream_stats.get("tokens", 0))
+            logger.info("Stream of session %s cancelled after %d chars", request.session_id, len(partial_response))
+            if partial_response:
+                with turn.timer.phase("persist"):
+                    await store_reply(request.session_id, partial_response, summary_update, truncated=True)
+                await checkpoint_partial_reply(request.session_id, partial_response)
+            raise
 
-        # Stream response and store LLM message
-        async def generate_and_store():
-            nonlocal llm_response
-            try:
-                messages = previous_messages + [HumanMessage(content=request.message)]
-                async for chunk in stream_response(
-                    message=request.message,
-                    model=request.model,
-                    condition=request.condition,
-                    talkativeness=request.talkativeness,
-                    patient_details=patient_details,
-                    patient_doc_md = patient_doc_md,
-                    session_id=request.session_id,
-                    previous_messages=messages
-                ):
-                    llm_response += chunk
-                    yield chunk
-                
-                # After streaming is complete, store LLM message
-                llm_message = ChatMessage(
-                    session_id=session.id,
-                    role="patient",
-                    content=llm_response
-                )
-                db.add(llm_message)
-                db.commit()
-            finally:
-                db.close()
+        llm_response = "".join(chunks)
+        RESPONSE_CHUNKS.observe(len(chunks), model=request.model)
 
-        return StreamingResponse(
-            generate_and_store(), 
-            media_type="text/plain"
+        # After streaming is complete, store LLM message
+        with turn.timer.phase("persist"):
+            await store_reply(request.session_id, llm_response, summary_update)
+    finally:
+        # Free the model slot taken by prepare_turn
+        release_turn(turn)
+        # Trailing summary of the phases, the header only carries the phases before streaming
+        record = turn.timer.finish(tokens=stream_stats.get("tokens", 0), cancelled=cancelled)
+        stream_stats["phases_ms"] = record["phases_ms"]
+
+def record_cancelled_response(model: str, streamed_tokens: int):
+    """Count a cancelled response and estimate the tokens it saved from the mean response length."""
+    CANCELLED_RESPONSES.inc(model=model)
+    mean_tokens = RESPONSE_TOKENS.mean(model=model)
+    if mean_tokens is not None:
+        CANCELLED_TOKENS_SAVED.inc(max(mean_tokens - streamed_tokens, 0), model=model)
+
+def get_eval_chain():
+    """chains.eval_chain (prompts, rating client) is imported on the first evaluation."""
+    from chains import eval_chain
+
+    return eval_chain
+
+def get_symptex_model():
+    """The compiled patient graph, chains.chat_chain (LangGraph, ChatOpenAI) is imported on first use."""
+    from chains.chat_chain import symptex_model
+
+    return symptex_model
+
+async def checkpoint_partial_reply(session_id: str, content: str):
+    """Add a partial reply to the checkpointed graph state, so it matches the stored history."""
+    if not checkpointer:
+        return
+    symptex_model = get_symptex_model()
+    config = {"configurable": {"thread_id": session_id}}
+    state = await symptex_model.aget_state(config)
+    messages = state.values.get("messages")
+    if messages and isinstance(messages[-1], HumanMessage):
+        await symptex_model.aupdate_state(config, {"messages": [AIMessage(content)]}, as_node="patient_model")
+
+# Chat endpoint
+@router.post("/chat")
+async def chat_with_llm(request: ChatRequest, http_request: Request, db: AsyncSession = Depends(get_db)):
+    """Endpoint to chat with the LLM"""
+    logger.debug("Received chat request for session %s, model %s: %s", request.session_id, request.model, truncate(request.message))
+
+    turn = await prepare_turn(request, db)
+    if not isinstance(turn, ChatTurn):
+        return turn
+
+    try:
+        # Stream response and store LLM message, generation stops when the client disconnects
+        return TurnStreamingResponse(
+            cancel_on_disconnect(generate_turn(turn), http_request.is_disconnected),
+            turn,
+            media_type="text/plain",
+            headers={"Server-Timing": turn.timer.server_timing()}
         )
     except Exception as e:
         logger.error("Error in chat_with_llm endpoint: %s", str(e))
+        release_turn(turn)
         return PlainTextResponse("Internal server error", status_code=500)
+
+# Server-sent events chat endpoint
+@router.post("/chat/stream")
+async def chat_with_llm_sse(request: ChatRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Endpoint to chat with the LLM over server-sent events.
+    Frames carry sequence numbers as event ids. The response is generated into a
+    per-session buffer, so a client can resume it with GET /chat/stream/{session_id}.
+    """
+    logger.debug("Received SSE chat request for session %s, model %s: %s", request.session_id, request.model, truncate(request.message))
+
+    turn = await prepare_turn(request, db)
+    if not isinstance(turn, ChatTurn):
+        return turn
+
+    buffer = start_response_buffer(request.session_id)
+
+    async def generate_into_buffer():
+        stream_stats = {}
+        try:
+            async for chunk in generate_turn(turn, stream_stats):
+                await buffer.append(chunk)
+            await buffer.finish(stream_stats)
+        except asyncio.CancelledError:
+            # Replaced by a newer turn, followers of this buffer get an error frame
+            await buffer.finish(stream_stats, error="Replaced by a newer response")
+            raise
+        except Exception as e:
+            logger.error("Error in SSE chat stream: %s", str(e))
+            await buffer.finish(stream_stats, error=str(e))
+
+    # Generation continues if the client disconnects, it can resume from the buffer
+    buffer.task = asyncio.create_task(generate_into_buffer())
+    # The task is cancelled when a newer turn of the session replaces the buffer, possibly before generate_turn starts
+    buffer.task.add_done_callback(lambda task: release_turn(turn))
+    return EventSourceResponse(
+        sse_frames(buffer),
+        ping=SSE_HEARTBEAT_INTERVAL,
+        headers={"Server-Timing": turn.timer.server_timing()}
+    )
+
+# Resume server-sent events chat endpoint
+@router.get("/chat/stream/{session_id}")
+async def resume_chat_sse(session_id: str, http_request: Request, after: Optional[int] = None):
+    """Resume the latest response of a session after the sequence number in Last-Event-ID"""
+    buffer = get_response_buffer(session_id)
+    if not buffer:
+        return PlainTextResponse("No response to resume", status_code=404)
+    if after is None:
+        try:
+            after = int(http_request.headers.get("last-event-id", "0"))
+        except ValueError:
+            return PlainTextResponse("Invalid Last-Event-ID", status_code=400)
+    return EventSourceResponse(sse_frames(buffer, after), ping=SSE_HEARTBEAT_INTERVAL)
+
+async def sse_frames(buffer: ResponseBuffer, after: int = 0):
+    """Server-sent event frames of a response buffer: tokens followed by a final frame"""
+    async for seq, text in buffer.follow(after):
+        yield {"event": "token", "id": str(seq), "data": json.dumps({"seq": seq, "text": text}, ensure_ascii=False)}
+    event = "error" if buffer.error else "done"
+    yield {"event": event, "id": str(len(buffer.chunks)), "data": json.dumps(buffer.summary(), ensure_ascii=False)}
     
+# Message history endpoint
+@router.get("/sessions/{session_id}/messages", response_model=MessagePage)
+async def get_session_messages(
+    session_id: str,
+    after_timestamp: Optional[datetime.datetime] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Page through the messages of a session in chronological order.
+    Pass next_after_timestamp and next_after_id of a page to get the following page.
+    """
+    if (after_timestamp is None) != (after_id is None):
+        return PlainTextResponse("after_timestamp and after_id must be given together", status_code=400)
+    await wait_for_session_writes(session_id)
+    if not await db.get(ChatSession, session_id):
+        return PlainTextResponse("Session not found", status_code=404)
+
+    # Keyset pagination on (timestamp, id), served by ix_chat_messages_session_id_timestamp
+    query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+    if after_timestamp is not None:
+        if after_timestamp.tzinfo is None:
+            after_timestamp = after_timestamp.replace(tzinfo=datetime.timezone.utc)
+        query = query.where(
+            tuple_(ChatMessage.timestamp, ChatMessage.id) > tuple_(after_timestamp, after_id)
+        )
+    query = query.order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc()).limit(limit)
+    rows = (await db.execute(query)).scalars().all()
+
+    page = MessagePage(
+        session_id=session_id,
+        messages=[
+            HistoryMessage(id=row.id, role=row.role, content=row.content, timestamp=row.timestamp, truncated=bool(row.truncated))
+            for row in rows
+        ]
+    )
+    # A full page may be followed by more messages
+    if len(rows) == limit:
+        page.next_after_timestamp = rows[-1].timestamp
+        page.next_after_id = rows[-1].id
+    return page
+
 # Reset endpoint
 @router.post("/reset/{session_id}")
-async def reset_memory(session_id: str, db: Session = Depends(get_db)):
+async def reset_memory(session_id: str, db: AsyncSession = Depends(get_db)):
     """Reset the LangChain memory for a specific session"""
     try:
-        # Delete messages from db
-        db.query(ChatMessage).filter(ChatMessage.session_id == session_id).delete()
-        # Delete the session itself
-        db.query(ChatSession).filter(ChatSession.id == session_id).delete()
-        db.commit()
+        # Drop cached history and checkpointed graph state
+        invalidate_history(session_id)
+        await wait_for_session_writes(session_id)
+        if checkpointer:
+            await checkpointer.adelete_thread(session_id)
+        # Delete the session, its messages and summary are deleted by ON DELETE CASCADE
+        await db.execute(delete(ChatSession).where(ChatSession.id == session_id))
+        await db.commit()
         return PlainTextResponse(f"Chat data deleted for session {session_id}", status_code=200)
     except Exception as e:
         logger.error(f"Error deleting session {session_id}: {str(e)}")
-        db.rollback()
+        await db.rollback()
         return PlainTextResponse("Error deleting session", status_code=500)
-    finally:
-        db.close()
+    
+# Patient profile invalidation endpoint
+@router.post("/patient-files/{patient_file_id}/invalidate")
+async def invalidate_patient_file(patient_file_id: int):
+    """Drop the cached profile and prompts of a patient file after it was changed"""
+    invalidate_patient_profile(patient_file_id)
+    return PlainTextResponse(f"Cache invalidated for patient file {patient_file_id}", status_code=200)
     
 # Evaluation endpoint
 @router.post("/eval")
@@ -160,32 +541,132 @@ async def eval_chat(request: RateRequest):
     # Convert frontend messages to LangChain messages
     from langchain_core.messages import HumanMessage, AIMessage
 
+    eval_chain = get_eval_chain()
+    timer = RequestTimer("eval", model=eval_chain.RATING_MODEL)
+
     async def generate_eval():
         try:
-            lc_messages = []
-            for msg in request.messages:
-                if msg["role"] == "user":
-                    lc_messages.append(HumanMessage(content=msg["output"]))
-                elif msg["role"] == "patient":
-                    lc_messages.append(AIMessage(content=msg["output"]))
-
-            # Stream evaluation chunks
-            async for chunk in eval_history(lc_messages):
+            # Stream evaluation chunks without think blocks
+            started = time.perf_counter()
+            async for chunk in timed_eval_stream(filter_think_tags(eval_chain.eval_history(lc_messages)), timer):
                 yield chunk
+            EVAL_SECONDS.observe(time.perf_counter() - started)
             
         except Exception as e:
             logger.error(f"Error generating evaluation: {str(e)}")
+            EVAL_ERRORS.inc()
             yield f"Entschuldigung, es ist ein Fehler aufgetreten: {str(e)}"
+        finally:
+            timer.finish()
 
     try:
+        with timer.phase("transcript"):
+            lc_messages = []
+            for msg in request.messages:
+                if msg["role"] == "user":
+                    lc_messages.append(HumanMessage(content=msg["output"]))
+                elif msg["role"] == "patient":
+                    lc_messages.append(AIMessage(content=msg["output"]))
+
         return StreamingResponse(
             generate_eval(),
-            media_type="text/plain"
+            media_type="text/plain",
+            headers={"Server-Timing": timer.server_timing()}
         )
     except Exception as e:
         logger.error(f"Error rating chat: {str(e)}")
         return PlainTextResponse("Error rating chat", status_code=500)
 
+async def timed_eval_stream(chunks: AsyncGenerator[str, None], timer: RequestTimer) -> AsyncGenerator[str, None]:
+    """Pass on evaluation chunks, traced if sampled, adding the first token and stream phases to the timer"""
+    started = time.perf_counter()
+    first_chunk = True
+    sampled = sample_trace()
+    if tracing_enabled():
+        TRACE_DECISIONS.inc(endpoint="eval", sampled=str(sampled).lower())
+    try:
+        with tracing_scope(sampled):
+            async for chunk in chunks:
+                if first_chunk:
+                    first_chunk = False
+                    timer.add("first_token", time.perf_counter() - started)
+                yield chunk
+    finally:
+        timer.add("stream", time.perf_counter() - started)
+
+# Session evaluation endpoint
+@router.post("/eval/{session_id}")
+async def eval_session(session_id: str, db: AsyncSession = Depends(get_db)):
+    """Evaluate a stored chat session, reusing the stored evaluation of an unchanged transcript"""
+    eval_chain = get_eval_chain()
+    timer = RequestTimer("eval", session_id, eval_chain.RATING_MODEL)
+    with timer.phase("transcript"):
+        await wait_for_session_writes(session_id)
+        if not await db.get(ChatSession, session_id):
+            return PlainTextResponse("Session not found", status_code=404)
+
+        # Read the full transcript, including turns folded into the running summary
+        rows = (await db.execute(
+            select(ChatMessage.role, ChatMessage.content).where(
+                ChatMessage.session_id == session_id
+            ).order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+        )).all()
+    lc_messages = [msg for msg in (to_langchain_message(role, content) for role, content in rows) if msg]
+    if not lc_messages:
+        return PlainTextResponse("Session has no messages to evaluate", status_code=400)
+    content_hash = transcript_hash(rows, eval_chain.EVAL_VERSION)
+
+    # Serve the stored evaluation if the transcript did not change
+    with timer.phase("cache"):
+        stored = (await db.execute(
+            select(Evaluation).where(
+                Evaluation.session_id == session_id,
+                Evaluation.content_hash == content_hash
+            )
+        )).scalars().first()
+    if stored:
+        timer.finish(cache="hit")
+        return PlainTextResponse(stored.content, headers={"X-Evaluation-Cache": "hit", "Server-Timing": timer.server_timing()})
+
+    async def generate_and_store_eval():
+        chunks = []
+        started = time.perf_counter()
+        try:
+            try:
+                async for chunk in timed_eval_stream(filter_think_tags(eval_chain.stream_evaluation(lc_messages)), timer):
+                    chunks.append(chunk)
+                    yield chunk
+                EVAL_SECONDS.observe(time.perf_counter() - started)
+            except Exception as e:
+                logger.error(f"Error generating evaluation: {str(e)}")
+                EVAL_ERRORS.inc()
+                yield f"Entschuldigung, es ist ein Fehler aufgetreten: {str(e)}"
+                return
+
+            # Store the complete evaluation only
+            with timer.phase("persist"):
+                try:
+                    db.add(Evaluation(session_id=session_id, content_hash=content_hash, content="".join(chunks)))
+                    await db.commit()
+                except Exception as e:
+                    # E.g. a concurrent request stored the same evaluation
+                    logger.error(f"Error storing evaluation for session {session_id}: {str(e)}")
+                    await db.rollback()
+        finally:
+            timer.finish(cache="miss")
+
+    return StreamingResponse(
+        generate_and_store_eval(),
+        media_type="text/plain",
+        headers={"X-Evaluation-Cache": "miss", "Server-Timing": timer.server_timing()}
+    )
+
+def transcript_hash(rows, version: str) -> str:
+    """Hash of the evaluation version and the (role, content) pairs of a transcript"""
+    transcript = [[role, content] for role, content in rows if role in ("user", "patient")]
+    payload = json.dumps({"version": version, "messages": transcript}, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 
 async def stream_response(
     message: str, 
@@ -195,7 +676,12 @@ async def stream_response(
     patient_details: str,
     patient_doc_md: str,
     session_id: str,
-    previous_messages: list
+    previous_messages: list,
+    summary: str = "",
+    summarized_count: int = 0,
+    on_summary: Optional[Callable[[str, int], Awaitable[None]]] = None,
+    stream_stats: Optional[dict] = None,
+    timer: Optional[RequestTimer] = None
 ) -> AsyncGenerator[str, None]:
     """
     Stream responses from the symptex_model.
@@ -207,29 +693,126 @@ async def stream_response(
         talkativeness (str): The level of talkativeness for the response.
         patient_details (str): Details about the patient.
         session_id (str): The ID of the chat session.
-        previous_messages (list): A list of previous messages in the chat.
+        previous_messages (list): A list of previous messages in the chat, only used if no
+            checkpointed state exists for the session.
+        summary (str): The running summary of turns not contained in previous_messages.
+        summarized_count (int): The number of messages folded into the summary.
+        on_summary (callable): Called with the new summary and count when older turns were summarized.
+        stream_stats (dict): Filled with timings and token counts of the response, if given.
+        timer (RequestTimer): Gets the prompt, upstream connect, first token and stream phases, if given.
 
     Returns:
         str: The response message from the LLM.
     """
-    logger.debug("Starting to stream response for message: %s", message)
+    logger.debug("Starting to stream response for message: %s", truncate(message))
 
+    started = time.perf_counter()
+    first_token_seen = False
+    first_visible_seen = False
+    token_count = 0
+    hit_budget = False
+    prompt_tokens = 0
+    cached_prompt_tokens = 0
+    think_filter = ThinkTagFilter()
     try:
-        async for msg, metadata in symptex_model.astream(
-            {
-                "messages": previous_messages + [HumanMessage(message)],
-                "model": model,
-                "condition": condition,
-                "talkativeness": talkativeness,
-                "patient_details": patient_details,
-                "patient_doc_md": patient_doc_md,
-            },
-            stream_mode="messages"
-        ):
-            # Get AIMessageChunks only
-            if msg.content and not isinstance(msg, HumanMessage):
-                # logger.debug(msg.content)
-                yield msg.content
+        graph_input = {
+            "model": model,
+            "condition": condition,
+            "talkativeness": talkativeness,
+            "patient_details": patient_details,
+            "patient_doc_md": patient_doc_md,
+        }
+        # Condition and talkativeness label the upstream call metrics
+        config = {
+            "configurable": {"thread_id": session_id},
+            "metadata": {"condition": condition, "talkativeness": talkativeness},
+        }
+        if timer is not None:
+            config["callbacks"] = [PromptTimingHandler(timer)]
+            upstream_connect_times.set(timer.upstream_connects)
+        symptex_model = get_symptex_model()
+        if checkpointer and (await symptex_model.aget_state(config)).values.get("messages"):
+            # The checkpointed graph state already holds the history
+            graph_input["messages"] = [HumanMessage(message)]
+        else:
+            # Rebuild the history, or seed a new checkpoint thread with it
+            graph_input["messages"] = previous_messages + [HumanMessage(message)]
+            graph_input["summary"] = summary
+            graph_input["summarized_count"] = summarized_count
+
+        # Head-based sampling, the whole turn is traced or not
+        sampled = sample_trace()
+        if tracing_enabled():
+            TRACE_DECISIONS.inc(endpoint="chat", sampled=str(sampled).lower())
+        with tracing_scope(sampled):
+            async for mode, payload in symptex_model.astream(
+                graph_input,
+                config,
+                stream_mode=["messages", "updates"]
+            ):
+                if mode == "updates":
+                    # Pass on summaries of older turns
+                    history_update = payload.get("manage_history") or {}
+                    if on_summary and "summarized_count" in history_update:
+                        await on_summary(history_update["summary"], history_update["summarized_count"])
+                    continue
+
+                msg, metadata = payload
+                # Get AIMessageChunks of the patient model only
+                if metadata.get("langgraph_node") != "patient_model":
+                    continue
+                if msg.response_metadata.get("finish_reason") == "length":
+                    hit_budget = True
+                # Prompt tokens served from the backend's prefix cache, where reported
+                usage = getattr(msg, "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    cached_prompt_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0)
+                if msg.content and not isinstance(msg, HumanMessage):
+                    # logger.debug(msg.content)
+                    token_count += 1
+                    if stream_stats is not None:
+                        stream_stats["tokens"] = token_count
+                    if not first_token_seen:
+                        first_token_seen = True
+                        first_token_seconds = time.perf_counter() - started
+                        FIRST_TOKEN_SECONDS.observe(first_token_seconds, model=model)
+                        if timer is not None:
+                            timer.add("first_token", first_token_seconds)
+                        if stream_stats is not None:
+                            stream_stats["time_to_first_token_ms"] = round(first_token_seconds * 1000)
+                    # Hidden thinking of reasoning models is not sent to the client
+                    visible = think_filter.feed(msg.content)
+                    if visible:
+                        if not first_visible_seen:
+                            first_visible_seen = True
+                            first_visible_seconds = time.perf_counter() - started
+                            FIRST_VISIBLE_TOKEN_SECONDS.observe(first_visible_seconds, model=model)
+                            if stream_stats is not None:
+                                stream_stats["time_to_first_visible_token_ms"] = round(first_visible_seconds * 1000)
+                        yield visible
+
+        rest = think_filter.flush()
+        if rest:
+            yield rest
+        stream_seconds = time.perf_counter() - started
+        STREAM_SECONDS.observe(stream_seconds, model=model)
+        if timer is not None:
+            timer.add("stream", stream_seconds)
+        RESPONSE_TOKENS.observe(token_count, model=model)
+        # Answer lengths per talkativeness, to tune the generation budgets
+        ANSWER_TOKENS.observe(token_count, talkativeness=talkativeness, condition=condition)
+        if hit_budget:
+            ANSWERS_AT_BUDGET.inc(talkativeness=talkativeness, condition=condition)
+        if prompt_tokens:
+            PROMPT_TOKENS.inc(prompt_tokens, model=model)
+            CACHED_PROMPT_TOKENS.inc(cached_prompt_tokens, model=model)
+        HIDDEN_TOKENS.observe(think_filter.hidden_chunks, model=model)
+        if stream_stats is not None:
+            stream_stats["hidden_tokens"] = think_filter.hidden_chunks
+            stream_stats["prompt_tokens"] = prompt_tokens
+            stream_stats["cached_prompt_tokens"] = cached_prompt_tokens
     except Exception as e:
         logger.error("Error while streaming response: %s", str(e))
+        CHAT_ERRORS.inc(model=model, condition=condition, talkativeness=talkativeness)
         yield f"Entschuldigung, es ist ein Fehler aufgetreten: {str(e)}"
@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.startup import readiness, warmup
+
+router = APIRouter()
+
+
+# Readiness endpoint
+@router.get("/ready")
+async def get_ready():
+    """Return 200 if the API can serve requests, 503 with the failed checks otherwise"""
+    state = await readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+
+# Warm-up endpoint
+@router.post("/warmup")
+async def post_warmup():
+    """Open database and ChatAI connections and build LLM clients and prompt templates ahead of the first requests"""
+    return await warmup()
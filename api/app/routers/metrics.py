@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.metrics import render_prometheus
+
+router = APIRouter()
+
+
+# Metrics endpoint
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Return all metrics in the Prometheus text format"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,36 @@
+from fastapi import APIRouter
+
+from app.admission import admission_stats
+from app.db.db import db_pool_stats
+from app.db.history_cache import history_cache_stats
+from app.db.patient_profiles import profile_cache_stats
+from app.db.persistence import message_writer_stats
+from app.metrics import metrics_snapshot
+from app.startup import startup_stats
+from chains.cassettes import cassette_stats
+from chains.checkpointer import checkpointer
+from chains.llm_pool import pool_stats
+from chains.prompts import prompt_cache_stats
+from chains.routing import routing_stats
+
+router = APIRouter()
+
+
+# Stats endpoint
+@router.get("/stats")
+async def get_stats():
+    """Return runtime statistics of connection pools and caches"""
+    return {
+        "startup": startup_stats(),
+        "llm_pool": pool_stats(),
+        "db_pool": db_pool_stats(),
+        "admission": admission_stats(),
+        "routing": routing_stats(),
+        "cassettes": cassette_stats(),
+        "prompt_cache": prompt_cache_stats(),
+        "patient_profile_cache": profile_cache_stats(),
+        "history_cache": history_cache_stats(),
+        "message_writer": message_writer_stats(),
+        "checkpointer": checkpointer.stats() if checkpointer else {"mode": "none"},
+        "metrics": metrics_snapshot(),
+    }
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import AsyncExitStack
+
+from sqlalchemy import select, text
+
+from app.admission import ALLOWED_MODELS
+from app.db.db import DB_POOL_SIZE, SessionLocal, engine, init_db
+from app.db.migrations import run_migrations
+from app.db.models import PatientFile
+from app.db.patient_profiles import load_patient_profile
+from app.metrics import gauge
+from chains.cassettes import LLM_CASSETTE_MODE
+from chains.llm_pool import CHATAI_API_KEY, CHATAI_API_URL, chatai_configured, get_http_async_client, pool_stats
+from chains.prompts import CONDITIONS, TALKATIVENESS_LEVELS, get_prompt
+
+# Schema setup is retried this many times while the database is unavailable, waiting
+# DB_STARTUP_RETRY_DELAY seconds before the first retry and twice as long before each further one
+DB_STARTUP_RETRIES = int(os.environ.get("DB_STARTUP_RETRIES", "5"))
+DB_STARTUP_RETRY_DELAY = float(os.environ.get("DB_STARTUP_RETRY_DELAY", "1"))
+# Max. seconds the readiness check waits for the database
+READY_DB_TIMEOUT = float(os.environ.get("READY_DB_TIMEOUT", "2"))
+# Run the warm-up in the background after startup, the API is only ready once it finished
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "false").lower() == "true"
+# Connections opened by the warm-up: pooled database connections, keep-alive connections to ChatAI,
+# and the most recent patient files whose prompt templates are built for all conditions and talkativeness levels
+WARMUP_DB_CONNECTIONS = int(os.environ.get("WARMUP_DB_CONNECTIONS", str(DB_POOL_SIZE)))
+WARMUP_UPSTREAM_CONNECTIONS = int(os.environ.get("WARMUP_UPSTREAM_CONNECTIONS", "2"))
+WARMUP_PATIENT_FILES = int(os.environ.get("WARMUP_PATIENT_FILES", "10"))
+
+logger = logging.getLogger('startup')
+
+STARTUP_SECONDS = gauge("startup_seconds", "Duration of the startup phases of this process", ("phase",))
+
+_phases = {}
+_schema_attempts = 0
+_schema_ready = False
+_warmup = None
+
+
+def record_phase(phase: str, seconds: float):
+    """Record the duration of a startup phase (import, schema, lifespan, warmup)."""
+    _phases[phase] = seconds
+    STARTUP_SECONDS.set(seconds, phase=phase)
+    logger.info("Startup phase %s took %.2fs", phase, seconds)
+
+
+async def setup_schema():
+    """Create missing tables and apply migrations, retrying with backoff while the database is unavailable."""
+    global _schema_attempts, _schema_ready
+    started = time.perf_counter()
+    delay = DB_STARTUP_RETRY_DELAY
+    for attempt in range(1, DB_STARTUP_RETRIES + 2):
+        _schema_attempts = attempt
+        try:
+            await init_db()
+            await run_migrations(engine)
+            break
+        except Exception as e:
+            if attempt > DB_STARTUP_RETRIES:
+                logger.error("Database schema setup failed after %d attempts: %s", attempt, str(e))
+                raise
+            logger.warning("Database not available (attempt %d): %s, retrying in %.1fs", attempt, str(e), delay)
+            await asyncio.sleep(delay)
+            delay *= 2
+    _schema_ready = True
+    record_phase("schema", time.perf_counter() - started)
+
+
+async def _check_database():
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def readiness() -> dict:
+    """Check that the schema is set up, the database is reachable and ChatAI is configured."""
+    checks = {"schema": _schema_ready, "chatai": chatai_configured()}
+    try:
+        await asyncio.wait_for(_check_database(), READY_DB_TIMEOUT)
+        checks["database"] = True
+    except Exception as e:
+        logger.warning("Readiness check could not reach the database: %s", str(e))
+        checks["database"] = False
+    if WARMUP_ON_STARTUP:
+        checks["warmup"] = _warmup is not None
+    return {"ready": all(checks.values()), "checks": checks}
+
+
+async def _warm_database() -> int:
+    """Open pooled database connections, they stay in the pool when they are released."""
+    count = min(WARMUP_DB_CONNECTIONS, DB_POOL_SIZE)
+    async with AsyncExitStack() as stack:
+        # Hold all connections at once, so each checkout opens a new one
+        for _ in range(count):
+            conn = await stack.enter_async_context(engine.connect())
+            await conn.execute(text("SELECT 1"))
+    return count
+
+
+def _warm_llms() -> int:
+    """Import the chains and create the pooled LLM clients of all models."""
+    from chains.chat_chain import get_llm, get_summary_llm
+    from chains.eval_chain import get_rating_llm
+
+    for model in ALLOWED_MODELS:
+        get_llm(model)
+        get_summary_llm(model)
+    get_rating_llm()
+    return pool_stats()["clients"]
+
+
+async def _warm_upstream() -> int:
+    """Open keep-alive connections to ChatAI in the shared HTTP client."""
+    if LLM_CASSETTE_MODE == "replay" or not chatai_configured():
+        return 0
+    client = get_http_async_client()
+    url = f"{CHATAI_API_URL.rstrip('/')}/models"
+    headers = {"Authorization": f"Bearer {CHATAI_API_KEY}"}
+    # Concurrent requests each use their own connection, the response status does not matter
+    await asyncio.gather(*[client.get(url, headers=headers) for _ in range(WARMUP_UPSTREAM_CONNECTIONS)])
+    return pool_stats()["connections"]["open"]
+
+
+async def _warm_prompts() -> int:
+    """Build the evaluation and summary prompts, and the patient prompts of the most recent patient files."""
+    from chains.eval_chain import get_chunk_prompt, get_criterion_prompt, get_overall_prompt
+    from chains.history import get_summary_prompt
+
+    for build in (get_criterion_prompt, get_chunk_prompt, get_overall_prompt, get_summary_prompt):
+        build()
+    built = 4
+
+    async with SessionLocal() as db:
+        result = await db.execute(
+            select(PatientFile.id).order_by(PatientFile.id.desc()).limit(WARMUP_PATIENT_FILES)
+        )
+        for patient_file_id in result.scalars().all():
+            profile = await load_patient_profile(db, patient_file_id)
+            if profile is None:
+                continue
+            for condition in CONDITIONS:
+                for talkativeness in TALKATIVENESS_LEVELS:
+                    get_prompt(condition, talkativeness, profile.details)
+                    built += 1
+    return built
+
+
+async def warmup() -> dict:
+    """
+    Prepare the process for the first requests: open database and ChatAI connections,
+    create the LLM clients and build prompt templates. Failed steps are reported, not raised.
+    """
+    global _warmup
+    started = time.perf_counter()
+    result = {}
+    errors = {}
+    steps = [
+        ("database_connections", _warm_database),
+        ("llm_clients", _warm_llms),
+        ("upstream_connections", _warm_upstream),
+        ("prompts", _warm_prompts),
+    ]
+    for name, step in steps:
+        try:
+            value = step()
+            result[name] = await value if asyncio.iscoroutine(value) else value
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, str(e))
+            errors[name] = str(e)
+    result["errors"] = errors
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    record_phase("warmup", result["seconds"])
+    _warmup = result
+    return result
+
+
+def startup_stats() -> dict:
+    """Return the durations of the startup phases, the schema setup attempts and the last warm-up."""
+    return {
+        "phases_seconds": {phase: round(seconds, 3) for phase, seconds in _phases.items()},
+        "schema_attempts": _schema_attempts,
+        "schema_ready": _schema_ready,
+        "warmup": _warmup,
+    }
@@ -0,0 +1,304 @@
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable
+
+# Seconds between heartbeat comments on server-sent event streams
+SSE_HEARTBEAT_INTERVAL = int(os.environ.get("SSE_HEARTBEAT_INTERVAL", "15"))
+# Seconds a finished response stays available for resuming
+STREAM_BUFFER_TTL = float(os.environ.get("STREAM_BUFFER_TTL", "300"))
+# Streamed chunks are merged until this many bytes are buffered or the window has passed,
+# a window of 0 sends every chunk on its own
+STREAM_COALESCE_BYTES = int(os.environ.get("STREAM_COALESCE_BYTES", "64"))
+STREAM_COALESCE_WINDOW_MS = float(os.environ.get("STREAM_COALESCE_WINDOW_MS", "30"))
+# Seconds between checks whether the client of a stream is still connected
+DISCONNECT_POLL_INTERVAL = float(os.environ.get("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _partial_tag_length(text: str, tag: str, start: int) -> int:
+    """Length of the longest suffix of text[start:] that is a proper prefix of tag."""
+    for length in range(min(len(tag) - 1, len(text) - start), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+class ThinkTagFilter:
+    """
+    Streaming filter that removes <think>...</think> blocks of reasoning models.
+
+    Tags may be split across chunks, only a possible partial tag at the end of a
+    chunk is held back, so the whole stream is processed in linear time.
+    """
+
+    def __init__(self):
+        self.inside = False
+        self.hidden_chunks = 0
+        self.hidden_chars = 0
+        self._pending = ""
+        self._strip_whitespace = False
+
+    def feed(self, chunk: str) -> str:
+        """Process the next chunk and return its visible part."""
+        text = self._pending + chunk
+        self._pending = ""
+        visible = []
+        hidden = 0
+        position = 0
+        while position < len(text):
+            tag = THINK_CLOSE if self.inside else THINK_OPEN
+            index = text.find(tag, position)
+            if index == -1:
+                # Hold back a tag that may be completed by the next chunk
+                end = len(text) - _partial_tag_length(text, tag, position)
+                self._pending = text[end:]
+            else:
+                end = index
+
+            segment = text[position:end]
+            if self.inside:
+                hidden += len(segment)
+            else:
+                if self._strip_whitespace:
+                    segment = segment.lstrip()
+                    self._strip_whitespace = not segment
+                visible.append(segment)
+
+            if index == -1:
+                break
+            position = index + len(tag)
+            self.inside = not self.inside
+            # Drop the line breaks that follow a think block
+            self._strip_whitespace = not self.inside
+
+        if hidden or (self.inside and chunk):
+            self.hidden_chunks += 1
+            self.hidden_chars += hidden
+        return "".join(visible)
+
+    def flush(self) -> str:
+        """Return text held back at the end of the stream, an unclosed think block is dropped."""
+        pending, self._pending = self._pending, ""
+        if self.inside:
+            self.hidden_chars += len(pending)
+            return ""
+        return pending
+
+
+async def filter_think_tags(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Remove think blocks from a stream of text chunks."""
+    think_filter = ThinkTagFilter()
+    async for chunk in chunks:
+        visible = think_filter.feed(chunk)
+        if visible:
+            yield visible
+    rest = think_filter.flush()
+    if rest:
+        yield rest
+
+
+async def coalesce_chunks(
+    chunks: AsyncIterator[str],
+    max_bytes: int = STREAM_COALESCE_BYTES,
+    window_ms: float = STREAM_COALESCE_WINDOW_MS,
+) -> AsyncIterator[str]:
+    """
+    Merge a stream of small chunks into fewer, larger ones.
+
+    The first chunk is sent right away. Later chunks are buffered until max_bytes
+    are reached or window_ms have passed since the oldest buffered chunk,
+    whichever comes first, so a stalled stream never holds back text.
+    """
+    if window_ms <= 0:
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    # The source is consumed by its own task, so a flush does not wait for the next chunk
+    queue = asyncio.Queue()
+    done = object()
+
+    async def produce():
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+        except Exception as e:
+            await queue.put(e)
+        await queue.put(done)
+
+    loop = asyncio.get_running_loop()
+    producer = asyncio.create_task(produce())
+    buffered, size, deadline = [], 0, None
+    first = True
+    try:
+        while True:
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield "".join(buffered)
+                buffered, size, deadline = [], 0, None
+                continue
+
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if first:
+                first = False
+                yield item
+                continue
+
+            buffered.append(item)
+            size += len(item.encode())
+            if deadline is None:
+                deadline = loop.time() + window_ms / 1000
+            if size >= max_bytes:
+                yield "".join(buffered)
+                buffered, size, deadline = [], 0, None
+
+        if buffered:
+            yield "".join(buffered)
+    finally:
+        # Stop the source right away, e.g. to abort the upstream request
+        producer.cancel()
+        await asyncio.wait({producer})
+
+# Cancelled sources may still be cleaning up after their consumer is gone
+_cancelled_sources = set()
+
+
+async def cancel_on_disconnect(
+    chunks: AsyncIterator[str],
+    is_disconnected: Callable[[], Awaitable[bool]],
+    poll_interval: float = DISCONNECT_POLL_INTERVAL,
+) -> AsyncIterator[str]:
+    """
+    Pass on a stream of chunks and cancel it as soon as the client disconnects.
+
+    The source runs in its own task, which is cancelled when is_disconnected()
+    returns True, even while it waits for the next chunk.
+    """
+    queue = asyncio.Queue()
+    done = object()
+
+    async def produce():
+        try:
+            async for chunk in chunks:
+                queue.put_nowait(chunk)
+        finally:
+            queue.put_nowait(done)
+
+    async def watch():
+        while not producer.done():
+            if await is_disconnected():
+                producer.cancel()
+                return
+            await asyncio.sleep(poll_interval)
+
+    producer = asyncio.create_task(produce())
+    watcher = asyncio.create_task(watch())
+    try:
+        while (item := await queue.get()) is not done:
+            yield item
+        await asyncio.wait({producer})
+        if not producer.cancelled():
+            # Raise errors of the source
+            producer.result()
+    finally:
+        watcher.cancel()
+        if not producer.done():
+            producer.cancel()
+            _cancelled_sources.add(producer)
+            producer.add_done_callback(_cancelled_sources.discard)
+
+
+class ResponseBuffer:
+    """
+    Chunks of a response that is generated independently of the client connection.
+    Chunks are numbered from 1, followers can start after any sequence number.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.stats = {}
+        self.task = None
+        self.started = time.perf_counter()
+        self.duration = None
+        # Monotonic finish time for the buffer expiry
+        self.finished_at = None
+        self._condition = asyncio.Condition()
+
+    async def append(self, text: str):
+        async with self._condition:
+            self.chunks.append(text)
+            self._condition.notify_all()
+
+    async def finish(self, stats: dict = None, error: str = None):
+        async with self._condition:
+            self.done = True
+            self.error = error
+            self.stats = stats or {}
+            self.duration = time.perf_counter() - self.started
+            self.finished_at = time.monotonic()
+            self._condition.notify_all()
+
+    async def follow(self, after: int = 0) -> AsyncIterator[tuple[int, str]]:
+        """Yield (seq, text) for all chunks after the given sequence number until the response is done."""
+        position = max(after, 0)
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: len(self.chunks) > position or self.done)
+                new_chunks = self.chunks[position:]
+                done = self.done
+            for seq, text in enumerate(new_chunks, start=position + 1):
+                yield seq, text
+            position += len(new_chunks)
+            if done and position >= len(self.chunks):
+                return
+
+    def summary(self) -> dict:
+        """Token counts and timings of the finished response."""
+        duration = self.duration if self.duration is not None else time.perf_counter() - self.started
+        summary = {
+            "chunks": len(self.chunks),
+            "chars": sum(len(text) for text in self.chunks),
+            "duration_ms": round(duration * 1000),
+            **self.stats,
+        }
+        if self.error:
+            summary["error"] = self.error
+        return summary
+
+
+# Latest response buffer per session
+_response_buffers = {}
+
+
+def _drop_expired_buffers():
+    now = time.monotonic()
+    for session_id, buffer in list(_response_buffers.items()):
+        if buffer.finished_at is not None and now - buffer.finished_at > STREAM_BUFFER_TTL:
+            del _response_buffers[session_id]
+
+
+def start_response_buffer(session_id: str) -> ResponseBuffer:
+    """Create the buffer for a new response of a session, replacing the previous one."""
+    _drop_expired_buffers()
+    previous = _response_buffers.get(session_id)
+    if previous is not None and previous.task is not None and not previous.task.done():
+        # Stop generating the replaced response, which frees its model slot
+        previous.task.cancel()
+    buffer = _response_buffers[session_id] = ResponseBuffer()
+    return buffer
+
+
+def get_response_buffer(session_id: str):
+    """Return the latest response buffer of a session, or None."""
+    _drop_expired_buffers()
+    return _response_buffers.get(session_id)
@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Requests taking at least this many seconds are written to the slow-turn log, 0 disables it
+SLOW_TURN_THRESHOLD = float(os.environ.get("SLOW_TURN_THRESHOLD", "10"))
+# File for slow-turn records as JSON lines, they are only logged through the 'slow_turns' logger if unset
+SLOW_TURN_LOG_FILE = os.environ.get("SLOW_TURN_LOG_FILE")
+
+logger = logging.getLogger('timing')
+slow_turn_logger = logging.getLogger('slow_turns')
+if SLOW_TURN_LOG_FILE:
+    _handler = logging.FileHandler(SLOW_TURN_LOG_FILE, encoding="utf-8")
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    slow_turn_logger.addHandler(_handler)
+
+
+class RequestTimer:
+    """
+    Durations of the phases of one chat or evaluation request. Phases finished before the
+    response starts go into its Server-Timing header, all phases are logged when it is done.
+    """
+
+    def __init__(self, endpoint: str, session_id: str = "", model: str = ""):
+        self.endpoint = endpoint
+        self.session_id = session_id
+        self.model = model
+        self.started = time.perf_counter()
+        self.phases = {}
+        # Seconds until the response headers of each upstream call
+        self.upstream_connects = []
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        """Add the duration of the enclosed block to a phase."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Server-Timing header value of the phases recorded so far."""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items())
+
+    def finish(self, **fields) -> dict:
+        """Log the phases of the finished request, and write it to the slow-turn log if it was slow."""
+        if self.upstream_connects:
+            # The slowest upstream call, hedged and summary calls may overlap the patient call
+            self.phases["connect"] = max(self.upstream_connects)
+        total = self.elapsed()
+        record = {
+            "endpoint": self.endpoint,
+            "session_id": self.session_id,
+            "model": self.model,
+            "total_ms": round(total * 1000, 1),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            **fields,
+        }
+        # Serialized only if the record is logged
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Request timing: %s", json.dumps(record, ensure_ascii=False))
+        if SLOW_TURN_THRESHOLD and total >= SLOW_TURN_THRESHOLD:
+            slow_turn_logger.warning(json.dumps(record, ensure_ascii=False))
+        return record
+
+
+class PromptTimingHandler(BaseCallbackHandler):
+    """Adds the time spent rendering prompt templates of a run to the 'prompt' phase of a timer."""
+
+    run_inline = True
+    # Skip the per-token callbacks of model runs
+    ignore_llm = True
+    ignore_chat_model = True
+    ignore_retriever = True
+    ignore_agent = True
+
+    def __init__(self, timer: RequestTimer):
+        self.timer = timer
+        self._started = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, run_type: Optional[str] = None, **kwargs):
+        if run_type == "prompt":
+            self._started[run_id] = time.perf_counter()
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            self.timer.add("prompt", time.perf_counter() - started)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
@@ -0,0 +1,87 @@
+import os
+import json
+import logging
+import threading
+from typing import NamedTuple
+
+# Set up logging
+logger = logging.getLogger('budgets')
+
+# Generation budgets of the patient model. Condition settings override talkativeness settings,
+# which override the defaults, stop sequences of all levels are combined. Models with hidden
+# thinking get extra_tokens on top of the budget.
+DEFAULT_GENERATION_BUDGETS = {
+    "default": {"max_tokens": 400, "stop": ["\nArzt:", "\nÄrztin:"]},
+    "talkativeness": {
+        "kurz angebunden": {"max_tokens": 120},
+        "ausgewogen": {"max_tokens": 300},
+        "ausschweifend": {"max_tokens": 700},
+    },
+    "condition": {},
+    "model": {
+        "qwq-32b": {"extra_tokens": 1500},
+    },
+}
+# JSON file with the same structure, merged over the defaults and reloaded when it changes
+GENERATION_BUDGETS_FILE = os.environ.get("GENERATION_BUDGETS_FILE")
+# OpenAI-compatible APIs accept at most 4 stop sequences
+MAX_STOP_SEQUENCES = 4
+
+
+class GenerationBudget(NamedTuple):
+    max_tokens: int
+    stop: tuple
+
+
+def _merge(defaults: dict, overrides: dict) -> dict:
+    merged = dict(defaults)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+_lock = threading.Lock()
+_budgets = DEFAULT_GENERATION_BUDGETS
+_budgets_mtime = None
+
+
+def load_budgets() -> dict:
+    """Return the budget configuration, reloading the budgets file if it changed."""
+    global _budgets, _budgets_mtime
+    if not GENERATION_BUDGETS_FILE:
+        return _budgets
+    try:
+        mtime = os.stat(GENERATION_BUDGETS_FILE).st_mtime
+    except OSError:
+        return _budgets
+    with _lock:
+        if mtime != _budgets_mtime:
+            try:
+                with open(GENERATION_BUDGETS_FILE, encoding="utf-8") as f:
+                    _budgets = _merge(DEFAULT_GENERATION_BUDGETS, json.load(f))
+                logger.info("Loaded generation budgets from %s", GENERATION_BUDGETS_FILE)
+            except (OSError, ValueError) as e:
+                # Keep the previous budgets on an invalid file
+                logger.error("Error loading generation budgets: %s", str(e))
+            _budgets_mtime = mtime
+        return _budgets
+
+
+def get_generation_budget(model: str, condition: str, talkativeness: str) -> GenerationBudget:
+    """Get max. tokens and stop sequences of a patient answer."""
+    budgets = load_budgets()
+    levels = [
+        budgets.get("default", {}),
+        budgets.get("talkativeness", {}).get(talkativeness, {}),
+        budgets.get("condition", {}).get(condition, {}),
+    ]
+    max_tokens = 0
+    stop = []
+    for level in levels:
+        max_tokens = level.get("max_tokens", max_tokens)
+        stop.extend(sequence for sequence in level.get("stop", []) if sequence not in stop)
+    max_tokens += budgets.get("model", {}).get(model, {}).get("extra_tokens", 0)
+    return GenerationBudget(max_tokens, tuple(stop[:MAX_STOP_SEQUENCES]))
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe, bounded LRU cache with optional time-to-live and hit/miss counters.
+    If a weigher is given, the summed weight of all entries is also kept below max_weight.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = None, weigher=None, max_weight: int = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigher = weigher
+        self.max_weight = max_weight
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entries if full."""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        weight = self.weigher(value) if self.weigher else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires_at, weight)
+            self.weight += weight
+            while len(self._data) > self.maxsize or (
+                self.max_weight is not None and self.weight > self.max_weight and len(self._data) > 1
+            ):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate(self, predicate=None) -> int:
+        """Drop all entries, or only those whose key matches predicate. Returns the count."""
+        with self._lock:
+            if predicate is None:
+                count = len(self._data)
+                self._data.clear()
+                self.weight = 0
+                return count
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def pop(self, key, default=None):
+        """Remove key and return its value."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def _remove(self, key):
+        value, _, weight = self._data.pop(key)
+        self.weight -= weight
+        return value
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Return size and counters of the cache."""
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "weight": self.weight,
+                "max_weight": self.max_weight,
+            }
@@ -0,0 +1,200 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, AsyncIterator, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+# Set up logging
+logger = logging.getLogger('cassettes')
+
+# Record/replay of LLM calls: "off", "record" (call the model and store the streamed chunks) or
+# "replay" (play stored chunks back, the model is never called)
+LLM_CASSETTE_MODE = os.environ.get("LLM_CASSETTE_MODE", "off").lower()
+LLM_CASSETTE_DIR = os.environ.get("LLM_CASSETTE_DIR", "cassettes")
+# Replay speed relative to the recorded timings, 0 plays the chunks back without delays
+LLM_CASSETTE_SPEED = float(os.environ.get("LLM_CASSETTE_SPEED", "1"))
+
+CASSETTE_VERSION = 1
+
+
+class CassetteNotFoundError(Exception):
+    """Raised in replay mode when no cassette was recorded for a call."""
+
+
+def cassette_key(model: str, messages: list[BaseMessage], **kwargs) -> str:
+    """Hash of the model, the prompt messages and the call parameters (max. tokens, stop, ...)."""
+    payload = json.dumps(
+        {
+            "model": model,
+            "messages": [[message.type, message.content] for message in messages],
+            "kwargs": kwargs,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cassette_path(key: str) -> str:
+    return os.path.join(LLM_CASSETTE_DIR, f"{key}.json.gz")
+
+
+def _chunk_to_record(offset: float, chunk: AIMessageChunk) -> list:
+    """Compact record of a chunk: [seconds since the call started, content, metadata if any]."""
+    record = [round(offset, 4), chunk.content]
+    metadata = {}
+    if chunk.response_metadata:
+        metadata["response_metadata"] = chunk.response_metadata
+    if chunk.usage_metadata:
+        metadata["usage_metadata"] = chunk.usage_metadata
+    if metadata:
+        record.append(metadata)
+    return record
+
+
+def _record_to_chunk(record: list) -> AIMessageChunk:
+    metadata = record[2] if len(record) > 2 else {}
+    return AIMessageChunk(content=record[1], **metadata)
+
+
+def _write(path: str, cassette: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Write to a temporary file first, concurrent readers never see a partial cassette
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(cassette, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def _read(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+_lock = threading.Lock()
+# Replayed cassettes are kept in memory, so replays measure our own overhead and not disk reads
+_loaded = {}
+_wrappers = {}
+_recorded = 0
+_replayed = 0
+_misses = 0
+
+
+async def load_cassette(key: str) -> dict:
+    """Return the cassette of a key, raises CassetteNotFoundError."""
+    global _misses
+    cassette = _loaded.get(key)
+    if cassette is not None:
+        return cassette
+    try:
+        cassette = await asyncio.to_thread(_read, cassette_path(key))
+    except FileNotFoundError:
+        with _lock:
+            _misses += 1
+        raise CassetteNotFoundError(f"No cassette recorded for call {key} in {LLM_CASSETTE_DIR}")
+    with _lock:
+        _loaded[key] = cassette
+    return cassette
+
+
+class CassetteChatModel(BaseChatModel):
+    """
+    Chat model that records the streamed chunks of a model with their timings, or replays them.
+    Calls of the recorded model are tagged "nostream", its tokens are streamed as tokens of this model.
+    """
+
+    model: str
+    mode: str = "replay"
+    llm: Optional[Any] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-chat-model"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.model, "mode": self.mode}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        raise NotImplementedError("CassetteChatModel only supports async calls")
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if stop is not None:
+            kwargs["stop"] = stop
+        key = cassette_key(self.model, messages, **kwargs)
+        stream = self._record(key, messages, **kwargs) if self.mode == "record" else self._replay(key)
+        async for chunk in stream:
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _record(self, key: str, messages: list[BaseMessage], **kwargs) -> AsyncIterator[AIMessageChunk]:
+        global _recorded
+        records = []
+        started = time.perf_counter()
+        # Callbacks of the surrounding run are inherited from the context
+        async for chunk in self.llm.astream(messages, {"tags": ["nostream"]}, **kwargs):
+            records.append(_chunk_to_record(time.perf_counter() - started, chunk))
+            yield chunk
+        # Only complete calls are stored
+        cassette = {"version": CASSETTE_VERSION, "model": self.model, "chunks": records}
+        await asyncio.to_thread(_write, cassette_path(key), cassette)
+        with _lock:
+            _recorded += 1
+        logger.debug("Recorded cassette %s with %d chunks", key, len(records))
+
+    async def _replay(self, key: str) -> AsyncIterator[AIMessageChunk]:
+        global _replayed
+        cassette = await load_cassette(key)
+        with _lock:
+            _replayed += 1
+        started = time.perf_counter()
+        for record in cassette["chunks"]:
+            if LLM_CASSETTE_SPEED > 0:
+                delay = started + record[0] / LLM_CASSETTE_SPEED - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield _record_to_chunk(record)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return await agenerate_from_stream(self._astream(messages, stop, run_manager, **kwargs))
+
+
+def with_cassette(llm, model: str):
+    """Put an LLM behind the cassette layer if LLM_CASSETTE_MODE is set, return it unchanged otherwise."""
+    if LLM_CASSETTE_MODE == "off":
+        return llm
+    if LLM_CASSETTE_MODE not in ("record", "replay"):
+        raise ValueError(f"Invalid LLM_CASSETTE_MODE: {LLM_CASSETTE_MODE}")
+    # LLM instances are pooled, so one wrapper per instance is enough
+    with _lock:
+        wrapper = _wrappers.get(id(llm))
+        if wrapper is None or wrapper.llm is not llm:
+            wrapper = CassetteChatModel(model=model, mode=LLM_CASSETTE_MODE, llm=llm)
+            _wrappers[id(llm)] = wrapper
+        return wrapper
+
+
+def cassette_stats() -> dict:
+    """Return the cassette mode and the number of recorded and replayed calls."""
+    return {
+        "mode": LLM_CASSETTE_MODE,
+        "recorded": _recorded,
+        "replayed": _replayed,
+        "misses": _misses,
+        "loaded": len(_loaded),
+    }
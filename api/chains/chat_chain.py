@@ -1,23 +1,35 @@
-import os
 from dotenv import load_dotenv
 
-from langchain_core.messages import AnyMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AnyMessage, RemoveMessage
 from langgraph.graph import START, StateGraph, END
 from langgraph.graph.message import add_messages
-import langsmith as ls
 from typing import Annotated
 from typing_extensions import TypedDict
 import logging
 
 from chains.prompts import get_prompt
+from chains.llm_pool import MAX_RETRIES, chatai_credentials, get_pooled_llm
+from chains.checkpointer import checkpointer
+from chains.routing import RoutedChatModel
+from chains.budgets import get_generation_budget
+from chains.cassettes import with_cassette
+from chains.observability import traceable, truncate
+from chains.history import (
+    HISTORY_KEEP_TURNS,
+    HISTORY_LOW_WATER,
+    count_history_tokens,
+    get_token_budget,
+    split_history,
+    summarize_history,
+    with_summary,
+)
 
 # Load env variables for LangSmith to work
 load_dotenv()
 
 # Set up logging
 logger = logging.getLogger('chat_chain')
-logger.setLevel(logging.DEBUG)
 
 class CustomState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
@@ -26,27 +38,74 @@ class CustomState(TypedDict):
     talkativeness: str
     patient_details: str
     patient_doc_md: str
-        
-# Set up env variables
-CHATAI_API_URL = os.environ.get("CHATAI_API_URL")
-CHATAI_API_KEY = os.environ.get("CHATAI_API_KEY")
-if not CHATAI_API_URL or not CHATAI_API_KEY:
-    logger.error("CHATAI environment variable not set, setting to default")
-    raise ValueError("ERROR: Environment variables not set")
-
-def get_llm(model: str) -> ChatOpenAI:
-    """Get the LLM instance."""
-    return ChatOpenAI(
-        openai_api_base=CHATAI_API_URL,
-        openai_api_key=CHATAI_API_KEY,
+    summary: str
+    summarized_count: int
+
+
+def get_llm(model: str) -> BaseChatModel:
+    """Get the pooled LLM instance for the given model, recorded or replayed if LLM_CASSETTE_MODE is set."""
+    return with_cassette(get_pooled_llm(
+        **chatai_credentials(),
         model=model,
         temperature=0.7,
         top_p=0.8,
-        #max_tokens=1024,
-        max_retries=2,
-    )
+        # max_tokens and stop are set per answer from the generation budgets
+        max_retries=MAX_RETRIES,
+        # Report token usage, including cached prompt tokens, at the end of the stream
+        stream_usage=True,
+    ), model)
+
+def get_routed_llm(model: str) -> RoutedChatModel:
+    """Get the LLM for the given model behind the routing layer (circuit breaker, hedged fallback)."""
+    return RoutedChatModel(model=model, llm_factory=get_llm)
+
+def get_summary_llm(model: str) -> BaseChatModel:
+    """Get the pooled LLM instance used to summarize older turns."""
+    return with_cassette(get_pooled_llm(
+        **chatai_credentials(),
+        model=model,
+        temperature=0.2,
+        max_retries=MAX_RETRIES,
+    ), model)
+
+async def manage_history(state: CustomState):
+    """
+    Keep the history within the model's token budget. Once it exceeds the budget, older turns
+    are folded into the running summary until summary and kept turns fit into HISTORY_LOW_WATER
+    of the budget, keeping at most the last HISTORY_KEEP_TURNS turns. The following turns then
+    fit without another summary call.
+    """
+    model = state.get("model")
+    messages = state.get("messages", [])
+    summary = state.get("summary") or ""
+
+    budget = get_token_budget(model)
+    if count_history_tokens(messages, summary) <= budget:
+        return {"summary": summary}
+
+    low_water = int(budget * HISTORY_LOW_WATER) - count_history_tokens([], summary)
+    older, _ = split_history(messages, HISTORY_KEEP_TURNS, max_tokens=low_water)
+    if not older:
+        return {"summary": summary}
+
+    try:
+        # Summary tokens must not be streamed to the user
+        llm = get_summary_llm(model).with_config(tags=["nostream"])
+        new_summary = await summarize_history(llm, summary, older)
+    except Exception as e:
+        # Fall back to the full history, the patient model can still answer
+        logger.error("Error summarizing history: %s", str(e))
+        return {"summary": summary}
 
-@ls.traceable(
+    logger.debug("Folded %d messages into the history summary", len(older))
+    return {
+        "messages": [RemoveMessage(id=msg.id) for msg in older],
+        "summary": new_summary,
+        "summarized_count": (state.get("summarized_count") or 0) + len(older),
+    }
+
+# Only wrapped for LangSmith if tracing is enabled
+@traceable(
     run_type="llm",
     name="Patient LLM Call Decorator",
 )
@@ -56,17 +115,27 @@ async def call_patient_model(state: CustomState):
     condition = state.get("condition")
     talkativeness = state.get("talkativeness")
     patient_details = state.get("patient_details")
+    summary = state.get("summary")
 
-    logger.debug("Calling patient model {model} with condition {condition}, talkativeness {talkativeness} and patient_details {patient_details}")
+    logger.debug(
+        "Calling patient model %s with condition %s, talkativeness %s and patient_details %s",
+        model, condition, talkativeness, truncate(patient_details)
+    )
 
     # Get appropriate prompt
     #todo include patient docs here, create tool to send docs to frontend
     prompt = get_prompt(condition, talkativeness, patient_details)
-    chain = prompt | get_llm(model)
+    # Limit the answer length to the talkativeness and condition
+    budget = get_generation_budget(model, condition, talkativeness)
+    chain = prompt | get_routed_llm(model).bind(max_tokens=budget.max_tokens, stop=list(budget.stop) or None)
 
     try:
         # Invoke the chain
-        response = await chain.ainvoke(state)
+        # Place the running summary before the verbatim history
+        history = state["messages"]
+        if summary:
+            history = with_summary(summary, history)
+        response = await chain.ainvoke({**state, "messages": history})
         logger.debug("Received response from patient model")
 
         return {"messages": response}
@@ -74,22 +143,21 @@ async def call_patient_model(state: CustomState):
         logger.error("Error calling patient model: %s", str(e))
         return {
             "messages": [
-                {
-                    "role": "patient",
-                    "content": f"Entschuldigung, es ist ein Fehler aufgetreten: {str(e)}"
-                }
+                AIMessage(content=f"Entschuldigung, es ist ein Fehler aufgetreten: {str(e)}")
             ]
         }
 
 # Define new graph
 workflow = StateGraph(state_schema=CustomState)
 
-# Define patient llm node
+# Define history management and patient llm nodes
+workflow.add_node("manage_history", manage_history)
 workflow.add_node("patient_model", call_patient_model)
 
-# Set entrypoint as 'patient_model'
-workflow.add_edge(START, "patient_model")
+# Set entrypoint as 'manage_history', followed by 'patient_model'
+workflow.add_edge(START, "manage_history")
+workflow.add_edge("manage_history", "patient_model")
 workflow.add_edge("patient_model", END)
 
-# Compile into LangChain runnable
-symptex_model = workflow.compile()
+# Compile into LangChain runnable, graph state is kept per session_id if a checkpointer is configured
+symptex_model = workflow.compile(checkpointer=checkpointer)
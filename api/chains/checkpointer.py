@@ -0,0 +1,14 @@
+import os
+
+# "none" rebuilds the history from the database on every turn,
+# "memory" keeps graph state in process, "postgres" stores it durably in the database
+CHECKPOINTER_MODE = os.environ.get("CHECKPOINTER_MODE", "none").lower()
+CHECKPOINT_PRUNE_INTERVAL = float(os.environ.get("CHECKPOINT_PRUNE_INTERVAL", "600"))
+
+# Process-wide checkpointer, None if graph state is rebuilt from the database on every turn.
+# LangGraph is only imported if a checkpointer is configured.
+checkpointer = None
+if CHECKPOINTER_MODE in ("memory", "postgres"):
+    from chains.session_checkpointer import SessionCheckpointer
+
+    checkpointer = SessionCheckpointer(CHECKPOINTER_MODE)
@@ -1,44 +1,59 @@
 import os
+import re
+import asyncio
+from functools import lru_cache
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.prompts.chat import SystemMessagePromptTemplate
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts.chat import SystemMessagePromptTemplate, HumanMessagePromptTemplate
 
 import logging
 
+from chains.llm_pool import chatai_credentials, get_pooled_llm
+from chains.cassettes import with_cassette
+from chains.history import estimate_tokens, format_transcript
+
 # Load env variables
 load_dotenv()
 
 # Set up logging
 logger = logging.getLogger('eval_chain')
-logger.setLevel(logging.DEBUG)
-
-# Set up env variables
-CHATAI_API_URL = os.environ.get("CHATAI_API_URL")
-CHATAI_API_KEY = os.environ.get("CHATAI_API_KEY")
-if not CHATAI_API_URL or not CHATAI_API_KEY:
-    logger.error("CHATAI environment variable not set, setting to default")
-    raise ValueError("ERROR: Environment variables not set")
 
-def get_eval_prompt():
+# Model rating the transcripts
+RATING_MODEL = "qwen3-235b-a22b"
+# Max. number of concurrent rating calls per evaluation
+EVAL_CONCURRENCY = int(os.environ.get("EVAL_CONCURRENCY", "4"))
+# Transcripts above this estimated token count are condensed chunk-wise before rating
+EVAL_CHUNK_TOKENS = int(os.environ.get("EVAL_CHUNK_TOKENS", "6000"))
+
+# CRI-HT criteria as (title, description)
+CRITERIA = [
+    ("Gesprächsführung übernehmen", "Der Doktor führt das Gespräch zielgerichtet, um relevante Informationen zu erhalten."),
+    ("Relevante Informationen erkennen und reagieren", "Der Doktor zeigt aktives Zuhören und Interesse an klinisch relevanten Aussagen des Patienten."),
+    ("Symptome präzisieren", "Der Doktor stellt gezielte Nachfragen, um Symptome detailliert zu erfassen (z.B. Ort, Dauer, Charakter)."),
+    ("Pathophysiologisch begründete Fragen stellen", "Der Doktor fragt spezifisch nach möglichen Ursachen oder Mustern (z.B. Übelkeit bei Schmerz)."),
+    ("Logische Fragerichtung", "Der Doktor folgt einer nachvollziehbaren Struktur (z.B. vom Allgemeinen zum Detaillierten) statt starrer Abfrage."),
+    ("Informationen beim Patienten rückbestätigen", "Der Doktor überprüft Verständnis durch Paraphrasieren oder Zusammenfassen (z.B. \"Habe ich richtig verstanden, dass...?\")."),
+    ("Zusammenfassung geben", "Der Doktor fasst Zwischenergebnisse laut zusammen, um Transparenz und Korrektheit zu sichern."),
+    ("Effizienz und Datenqualität", "Der Doktor erhebt ausreichend hochwertige Daten in angemessener Zeit (gegeben dem Patientenverhalten)."),
+]
+
+# Bump when prompts or criteria change, stored evaluations of older versions are not reused
+EVAL_VERSION = "2"
+EVAL_HEADER = "**Personalisierte Bewertung der Anamnese**\n\n---\n\n"
+SCORE_PATTERN = re.compile(r"([1-5])\s*/\s*5")
+THINK_PATTERN = re.compile(r"<think>.*?</think>\s*", re.DOTALL)
+
+@lru_cache(maxsize=1)
+def get_criterion_prompt():
     return ChatPromptTemplate.from_messages([
         SystemMessagePromptTemplate.from_template(
             """
             /nothink
-            Ziel: Du ist ein medizinischer Prüfer und bewertest die klinische Gesprächsführung eines Doktors während der Anamneseerhebung anhand definierter klinischer Indikatoren (CRI-HT) auf Deutsch. 
-            Die Bewertung erfolgt auf einer Skala von 1 bis 5 für jede Kategorie.
-            
-            Bewertungskriterien:
-            * Gesprächsführung übernehmen: Der Doktor führt das Gespräch zielgerichtet, um relevante Informationen zu erhalten.
-            * Relevante Informationen erkennen und reagieren: Der Doktor zeigt aktives Zuhören und Interesse an klinisch relevanten Aussagen des Patienten.
-            * Symptome präzisieren: Der Doktor stellt gezielte Nachfragen, um Symptome detailliert zu erfassen (z.B. Ort, Dauer, Charakter).
-            * Pathophysiologisch begründete Fragen stellen: Der Doktor fragt spezifisch nach möglichen Ursachen oder Mustern (z.B. Übelkeit bei Schmerz).
-            * Logische Fragerichtung: Der Doktor folgt einer nachvollziehbaren Struktur (z.B. vom Allgemeinen zum Detaillierten) statt starrer Abfrage.
-            * Informationen beim Patienten rückbestätigen: Der Doktor überprüft Verständnis durch Paraphrasieren oder Zusammenfassen (z.B. "Habe ich richtig verstanden, dass...?").
-            * Zusammenfassung geben: Der Doktor fasst Zwischenergebnisse laut zusammen, um Transparenz und Korrektheit zu sichern.
-            * Effizienz und Datenqualität: Der Doktor erhebt ausreichend hochwertige Daten in angemessener Zeit (gegeben dem Patientenverhalten).
+            Ziel: Du ist ein medizinischer Prüfer und bewertest die klinische Gesprächsführung eines Doktors während der Anamneseerhebung anhand eines klinischen Indikators (CRI-HT) auf Deutsch.
+
+            Bewertungskriterium:
+            * {title}: {description}
 
             Bewertungsskala:
             1: Kriterium nicht erfüllt
@@ -48,53 +63,144 @@ def get_eval_prompt():
             5: Vollständig erfüllt
 
             Anweisung:
-            Analysiere den vorgelegten Arzt-Patienten-Dialog und vergib für jedes der 8 Kriterien eine Punktzahl (1–5). 
-            Begründe jede Bewertung mit konkreten Beispielen aus dem Dialog.
+            Analysiere den vorgelegten Arzt-Patienten-Dialog und vergib für dieses Kriterium eine Punktzahl (1–5).
+            Begründe die Bewertung mit konkreten Beispielen aus dem Dialog.
             Die Bewertung soll konstruktiv sein und Verbesserungspotenziale aufzeigen.
 
-            Formatiere deine Antwort wie folgt:
-            **Personalisierte Bewertung der Anamnese**
-
-            ---
-
-            1. **Gesprächsführung übernehmen: [1-5]/5**
+            Formatiere deine Antwort genau wie folgt, ohne weiteren Text:
+            {index}. **{title}: [1-5]/5**
                 - **Begründung:** [konkrete Beispiele]
                 - **Verbesserungsvorschlag:** [konstruktive Vorschläge]
+            """
+        ),
+        HumanMessagePromptTemplate.from_template("Arzt-Patienten-Dialog:\n{transcript}"),
+    ])
 
-            2. **Relevante Informationen erkennen und reagieren: [1-5]/5**
-            [gleiche Struktur]
-            
-            [weitere Kriterien...]
+@lru_cache(maxsize=1)
+def get_chunk_prompt():
+    return ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(
+            """
+            /nothink
+            Du verdichtest einen Abschnitt eines Anamnesegesprächs für eine spätere Bewertung der Gesprächsführung des Doktors.
+            * Behalte jede Frage und jede Zusammenfassung des Doktors möglichst wörtlich und in der ursprünglichen Reihenfolge.
+            * Kürze die Antworten des Patienten auf die enthaltenen Informationen.
+            * Schreibe im Format "Arzt: ..." bzw. "Patient: ...", ohne Einleitung.
+            """
+        ),
+        HumanMessagePromptTemplate.from_template("Abschnitt {index} von {count}:\n{transcript}"),
+    ])
 
-            **Gesamtbewertung: [1-5]/5**
+@lru_cache(maxsize=1)
+def get_overall_prompt():
+    return ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(
+            """
+            /nothink
+            Du bist ein medizinischer Prüfer. Fasse die folgenden Einzelbewertungen einer Anamnese auf Deutsch zusammen.
+            Formatiere deine Antwort genau wie folgt, ohne weiteren Text:
             - **Stärken**: [Aufzählung]
-            - **Verbesserungspotenzial**: [Aufzählung]     
+            - **Verbesserungspotenzial**: [Aufzählung]
             """
         ),
-        MessagesPlaceholder(variable_name="messages"),
+        HumanMessagePromptTemplate.from_template("Einzelbewertungen:\n{ratings}"),
     ])
 
 def get_rating_llm():
-    return ChatOpenAI(
-        openai_api_base=CHATAI_API_URL,
-        openai_api_key=CHATAI_API_KEY,
-        model="qwen3-235b-a22b", 
+    return with_cassette(get_pooled_llm(
+        **chatai_credentials(),
+        model=RATING_MODEL,
         temperature=0.0,
-    )
+    ), RATING_MODEL)
+
+def chunk_messages(messages, max_tokens: int):
+    """Split messages into consecutive chunks of at most max_tokens estimated tokens."""
+    chunks, current, current_tokens = [], [], 0
+    for msg in messages:
+        tokens = estimate_tokens(str(msg.content))
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(msg)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+async def _invoke(semaphore: asyncio.Semaphore, prompt, inputs: dict) -> str:
+    async with semaphore:
+        response = await (prompt | get_rating_llm()).ainvoke(inputs)
+    return THINK_PATTERN.sub("", str(response.content)).strip()
+
+async def condense_transcript(messages, semaphore: asyncio.Semaphore) -> str:
+    """Return the transcript, condensed chunk by chunk (map step) if it is too long."""
+    transcript = format_transcript(messages)
+    if estimate_tokens(transcript) <= EVAL_CHUNK_TOKENS:
+        return transcript
+
+    chunks = chunk_messages(messages, EVAL_CHUNK_TOKENS)
+    logger.debug("Condensing transcript in %d chunks", len(chunks))
+    condensed = await asyncio.gather(*[
+        _invoke(semaphore, get_chunk_prompt(), {
+            "index": index,
+            "count": len(chunks),
+            "transcript": format_transcript(chunk),
+        })
+        for index, chunk in enumerate(chunks, start=1)
+    ])
+    return "\n".join(condensed)
+
+async def stream_evaluation(messages):
+    """
+    Evaluate the dialogue with one concurrent rating call per criterion.
+    Criteria are streamed in order, each as soon as it and all criteria before it are rated,
+    followed by the overall rating.
+    Errors are raised to the caller.
+    """
+    semaphore = asyncio.Semaphore(EVAL_CONCURRENCY)
+    logger.debug("Evaluating %d messages", len(messages))
+    yield EVAL_HEADER
+
+    transcript = await condense_transcript(messages, semaphore)
+
+    async def rate(index: int, title: str, description: str):
+        rating = await _invoke(semaphore, get_criterion_prompt(), {
+            "index": index,
+            "title": title,
+            "description": description,
+            "transcript": transcript,
+        })
+        return index, rating
+
+    tasks = [
+        asyncio.create_task(rate(index, title, description))
+        for index, (title, description) in enumerate(CRITERIA, start=1)
+    ]
+    ratings = {}
+    try:
+        # Rated concurrently, but streamed in criterion order: criterion i as soon as 1..i are done,
+        # so the numbered list renders correctly and stored evaluations do not depend on timing
+        for task in tasks:
+            index, rating = await task
+            ratings[index] = rating
+            yield rating + "\n\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    # Reduce step: average score and overall strengths/weaknesses
+    ordered = [ratings[index] for index in sorted(ratings)]
+    scores = [int(match.group(1)) for match in (SCORE_PATTERN.search(rating) for rating in ordered) if match]
+    overall = round(sum(scores) / len(scores)) if scores else "-"
+    yield f"**Gesamtbewertung: {overall}/5**\n"
+    async for chunk in (get_overall_prompt() | get_rating_llm()).astream({"ratings": "\n\n".join(ordered)}):
+        yield chunk.content
 
 async def eval_history(messages):
+    """Stream the evaluation of the dialogue, errors are streamed as a message."""
     try:
-        prompt = get_eval_prompt()
-        llm = get_rating_llm()
-        chain = prompt | llm
-
-        logger.debug("Evaluating messages: %s", messages)
-        async for chunk in chain.astream({"messages": messages}):
-            if isinstance(chunk, (HumanMessage, AIMessage)):
-                yield chunk.content
-            else:
-                yield str(chunk)
-            
+        async for chunk in stream_evaluation(messages):
+            yield chunk
     except Exception as e:
         logger.error("Error in eval_history: %s", str(e))
-        yield f"Entschuldigung, es ist ein Fehler aufgetreten: {str(e)}"
\ No newline at end of file
+        yield f"Entschuldigung, es ist ein Fehler aufgetreten: {str(e)}"
@@ -0,0 +1,123 @@
+import os
+import json
+import logging
+from functools import lru_cache
+
+from langchain_core.messages import AnyMessage, HumanMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts.chat import SystemMessagePromptTemplate, HumanMessagePromptTemplate
+
+# Set up logging
+logger = logging.getLogger('history')
+
+# Number of most recent turns (doctor question + patient answer) that are always kept verbatim
+HISTORY_KEEP_TURNS = int(os.environ.get("HISTORY_KEEP_TURNS", "6"))
+
+# Token budget for summary + verbatim history per model, before older turns are summarized
+DEFAULT_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "6000"))
+HISTORY_TOKEN_BUDGETS = {
+    "gemma-3-27b-it": 4000,
+    "llama-3.3-70b-instruct": 6000,
+    "llama-3.1-sauerkrautlm-70b-instruct": 6000,
+    "qwq-32b": 4000,
+    "mistral-large-instruct": 6000,
+    "qwen3-235b-a22b": 8000,
+}
+# Overrides as JSON object, e.g. HISTORY_TOKEN_BUDGETS='{"qwq-32b": 3000}'
+HISTORY_TOKEN_BUDGETS.update(json.loads(os.environ.get("HISTORY_TOKEN_BUDGETS", "{}")))
+# Fraction of the budget the history is folded down to once it exceeds the budget,
+# so the following turns fit without another summary call
+HISTORY_LOW_WATER = float(os.environ.get("HISTORY_LOW_WATER", "0.5"))
+
+SUMMARY_PREFIX = "Zusammenfassung des bisherigen Gesprächs:\n"
+
+
+def get_token_budget(model: str) -> int:
+    """Get the history token budget for a model."""
+    return HISTORY_TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGET)
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the number of tokens of a text (about 4 characters per token)."""
+    return len(text) // 4 + 1 if text else 0
+
+
+def count_history_tokens(messages: list[AnyMessage], summary: str = "") -> int:
+    """Estimate the number of tokens of the history and its summary."""
+    return estimate_tokens(summary) + sum(estimate_tokens(str(msg.content)) for msg in messages)
+
+
+def split_history(messages: list[AnyMessage], keep_turns: int = HISTORY_KEEP_TURNS, max_tokens: int = None):
+    """
+    Split messages into older messages and the last keep_turns turns.
+    A turn starts with a doctor message (HumanMessage). If max_tokens is given, fewer
+    turns are kept when they do not fit into it, but always at least the current turn.
+    """
+    # Always keep at least the current turn
+    keep_turns = max(keep_turns, 1)
+    turns = 0
+    tokens = 0
+    split = None
+    for index in range(len(messages) - 1, -1, -1):
+        tokens += estimate_tokens(str(messages[index].content))
+        if isinstance(messages[index], HumanMessage):
+            turns += 1
+            if turns > 1 and max_tokens is not None and tokens > max_tokens:
+                break
+            split = index
+            if turns == keep_turns:
+                break
+    else:
+        return [], messages
+    return messages[:split], messages[split:]
+
+
+def with_summary(summary: str, messages: list[AnyMessage]) -> list[AnyMessage]:
+    """
+    Put the running summary before the verbatim history, as a prefix of its first doctor message.
+    A system message within the conversation breaks chat templates that require alternating roles (Gemma, Mistral).
+    """
+    for index, msg in enumerate(messages):
+        if isinstance(msg, HumanMessage):
+            first = HumanMessage(content=f"{SUMMARY_PREFIX}{summary}\n\n{msg.content}")
+            return messages[:index] + [first] + messages[index + 1:]
+    return [HumanMessage(content=SUMMARY_PREFIX + summary)] + messages
+
+
+@lru_cache(maxsize=1)
+def get_summary_prompt():
+    return ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(
+            """
+            /nothink
+            Du fasst ein Anamnesegespräch zwischen einer Ärztin bzw. einem Arzt und einer Patientin bzw. einem Patienten zusammen.
+            Ergänze die bisherige Zusammenfassung um die neuen Gesprächsabschnitte.
+            * Behalte alle Fragen der Ärztin bzw. des Arztes und alle Informationen, die die Patientin bzw. der Patient preisgegeben hat.
+            * Behalte auffällige Verhaltensweisen der Patientin bzw. des Patienten (z.B. Ausweichen, Missverständnisse).
+            * Schreibe knapp, sachlich und auf Deutsch, ohne Einleitung.
+            """
+        ),
+        HumanMessagePromptTemplate.from_template(
+            "Bisherige Zusammenfassung:\n{summary}\n\nNeue Gesprächsabschnitte:\n{transcript}"
+        ),
+    ])
+
+
+def format_transcript(messages: list[AnyMessage]) -> str:
+    """Format messages as a plain doctor/patient transcript."""
+    lines = []
+    for msg in messages:
+        speaker = "Arzt" if isinstance(msg, HumanMessage) else "Patient"
+        lines.append(f"{speaker}: {msg.content}")
+    return "\n".join(lines)
+
+
+async def summarize_history(llm, summary: str, messages: list[AnyMessage]) -> str:
+    """Fold messages into the running summary and return the updated summary."""
+    chain = get_summary_prompt() | llm
+    response = await chain.ainvoke({
+        "summary": summary or "(noch keine)",
+        "transcript": format_transcript(messages),
+    })
+    logger.debug("Summarized %d messages", len(messages))
+    return str(response.content).strip()
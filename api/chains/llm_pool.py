@@ -0,0 +1,159 @@
+import os
+import time
+import threading
+import logging
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    # Imported on first use, langchain_openai and the openai SDK are slow to import
+    from langchain_openai import ChatOpenAI
+
+# Load env variables, the ChatAI settings may be set in a .env file
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger('llm_pool')
+
+# ChatAI endpoint, requests to the patient and rating models fail until both are set
+CHATAI_API_URL = os.environ.get("CHATAI_API_URL")
+CHATAI_API_KEY = os.environ.get("CHATAI_API_KEY")
+if not CHATAI_API_URL or not CHATAI_API_KEY:
+    logger.error("CHATAI_API_URL or CHATAI_API_KEY is not set, LLM calls will fail")
+
+# Connection pool limits for the shared ChatAI HTTP client
+MAX_CONNECTIONS = int(os.environ.get("CHATAI_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("CHATAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.environ.get("CHATAI_KEEPALIVE_EXPIRY", "60"))
+REQUEST_TIMEOUT = float(os.environ.get("CHATAI_TIMEOUT", "120"))
+# Retries of failed ChatAI calls, chat turns are already limited per model by admission control
+MAX_RETRIES = int(os.environ.get("CHATAI_MAX_RETRIES", "2"))
+
+# If set to a list, the seconds until the response headers of ChatAI calls made in the current context are appended to it
+upstream_connect_times: ContextVar[Optional[list]] = ContextVar("upstream_connect_times", default=None)
+
+_lock = threading.Lock()
+_http_async_client = None
+_clients = {}
+_hits = 0
+_misses = 0
+
+
+def _freeze(value):
+    """Turn lists and dicts into hashable tuples so they can be part of a cache key."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+async def _mark_request(request: httpx.Request):
+    if upstream_connect_times.get() is not None:
+        request.extensions["symptex_started"] = time.perf_counter()
+
+
+async def _record_response(response: httpx.Response):
+    times = upstream_connect_times.get()
+    started = response.request.extensions.get("symptex_started")
+    if times is not None and started is not None:
+        times.append(time.perf_counter() - started)
+
+
+class ChatAINotConfiguredError(RuntimeError):
+    """Raised when an LLM is requested but CHATAI_API_URL or CHATAI_API_KEY is not set."""
+
+
+def chatai_configured() -> bool:
+    return bool(CHATAI_API_URL and CHATAI_API_KEY)
+
+
+def chatai_credentials() -> dict:
+    """Base URL and key of ChatAI as ChatOpenAI parameters, raises ChatAINotConfiguredError if unset."""
+    if not chatai_configured():
+        raise ChatAINotConfiguredError("CHATAI_API_URL and CHATAI_API_KEY must be set")
+    return {"openai_api_base": CHATAI_API_URL, "openai_api_key": CHATAI_API_KEY}
+
+
+def get_http_async_client() -> httpx.AsyncClient:
+    """Get the process-wide async HTTP client shared by all ChatOpenAI instances."""
+    global _http_async_client
+    with _lock:
+        if _http_async_client is None or _http_async_client.is_closed:
+            _http_async_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=10.0),
+                event_hooks={"request": [_mark_request], "response": [_record_response]},
+            )
+            logger.debug("Created shared ChatAI HTTP client")
+        return _http_async_client
+
+
+def get_pooled_llm(**params) -> "ChatOpenAI":
+    """
+    Get a ChatOpenAI instance for the given parameters from the registry.
+
+    Instances are keyed by their full parameter set (model, sampling params, ...),
+    so every call with the same arguments returns the same object. All instances
+    share one async HTTP connection pool with keep-alive.
+    """
+    global _hits, _misses
+    key = _freeze(params)
+    with _lock:
+        llm = _clients.get(key)
+        if llm is not None:
+            _hits += 1
+            return llm
+        _misses += 1
+
+    from langchain_openai import ChatOpenAI
+
+    llm = ChatOpenAI(http_async_client=get_http_async_client(), **params)
+    with _lock:
+        # Another caller may have built the same client in the meantime
+        return _clients.setdefault(key, llm)
+
+
+def pool_stats() -> dict:
+    """Return registry and connection pool statistics."""
+    with _lock:
+        stats = {
+            "clients": len(_clients),
+            "hits": _hits,
+            "misses": _misses,
+            "limits": {
+                "max_connections": MAX_CONNECTIONS,
+                "max_keepalive_connections": MAX_KEEPALIVE_CONNECTIONS,
+                "keepalive_expiry": KEEPALIVE_EXPIRY,
+            },
+        }
+        client = _http_async_client
+
+    # httpcore does not expose pool state publicly, so read it defensively
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    stats["connections"] = {
+        "open": len(connections),
+        "idle": sum(1 for conn in connections if conn.is_idle()),
+        "active": sum(1 for conn in connections if not conn.is_idle()),
+    }
+    return stats
+
+
+async def aclose_pool():
+    """Close the shared HTTP client and drop all cached ChatOpenAI instances."""
+    global _http_async_client
+    with _lock:
+        client = _http_async_client
+        _http_async_client = None
+        _clients.clear()
+    if client is not None and not client.is_closed:
+        await client.aclose()
+        logger.debug("Closed shared ChatAI HTTP client")
@@ -0,0 +1,77 @@
+import os
+import json
+import random
+import logging
+from contextlib import nullcontext
+
+# Default level of all loggers, and levels per logger as JSON object, e.g. LOG_LEVELS='{"chat": "DEBUG", "timing": "INFO"}'
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "WARNING").upper()
+LOG_LEVELS = {name: level.upper() for name, level in json.loads(os.environ.get("LOG_LEVELS", "{}")).items()}
+# Level of the 'timing' logger, INFO logs the phase durations of every request, LOG_LEVELS takes precedence
+TIMING_LOG_LEVEL = os.environ.get("TIMING_LOG_LEVEL", "INFO").upper()
+# Logged values (messages, prompts, transcripts) are cut to this many characters
+LOG_MAX_CHARS = int(os.environ.get("LOG_MAX_CHARS", "200"))
+# Fraction of chat turns and evaluations traced to LangSmith when tracing is enabled, decided once per request
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "1.0"))
+
+_TRACING_ENV_VARS = ("LANGSMITH_TRACING_V2", "LANGCHAIN_TRACING_V2", "LANGSMITH_TRACING", "LANGCHAIN_TRACING")
+
+
+def configure_logging():
+    """Set the level of the root logger, of the 'timing' logger and of the loggers in LOG_LEVELS."""
+    root = logging.getLogger()
+    if not root.handlers:
+        logging.basicConfig(format="%(levelname)s:    %(name)s: %(message)s")
+    root.setLevel(LOG_LEVEL)
+    logging.getLogger("timing").setLevel(TIMING_LOG_LEVEL)
+    for name, level in LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+
+class _Truncated:
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = str(self.value)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... ({len(text)} chars)"
+
+
+def truncate(value, limit: int = None) -> _Truncated:
+    """Log argument that is converted to a string and cut to LOG_MAX_CHARS only when the record is emitted."""
+    return _Truncated(value, LOG_MAX_CHARS if limit is None else limit)
+
+
+def tracing_enabled() -> bool:
+    """Whether LangSmith tracing is switched on in the environment."""
+    return any(os.environ.get(name, "").lower() == "true" for name in _TRACING_ENV_VARS)
+
+
+def traceable(**kwargs):
+    """langsmith.traceable if tracing is enabled, otherwise a decorator that returns the function unchanged."""
+    if not tracing_enabled():
+        return lambda func: func
+    import langsmith as ls
+
+    return ls.traceable(**kwargs)
+
+
+def sample_trace() -> bool:
+    """Head-based sampling decision for one request, False if tracing is disabled."""
+    if not tracing_enabled():
+        return False
+    return TRACE_SAMPLE_RATE >= 1.0 or random.random() < TRACE_SAMPLE_RATE
+
+
+def tracing_scope(sampled: bool):
+    """Context in which LangChain and LangSmith runs are traced only if the request was sampled."""
+    if sampled or not tracing_enabled():
+        return nullcontext()
+    import langsmith as ls
+
+    return ls.tracing_context(enabled=False)
@@ -1,10 +1,78 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, AIMessagePromptTemplate
 from langchain_core.prompts.chat import SystemMessagePromptTemplate
 from langchain_core.prompts import MessagesPlaceholder
+import hashlib
+import os
+import re
+import unicodedata
+
+from chains.cache import LRUCache
+
+# Compiled prompt templates keyed by (condition, talkativeness, patient details hash)
+PROMPT_CACHE_SIZE = int(os.environ.get("PROMPT_CACHE_SIZE", "256"))
+_prompt_cache = LRUCache(maxsize=PROMPT_CACHE_SIZE)
+# "canonical" renders the static part of a prompt (system prompt and few-shots) as literal messages with
+# normalized whitespace, so every turn sends a byte-identical prefix that backends can serve from their
+# prefix (KV) cache. "legacy" sends the templates as written.
+PROMPT_LAYOUT = os.environ.get("PROMPT_LAYOUT", "canonical").lower()
+
+# Patient conditions and talkativeness levels accepted by the chat endpoints
+CONDITIONS = ("default", "alzheimer", "schwerhörig", "verdrängung")
+TALKATIVENESS_LEVELS = ("kurz angebunden", "ausgewogen", "ausschweifend")
+
+
+def _details_hash(patient_details: str) -> str:
+    return hashlib.sha256(patient_details.encode("utf-8")).hexdigest()
+
 
 def get_prompt(patient_condition: str, talkativeness: str, patient_details: str) -> ChatPromptTemplate:
     """
     Returns the appropriate prompt template based on the patient's condition and talkativeness.
+    Compiled templates are cached, so repeated turns of a session skip template parsing.
+    """
+    key = (patient_condition, talkativeness, _details_hash(patient_details))
+    prompt = _prompt_cache.get(key)
+    if prompt is None:
+        prompt = build_prompt(patient_condition, talkativeness, patient_details)
+        if PROMPT_LAYOUT == "canonical":
+            prompt = canonicalize_prompt(prompt)
+        _prompt_cache.set(key, prompt)
+    return prompt
+
+
+def normalize_text(text: str) -> str:
+    """Normalize line endings, unicode form, indentation and blank lines of a prompt text."""
+    text = unicodedata.normalize("NFC", text.replace("\r\n", "\n"))
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+_LITERAL_MESSAGES = {
+    SystemMessagePromptTemplate: SystemMessage,
+    HumanMessagePromptTemplate: HumanMessage,
+    AIMessagePromptTemplate: AIMessage,
+}
+
+
+def canonicalize_prompt(prompt: ChatPromptTemplate) -> ChatPromptTemplate:
+    """
+    Replace the message templates of a prompt by literal messages with normalized text.
+    The templates are fully rendered when they are built, only the history placeholder stays dynamic.
+    """
+    messages = []
+    for message in prompt.messages:
+        literal = _LITERAL_MESSAGES.get(type(message))
+        if literal is None:
+            messages.append(message)
+        else:
+            messages.append(literal(content=normalize_text(message.prompt.template)))
+    return ChatPromptTemplate.from_messages(messages)
+
+
+def build_prompt(patient_condition: str, talkativeness: str, patient_details: str) -> ChatPromptTemplate:
+    """
+    Builds a new prompt template based on the patient's condition and talkativeness.
     """
     
     if patient_condition == "schwerhörig":
@@ -17,6 +85,22 @@ def get_prompt(patient_condition: str, talkativeness: str, patient_details: str)
         return PROMPTS["default"](talkativeness.capitalize(), patient_details)
 
 
+def invalidate_prompt_cache(patient_details: str = None) -> int:
+    """
+    Drops cached templates for the given patient details, or all templates if none are given.
+    Call this when a patient file changes. Returns the number of dropped templates.
+    """
+    if patient_details is None:
+        return _prompt_cache.invalidate()
+    details_hash = _details_hash(patient_details)
+    return _prompt_cache.invalidate(lambda key: key[2] == details_hash)
+
+
+def prompt_cache_stats() -> dict:
+    """Returns size and hit/miss counters of the prompt cache."""
+    return _prompt_cache.stats()
+
+
 def default_prompt(talkativeness: str, patient_details: str):
     return ChatPromptTemplate.from_messages(
         [
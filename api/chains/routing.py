@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+# Set up logging
+logger = logging.getLogger('routing')
+
+# Fallback model per model as JSON object, e.g. ROUTING_FALLBACKS='{"qwen3-235b-a22b": "llama-3.3-70b-instruct"}'.
+# Models without a fallback are neither hedged nor failed over.
+ROUTING_FALLBACKS = json.loads(os.environ.get("ROUTING_FALLBACKS", "{}"))
+# Number of recent calls per model used for latency percentiles and the error rate
+ROUTING_WINDOW = int(os.environ.get("ROUTING_WINDOW", "100"))
+ROUTING_MIN_SAMPLES = int(os.environ.get("ROUTING_MIN_SAMPLES", "20"))
+# The hedged request is sent after the p95 time to first token, bounded by min and max seconds,
+# and after HEDGE_DEFAULT_DELAY while fewer than ROUTING_MIN_SAMPLES are known
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", "5"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "1"))
+HEDGE_MAX_DELAY = float(os.environ.get("HEDGE_MAX_DELAY", "20"))
+# The circuit opens after this many consecutive failures or this error rate, and lets a trial call through after CIRCUIT_OPEN_SECONDS
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_ERROR_RATE = float(os.environ.get("CIRCUIT_ERROR_RATE", "0.5"))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "30"))
+
+
+class ModelUnavailableError(Exception):
+    """Raised when the circuits of a model and its fallback are open."""
+
+
+def _percentile(values, fraction: float):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class ModelHealth:
+    """Rolling time to first token, error rate and circuit breaker of one model."""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.ttft = deque(maxlen=ROUTING_WINDOW)
+        self.outcomes = deque(maxlen=ROUTING_WINDOW)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.short_circuited = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < CIRCUIT_OPEN_SECONDS:
+            return "open"
+        return "half_open"
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for the first token before a hedged request is sent."""
+        if len(self.ttft) < ROUTING_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return min(max(_percentile(self.ttft, 0.95), HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+    def allow_request(self) -> bool:
+        """Whether a call may be sent, a half-open circuit lets one trial call through."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        self.short_circuited += 1
+        return False
+
+    def record_first_token(self, seconds: float):
+        self.ttft.append(seconds)
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.outcomes.append(True)
+        self.trial_running = False
+        if self.opened_at is not None:
+            # Trial call succeeded, start over with a clean window
+            logger.info("Closing circuit of model %s", self.model)
+            self.opened_at = None
+            self.outcomes.clear()
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.outcomes.append(False)
+        self.trial_running = False
+        if self.opened_at is not None:
+            # Trial call failed, keep the circuit open
+            self.opened_at = time.monotonic()
+        elif self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD or (
+            len(self.outcomes) >= ROUTING_MIN_SAMPLES and self.error_rate() >= CIRCUIT_ERROR_RATE
+        ):
+            logger.warning("Opening circuit of model %s after %d consecutive failures", self.model, self.consecutive_failures)
+            self.opened_at = time.monotonic()
+
+    def record_cancelled(self, waited: Optional[float] = None):
+        """
+        Record a cancelled call, waited are the seconds it ran without a first token.
+        They are a lower bound of its time to first token. Without them, calls beaten by
+        a hedge would be missing from the percentiles and the hedge delay would keep dropping.
+        """
+        self.trial_running = False
+        if waited is not None:
+            self.ttft.append(waited)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "calls": len(self.outcomes),
+            "error_rate": round(self.error_rate(), 3),
+            "ttft_p50": round(_percentile(self.ttft, 0.5), 3) if self.ttft else None,
+            "ttft_p95": round(_percentile(self.ttft, 0.95), 3) if self.ttft else None,
+            "hedge_delay": round(self.hedge_delay(), 3),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "short_circuited": self.short_circuited,
+        }
+
+
+_health = {}
+
+
+def get_model_health(model: str) -> ModelHealth:
+    health = _health.get(model)
+    if health is None:
+        health = _health[model] = ModelHealth(model)
+    return health
+
+
+class _Attempt:
+    """A streaming call to one model, consumed through a queue."""
+
+    _END = object()
+
+    def __init__(self, model: str, llm: BaseChatModel, messages: list[BaseMessage], config: dict, **kwargs):
+        self.model = model
+        self.health = get_model_health(model)
+        self.queue = asyncio.Queue()
+        # Resolved with None on the first token, or with the error of a failed call
+        self.first = asyncio.get_running_loop().create_future()
+        self.error = None
+        self._started = time.perf_counter()
+        self.task = asyncio.create_task(self._run(llm, messages, config, **kwargs))
+
+    def _resolve_first(self, error: Optional[Exception] = None):
+        if not self.first.done():
+            self.first.set_result(error)
+
+    async def _run(self, llm, messages, config, **kwargs):
+        try:
+            async for chunk in llm.astream(messages, config, **kwargs):
+                if not self.first.done() and (chunk.content or chunk.tool_call_chunks):
+                    self.health.record_first_token(time.perf_counter() - self._started)
+                    self._resolve_first()
+                self.queue.put_nowait(chunk)
+            self.health.record_success()
+            self._resolve_first()
+            self.queue.put_nowait(self._END)
+        except asyncio.CancelledError:
+            self.health.record_cancelled(None if self.first.done() else time.perf_counter() - self._started)
+            raise
+        except Exception as e:
+            self.health.record_failure()
+            self._resolve_first(e)
+            self.queue.put_nowait(e)
+
+    async def chunks(self) -> AsyncIterator[AIMessageChunk]:
+        while (item := await self.queue.get()) is not self._END:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+async def stream_with_fallback(
+    model: str,
+    llm_factory: Callable[[str], BaseChatModel],
+    messages: list[BaseMessage],
+    config: dict,
+    **kwargs,
+) -> AsyncIterator[AIMessageChunk]:
+    """
+    Stream a model call with circuit breaking and, if a fallback model is configured,
+    a hedged request to the fallback when the first token is late or the call fails.
+    The first call to produce a token wins, the other one is cancelled.
+    """
+    fallback = ROUTING_FALLBACKS.get(model)
+    health = get_model_health(model)
+    attempts = []
+
+    def start(target: str):
+        attempts.append(_Attempt(target, llm_factory(target), messages, config, **kwargs))
+
+    try:
+        if health.allow_request():
+            start(model)
+        elif fallback and get_model_health(fallback).allow_request():
+            logger.debug("Circuit of model %s is open, routing to %s", model, fallback)
+            start(fallback)
+            fallback = None
+        else:
+            raise ModelUnavailableError(f"Model {model} is currently unavailable")
+
+        started = time.monotonic()
+        winner = None
+        while winner is None:
+            waiting = {attempt.first: attempt for attempt in attempts if attempt.error is None}
+            can_hedge = fallback is not None and len(attempts) == 1
+            timeout = None
+            if can_hedge and waiting:
+                timeout = max(health.hedge_delay() - (time.monotonic() - started), 0)
+
+            done = set()
+            if waiting:
+                done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                attempt = waiting[future]
+                if future.result() is None:
+                    winner = attempt
+                    break
+                attempt.error = future.result()
+            if winner is not None:
+                break
+
+            if can_hedge and (not done or not any(attempt.error is None for attempt in attempts)):
+                # First token is late or the call failed, send the request to the fallback as well
+                if get_model_health(fallback).allow_request():
+                    logger.debug("Hedging request to model %s with %s", model, fallback)
+                    health.hedges += 1
+                    start(fallback)
+                    continue
+                fallback = None
+            if not any(attempt.error is None for attempt in attempts):
+                raise attempts[0].error
+
+        if winner.model != model:
+            health.hedge_wins += 1
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.task.cancel()
+        async for chunk in winner.chunks():
+            yield chunk
+    finally:
+        for attempt in attempts:
+            attempt.task.cancel()
+
+
+class RoutedChatModel(BaseChatModel):
+    """
+    Chat model that routes calls of a model through stream_with_fallback.
+    Calls of the underlying models are tagged "nostream", only the tokens of the
+    winning call are streamed, as tokens of this model.
+    """
+
+    model: str
+    llm_factory: Callable[[str], Any]
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed-chat-model"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.model, "fallback": ROUTING_FALLBACKS.get(self.model)}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        raise NotImplementedError("RoutedChatModel only supports async calls")
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        # Callbacks of the surrounding run are inherited from the context
+        config = {"tags": ["nostream"]}
+        if stop is not None:
+            kwargs["stop"] = stop
+        async for chunk in stream_with_fallback(self.model, self.llm_factory, messages, config, **kwargs):
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return await agenerate_from_stream(self._astream(messages, stop, run_manager, **kwargs))
+
+
+def routing_stats() -> dict:
+    """Return latency, error rate and circuit state per model."""
+    return {model: health.stats() for model, health in _health.items()}
@@ -3,22 +3,22 @@ from dotenv import load_dotenv
 
 from langchain_core.messages import AnyMessage
 from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import InMemorySaver
 from langgraph.graph import START, StateGraph, END
 from langgraph.graph.message import add_messages
-import langsmith as ls
 from typing import Annotated
 from typing_extensions import TypedDict
 import logging
 
 from api.chains.prompts import get_prompt
+from api.chains.llm_pool import MAX_RETRIES, get_pooled_llm
+from api.chains.checkpointer import checkpointer
+from api.chains.observability import traceable
 
 # Load env variables for LangSmith to work
 load_dotenv()
 
 # Set up logging
 logger = logging.getLogger('symptex_chain')
-logger.setLevel(logging.DEBUG)
 
 class CustomState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
@@ -34,18 +34,18 @@ if not CHATAI_API_URL or not CHATAI_API_KEY:
     raise ValueError("ERROR: Environment variables not set")
 
 def get_llm(model: str) -> ChatOpenAI:
-    """Get the LLM instance."""
-    return ChatOpenAI(
+    """Get the pooled LLM instance for the given model."""
+    return get_pooled_llm(
         openai_api_base=CHATAI_API_URL,
         openai_api_key=CHATAI_API_KEY,
         model=model,
         temperature=0.7,
         top_p=0.8,
         #max_tokens=1024,
-        max_retries=2,
+        max_retries=MAX_RETRIES,
     )
 
-@ls.traceable(
+@traceable(
     run_type="llm",
     name="Patient LLM Call Decorator",
 )
@@ -55,7 +55,7 @@ async def call_patient_model(state: CustomState):
     condition = state.get("condition")
     talkativeness = state.get("talkativeness")
 
-    logger.debug("Calling patient model {model} with condition {condition} and talkativeness {talkativeness}")
+    logger.debug("Calling patient model %s with condition %s and talkativeness %s", model, condition, talkativeness)
 
     # Get appropriate prompt
     prompt = get_prompt(condition, talkativeness)
@@ -81,8 +81,5 @@ workflow.add_node("patient_model", call_patient_model)
 workflow.add_edge(START, "patient_model")
 workflow.add_edge("patient_model", END)
 
-# Add memory
-memory = InMemorySaver()
-
-# Compile into LangChain runnable
-symptex_model = workflow.compile(checkpointer=memory)
+# Compile into LangChain runnable with the shared session checkpointer
+symptex_model = workflow.compile(checkpointer=checkpointer)
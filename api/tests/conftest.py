@@ -0,0 +1,81 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+
+class FakeChatModel(BaseChatModel):
+    """Streams a fixed answer after a delay and with a pause between tokens, or fails. Counts its calls."""
+
+    answer: str
+    delay: float = 0.0
+    pause: float = 0.0
+    fail: bool = False
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-test-model"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("backend down")
+        for word in self.answer.split(" "):
+            await asyncio.sleep(self.pause)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content="", usage_metadata={"input_tokens": 12, "output_tokens": 3, "total_tokens": 15}
+        ))
+
+
+@pytest.fixture
+def run_api(tmp_path, monkeypatch):
+    """
+    Run test(client, sessionmaker) against the chat router and a SQLite database that enforces foreign keys.
+    client is an httpx.AsyncClient for the app, sessionmaker opens sessions on the same database.
+    """
+    pytest.importorskip("aiosqlite")
+    from app.db.db import Base, get_db
+    from app.db import models  # noqa: F401 register tables
+    from app.routers import chat
+
+    def run(test):
+        async def main():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'api.db'}")
+
+            @event.listens_for(engine.sync_engine, "connect")
+            def enable_foreign_keys(dbapi_connection, connection_record):
+                dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            sessionmaker = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+            async def override_get_db():
+                async with sessionmaker() as db:
+                    yield db
+
+            monkeypatch.setattr(chat, "SessionLocal", sessionmaker)
+            app = FastAPI()
+            app.include_router(chat.router, prefix="/api/v1")
+            app.dependency_overrides[get_db] = override_get_db
+            try:
+                async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                    return await test(client, sessionmaker)
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,142 @@
+# Local OpenAI-compatible chat completions server for load tests, no ChatAI quota needed.
+# Run: python -m tests.load.mock_backend --port 8900 --token-rate 50 --first-token-delay 0.3
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Tokens per second streamed per answer
+MOCK_TOKEN_RATE = float(os.environ.get("MOCK_TOKEN_RATE", "50"))
+# Seconds until the first token is sent
+MOCK_FIRST_TOKEN_DELAY = float(os.environ.get("MOCK_FIRST_TOKEN_DELAY", "0.3"))
+# Fraction of requests answered with 500
+MOCK_ERROR_RATE = float(os.environ.get("MOCK_ERROR_RATE", "0"))
+# Answer length in tokens if the request sets no max. tokens
+MOCK_ANSWER_TOKENS = int(os.environ.get("MOCK_ANSWER_TOKENS", "80"))
+
+WORDS = (
+    "Ich", "habe", "seit", "gestern", "Schmerzen", "in", "der", "rechten", "Hüfte", "und", "kann",
+    "kaum", "laufen", "Mir", "ist", "auch", "etwas", "schwindelig", "Das", "weiß", "ich", "nicht", "genau",
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text, ~4 characters per token."""
+    return max(1, len(text) // 4)
+
+
+def create_app(token_rate: float = MOCK_TOKEN_RATE, first_token_delay: float = MOCK_FIRST_TOKEN_DELAY,
+               error_rate: float = MOCK_ERROR_RATE, answer_tokens: int = MOCK_ANSWER_TOKENS) -> FastAPI:
+    """Create the mock server with the given token rate, first-token delay and error rate."""
+    app = FastAPI(title="Symptex mock chat completions")
+    # System prompts seen before, their tokens are reported as cached on repeated requests
+    seen_prefixes = set()
+    stats = {"requests": 0, "errors": 0, "tokens": 0}
+
+    def prompt_usage(messages: list) -> dict:
+        prompt_tokens = sum(estimate_tokens(str(message.get("content") or "")) for message in messages)
+        cached_tokens = 0
+        if messages and messages[0].get("role") == "system":
+            system = str(messages[0].get("content") or "")
+            digest = hashlib.sha256(system.encode("utf-8")).hexdigest()
+            if digest in seen_prefixes:
+                cached_tokens = estimate_tokens(system)
+            seen_prefixes.add(digest)
+        return {"prompt_tokens": prompt_tokens, "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+
+    def answer(limit: int) -> list[str]:
+        return [(" " if index else "") + random.choice(WORDS) for index in range(limit)]
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": []}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        if random.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"message": "Injected error", "type": "server_error"}}, status_code=500)
+
+        model = body.get("model", "mock")
+        max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+        limit = min(max_tokens, answer_tokens) if max_tokens else answer_tokens
+        finish_reason = "length" if max_tokens and max_tokens <= answer_tokens else "stop"
+        tokens = answer(limit)
+        usage = prompt_usage(body.get("messages", []))
+        usage.update(completion_tokens=len(tokens), total_tokens=usage["prompt_tokens"] + len(tokens))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(first_token_delay + len(tokens) / token_rate)
+            stats["tokens"] += len(tokens)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": usage,
+            }
+
+        def frame(choices: list, **extra) -> str:
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                       "model": model, "choices": choices, **extra}
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(first_token_delay)
+            started = time.perf_counter()
+            yield frame([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            for index, token in enumerate(tokens):
+                # Pace by the total elapsed time, so slow writes do not lower the token rate
+                delay = started + index / token_rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                stats["tokens"] += 1
+                yield frame([{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+            yield frame([{"index": 0, "delta": {}, "finish_reason": finish_reason}])
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield frame([], usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--token-rate", type=float, default=MOCK_TOKEN_RATE, help="tokens per second per answer")
+    parser.add_argument("--first-token-delay", type=float, default=MOCK_FIRST_TOKEN_DELAY, help="seconds until the first token")
+    parser.add_argument("--error-rate", type=float, default=MOCK_ERROR_RATE, help="fraction of requests answered with 500")
+    parser.add_argument("--answer-tokens", type=int, default=MOCK_ANSWER_TOKENS, help="answer length without max. tokens")
+    args = parser.parse_args()
+
+    app = create_app(args.token_rate, args.first_token_delay, args.error_rate, args.answer_tokens)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
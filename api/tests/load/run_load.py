@@ -0,0 +1,261 @@
+# Offline load test: starts the mock chat completions server and the API against a throwaway
+# database, drives concurrent simulated students through /chat and /eval and reports latencies.
+# Run in the api/ folder: python -m tests.load.run_load --students 20 --turns 5
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+QUESTIONS = [
+    "Guten Tag, was führt Sie heute zu uns?",
+    "Seit wann haben Sie die Beschwerden?",
+    "Haben Sie Vorerkrankungen?",
+    "Welche Medikamente nehmen Sie regelmäßig ein?",
+    "Haben Sie Allergien?",
+    "Gibt es Krankheiten in Ihrer Familie?",
+    "Rauchen Sie oder trinken Sie Alkohol?",
+    "Wie ist Ihre Wohnsituation?",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, fraction: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def histogram_totals(snapshot: dict, name: str) -> tuple:
+    """Sum and count of a histogram over all label values of a /stats metrics snapshot."""
+    values = snapshot.get(name, {}).values()
+    return sum(value["sum"] for value in values), sum(value["count"] for value in values)
+
+
+async def seed_database(database_url: str) -> int:
+    """Create the schema in the load test database and add a patient file, return its id."""
+    # The database URL is read when app.db.db is imported
+    os.environ["DATABASE_URL"] = database_url
+    from app.db.db import SessionLocal, engine, init_db
+    from app.db.models import Anamnesis, PatientFile
+
+    await init_db()
+    async with SessionLocal() as db:
+        patient_file = PatientFile(first_name="Anna", last_name="Zank", height=165, weight=56.0,
+                                   gender_identity="weiblich", gender_medical="weiblich", ethnic_origin="kaukasisch")
+        patient_file.anamneses = [
+            Anamnesis(category="Krankheitsverlauf", answer="Heute morgen auf die rechte Seite gestürzt"),
+            Anamnesis(category="Vorerkrankungen", answer="Art. Hypertonie, senile Alzheimer Demenz"),
+            Anamnesis(category="Dauermedikation", answer="Ramipril 5mg 1-0-1, Donepezil 10mg 0-0-1"),
+            Anamnesis(category="Allergien", answer="keine"),
+        ]
+        db.add(patient_file)
+        await db.commit()
+        patient_file_id = patient_file.id
+    await engine.dispose()
+    return patient_file_id
+
+
+def start_process(args: list, env: dict, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen([sys.executable, *args], env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Process for {url} exited with code {process.returncode}")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout} seconds")
+
+
+async def chat_turn(client: httpx.AsyncClient, payload: dict) -> dict:
+    """Send one chat turn and return client-side timings."""
+    started = time.perf_counter()
+    first = None
+    text = ""
+    async with client.stream("POST", "/api/v1/chat", json=payload) as response:
+        async for chunk in response.aiter_text():
+            if first is None and chunk:
+                first = time.perf_counter() - started
+            text += chunk
+    total = time.perf_counter() - started
+    failed = response.status_code != 200 or text.startswith("Entschuldigung, es ist ein Fehler aufgetreten")
+    return {"ttft": first, "total": total, "words": len(text.split()), "failed": failed, "status": response.status_code}
+
+
+async def run_student(client: httpx.AsyncClient, args, patient_file_id: int, results: list, evals: list):
+    """One simulated student: args.turns chat turns, then an evaluation of the session."""
+    session_id = str(uuid.uuid4())
+    for turn in range(args.turns):
+        payload = {
+            "message": QUESTIONS[turn % len(QUESTIONS)],
+            "model": args.model,
+            "condition": args.condition,
+            "talkativeness": args.talkativeness,
+            "patient_file_id": patient_file_id,
+            "session_id": session_id,
+        }
+        try:
+            results.append(await chat_turn(client, payload))
+        except httpx.HTTPError as e:
+            results.append({"ttft": None, "total": None, "words": 0, "failed": True, "status": type(e).__name__})
+        if args.think_time:
+            await asyncio.sleep(args.think_time)
+    if args.eval:
+        started = time.perf_counter()
+        try:
+            response = await client.post(f"/api/v1/eval/{session_id}")
+            evals.append({"total": time.perf_counter() - started, "failed": response.status_code != 200})
+        except httpx.HTTPError:
+            evals.append({"total": None, "failed": True})
+
+
+def summarize(label: str, values: list) -> str:
+    values = [value for value in values if value is not None]
+    if not values:
+        return f"{label:<28} -"
+    return (f"{label:<28} p50 {percentile(values, 0.5) * 1000:8.1f} ms   p95 {percentile(values, 0.95) * 1000:8.1f} ms"
+            f"   p99 {percentile(values, 0.99) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms")
+
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="symptex-load-")
+    database_url = args.database_url or f"sqlite+aiosqlite:///{os.path.join(workdir, 'load.db')}"
+    mock_port, api_port = free_port(), free_port()
+    patient_file_id = await seed_database(database_url)
+
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "CHATAI_API_URL": f"http://127.0.0.1:{mock_port}/v1",
+        "CHATAI_API_KEY": "load-test",
+        "LANGCHAIN_TRACING_V2": "false",
+        "PYTHONPATH": os.getcwd(),
+    }
+    mock = start_process([
+        "-m", "tests.load.mock_backend", "--port", str(mock_port), "--token-rate", str(args.token_rate),
+        "--first-token-delay", str(args.first_token_delay), "--error-rate", str(args.error_rate),
+        "--answer-tokens", str(args.answer_tokens),
+    ], env, os.path.join(workdir, "mock.log"))
+    api = start_process([
+        "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(api_port), "--log-level", "warning",
+    ], env, os.path.join(workdir, "api.log"))
+
+    try:
+        await wait_until_up(f"http://127.0.0.1:{mock_port}/v1/models", mock)
+        await wait_until_up(f"http://127.0.0.1:{api_port}/api/v1/ready", api)
+
+        limits = httpx.Limits(max_connections=args.students * 2, max_keepalive_connections=args.students * 2)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", timeout=args.timeout, limits=limits) as client:
+            if args.warmup:
+                # Measure warm workers, otherwise the first turns include loading the chains
+                await client.post("/api/v1/warmup")
+            before = (await client.get("/api/v1/stats")).json()["metrics"]
+            results, evals = [], []
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                run_student(client, args, patient_file_id, results, evals) for _ in range(args.students)
+            ))
+            wall = time.perf_counter() - started
+            after = (await client.get("/api/v1/stats")).json()["metrics"]
+    finally:
+        for process in (api, mock):
+            process.terminate()
+        for process in (api, mock):
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    db_sum = histogram_totals(after, "db_query_seconds")[0] - histogram_totals(before, "db_query_seconds")[0]
+    db_count = histogram_totals(after, "db_query_seconds")[1] - histogram_totals(before, "db_query_seconds")[1]
+    tokens = histogram_totals(after, "chat_response_tokens")[0] - histogram_totals(before, "chat_response_tokens")[0]
+    turns = len(results)
+    decode_rates = [
+        result["words"] / (result["total"] - result["ttft"])
+        for result in results
+        if result["ttft"] is not None and result["total"] - result["ttft"] > 0 and result["words"] > 1
+    ]
+    return {
+        "students": args.students,
+        "turns": turns,
+        "failed_turns": sum(result["failed"] for result in results),
+        "evaluations": len(evals),
+        "failed_evaluations": sum(evaluation["failed"] for evaluation in evals),
+        "wall_seconds": wall,
+        "turns_per_second": turns / wall if wall else None,
+        "tokens_per_second": tokens / wall if wall else None,
+        "stream_tokens_per_second_p50": percentile(decode_rates, 0.5),
+        "ttft": [result["ttft"] for result in results],
+        "turn_latency": [result["total"] for result in results],
+        "eval_latency": [evaluation["total"] for evaluation in evals],
+        "db_seconds_per_turn": db_sum / turns if turns else None,
+        "db_queries_per_turn": db_count / turns if turns else None,
+        "logs": workdir,
+    }
+
+
+def report(result: dict):
+    print(f"Students: {result['students']}, turns: {result['turns']} ({result['failed_turns']} failed), "
+          f"evaluations: {result['evaluations']} ({result['failed_evaluations']} failed), wall: {result['wall_seconds']:.1f} s")
+    print(f"Throughput: {result['turns_per_second']:.2f} turns/s, {result['tokens_per_second']:.1f} tokens/s")
+    if result["stream_tokens_per_second_p50"] is not None:
+        print(f"Tokens/s per stream (p50): {result['stream_tokens_per_second_p50']:.1f}")
+    print(summarize("Time to first token", result["ttft"]))
+    print(summarize("Turn latency", result["turn_latency"]))
+    print(summarize("Evaluation latency", result["eval_latency"]))
+    if result["db_seconds_per_turn"] is not None:
+        print(f"DB time per turn (incl. evaluations): {result['db_seconds_per_turn'] * 1000:.1f} ms "
+              f"in {result['db_queries_per_turn']:.1f} statements")
+    print(f"Logs: {result['logs']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the chat and evaluation endpoints")
+    parser.add_argument("--students", type=int, default=10, help="concurrent simulated students")
+    parser.add_argument("--turns", type=int, default=5, help="chat turns per student")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds between the turns of a student")
+    parser.add_argument("--eval", action=argparse.BooleanOptionalAction, default=True, help="evaluate each session")
+    parser.add_argument("--warmup", action=argparse.BooleanOptionalAction, default=True, help="warm the API up before the load")
+    parser.add_argument("--model", default="llama-3.3-70b-instruct")
+    parser.add_argument("--condition", default="default")
+    parser.add_argument("--talkativeness", default="ausgewogen")
+    parser.add_argument("--token-rate", type=float, default=50, help="mock tokens per second per answer")
+    parser.add_argument("--first-token-delay", type=float, default=0.3, help="mock seconds until the first token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock requests answered with 500")
+    parser.add_argument("--answer-tokens", type=int, default=80, help="mock answer length")
+    parser.add_argument("--database-url", help="throwaway database, default: SQLite file in a temporary folder")
+    parser.add_argument("--timeout", type=float, default=120, help="client timeout in seconds")
+    parser.add_argument("--json", action="store_true", help="print the raw results as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from app.admission import AdmissionRejected, ModelLimiter
+
+
+def test_limiter_rejects_when_queue_is_full():
+    async def run():
+        limiter = ModelLimiter("test-model", concurrency=1, queue=1)
+        slot = await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await limiter.acquire()
+        assert rejected.value.retry_after >= 1
+
+        limiter.release(slot)
+        limiter.release(await waiter)
+        return limiter.stats()
+
+    stats = asyncio.run(run())
+    assert stats["in_flight"] == 0
+    assert stats["waiting"] == 0
+
+def test_limiter_rejects_after_timeout():
+    async def run():
+        limiter = ModelLimiter("test-model", concurrency=1, queue=5)
+        await limiter.acquire()
+        with pytest.raises(AdmissionRejected):
+            await limiter.acquire(timeout=0.01)
+
+    asyncio.run(run())
+
+def test_chat_response_frees_slot_when_client_is_gone_before_streaming():
+    from app.admission import get_model_limiter
+    from app.routers import chat
+    from app.streaming import cancel_on_disconnect
+    from app.timing import RequestTimer
+
+    async def run():
+        request = chat.ChatRequest(
+            message="Hallo", model="qwq-32b", condition="default",
+            talkativeness="ausgewogen", patient_file_id=1, session_id="s1",
+        )
+        limiter = get_model_limiter(request.model)
+        turn = chat.ChatTurn(request, "", [], [], "", 0, await limiter.acquire(), RequestTimer("chat"))
+
+        async def generate():
+            # Stands in for generate_turn, which releases the slot only once it runs
+            try:
+                yield "Hallo"
+            finally:
+                chat.release_turn(turn)
+
+        async def is_disconnected():
+            return True
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            await asyncio.sleep(0)
+
+        response = chat.TurnStreamingResponse(cancel_on_disconnect(generate(), is_disconnected), turn)
+        await response({"type": "http"}, receive, send)
+        return limiter.in_flight
+
+    assert asyncio.run(run()) == 0
@@ -0,0 +1,25 @@
+import json
+
+from chains import budgets
+
+
+def test_budget_follows_talkativeness_and_model():
+    short = budgets.get_generation_budget("gemma-3-27b-it", "default", "kurz angebunden")
+    long = budgets.get_generation_budget("gemma-3-27b-it", "default", "ausschweifend")
+    thinking = budgets.get_generation_budget("qwq-32b", "default", "kurz angebunden")
+    assert short.max_tokens < long.max_tokens
+    assert thinking.max_tokens > short.max_tokens
+    assert "\nArzt:" in short.stop
+
+def test_budgets_file_overrides_defaults(tmp_path, monkeypatch):
+    budgets_file = tmp_path / "budgets.json"
+    budgets_file.write_text(json.dumps({
+        "condition": {"alzheimer": {"max_tokens": 80, "stop": ["\nPatient:"]}},
+    }))
+    monkeypatch.setattr(budgets, "GENERATION_BUDGETS_FILE", str(budgets_file))
+    monkeypatch.setattr(budgets, "_budgets", budgets.DEFAULT_GENERATION_BUDGETS)
+    monkeypatch.setattr(budgets, "_budgets_mtime", None)
+
+    budget = budgets.get_generation_budget("gemma-3-27b-it", "alzheimer", "ausschweifend")
+    assert budget.max_tokens == 80
+    assert budget.stop == ("\nArzt:", "\nÄrztin:", "\nPatient:")
@@ -0,0 +1,48 @@
+import time
+
+from chains.cache import LRUCache
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_lru_counts_hits_and_misses():
+    cache = LRUCache(maxsize=4)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("missing")
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+def test_lru_expires_entries_after_ttl():
+    cache = LRUCache(maxsize=4, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+def test_lru_invalidates_by_predicate():
+    cache = LRUCache(maxsize=4)
+    cache.set(("default", "ausgewogen", "x"), 1)
+    cache.set(("alzheimer", "ausgewogen", "y"), 2)
+    assert cache.invalidate(lambda key: key[2] == "x") == 1
+    assert cache.get(("default", "ausgewogen", "x")) is None
+    assert cache.get(("alzheimer", "ausgewogen", "y")) == 2
+
+def test_lru_evicts_to_stay_below_max_weight():
+    cache = LRUCache(maxsize=10, weigher=len, max_weight=10)
+    cache.set("a", "xxxx")
+    cache.set("b", "xxxx")
+    cache.set("c", "xxxx")
+    assert cache.get("a") is None
+    assert cache.weight == 8
+    cache.set("b", "x")
+    assert cache.weight == 5
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+
+from langchain_core.messages import HumanMessage
+
+from chains import cassettes
+from conftest import FakeChatModel
+
+
+def setup_cassettes(monkeypatch, tmp_path, mode, speed=1.0):
+    monkeypatch.setattr(cassettes, "LLM_CASSETTE_MODE", mode)
+    monkeypatch.setattr(cassettes, "LLM_CASSETTE_DIR", str(tmp_path))
+    monkeypatch.setattr(cassettes, "LLM_CASSETTE_SPEED", speed)
+    monkeypatch.setattr(cassettes, "_loaded", {})
+    monkeypatch.setattr(cassettes, "_wrappers", {})
+
+def stream(llm, question="Wie geht es Ihnen?", **kwargs):
+    async def run():
+        started = time.perf_counter()
+        chunks = [chunk async for chunk in llm.astream([HumanMessage(question)], **kwargs)]
+        return chunks, time.perf_counter() - started
+    return asyncio.run(run())
+
+def test_replay_plays_back_recorded_chunks(monkeypatch, tmp_path):
+    model = FakeChatModel(answer="Mir geht es gut", pause=0.02)
+    setup_cassettes(monkeypatch, tmp_path, "record")
+    recorded, _ = stream(cassettes.with_cassette(model, "test-model"), max_tokens=50)
+    assert model.calls == 1
+    assert len(list(tmp_path.glob("*.json.gz"))) == 1
+
+    setup_cassettes(monkeypatch, tmp_path, "replay")
+    replayed, seconds = stream(cassettes.with_cassette(model, "test-model"), max_tokens=50)
+    assert model.calls == 1
+    assert "".join(chunk.content for chunk in replayed) == "Mir geht es gut "
+    assert sum(replayed[1:], replayed[0]).usage_metadata["output_tokens"] == 3
+    # Played back at the recorded speed
+    assert seconds >= 0.07
+
+def test_replay_at_full_speed_and_missing_cassette(monkeypatch, tmp_path):
+    model = FakeChatModel(answer="Ja", pause=0.2)
+    setup_cassettes(monkeypatch, tmp_path, "record")
+    stream(cassettes.with_cassette(model, "test-model"))
+
+    setup_cassettes(monkeypatch, tmp_path, "replay", speed=0)
+    _, seconds = stream(cassettes.with_cassette(model, "test-model"))
+    assert seconds < 0.1
+    with pytest.raises(cassettes.CassetteNotFoundError):
+        stream(cassettes.with_cassette(model, "test-model"), question="Haben Sie Allergien?")
+
+def test_cassette_layer_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(cassettes, "LLM_CASSETTE_MODE", "off")
+    model = FakeChatModel(answer="Ja")
+    assert cassettes.with_cassette(model, "test-model") is model
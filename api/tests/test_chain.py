@@ -1,12 +1,23 @@
 import pytest
 import httpx
+import uuid
 
 API_URL = "http://localhost:8000/api/v1/chat"
 
+def chat_request(message: str, condition: str) -> dict:
+    return {
+        "message": message,
+        "model": "llama-3.3-70b-instruct",
+        "condition": condition,
+        "talkativeness": "ausgewogen",
+        "patient_file_id": 3, # Anna Zank
+        "session_id": str(uuid.uuid4()),
+    }
+
 @pytest.mark.asyncio
 async def test_chat_default_condition():
     async with httpx.AsyncClient(timeout=30) as client:
-        response = await client.post(API_URL, json={"message": "Wie geht es Ihnen?", "condition": "default"})
+        response = await client.post(API_URL, json=chat_request("Wie geht es Ihnen?", "default"))
         assert response.status_code == 200
         text = ""
         async for chunk in response.aiter_text():
@@ -16,7 +27,7 @@ async def test_chat_default_condition():
 @pytest.mark.asyncio
 async def test_chat_default_patient():
     async with httpx.AsyncClient(timeout=30) as client:
-        response = await client.post(API_URL, json={"message": "Haben Sie Vorerkrankungen?", "condition": "default"})
+        response = await client.post(API_URL, json=chat_request("Haben Sie Vorerkrankungen?", "default"))
         assert response.status_code == 200
         text = ""
         async for chunk in response.aiter_text():
@@ -26,5 +37,5 @@ async def test_chat_default_patient():
 @pytest.mark.asyncio
 async def test_chat_invalid_condition():
     async with httpx.AsyncClient(timeout=30) as client:
-        response = await client.post(API_URL, json={"message": "Test", "condition": "invalid_condition"})
+        response = await client.post(API_URL, json=chat_request("Test", "invalid_condition"))
         assert response.status_code in (400, 422, 500)
\ No newline at end of file
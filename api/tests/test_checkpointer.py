@@ -0,0 +1,139 @@
+import asyncio
+
+from langgraph.checkpoint.base import empty_checkpoint, get_checkpoint_id
+
+from chains import session_checkpointer as checkpointer_module
+from chains.session_checkpointer import SessionCheckpointer
+
+
+def thread_config(thread_id: str, checkpoint_id: str = None) -> dict:
+    configurable = {"thread_id": thread_id, "checkpoint_ns": ""}
+    if checkpoint_id:
+        configurable["checkpoint_id"] = checkpoint_id
+    return {"configurable": configurable}
+
+def make_checkpoint(version: int, messages: list) -> dict:
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": messages}
+    checkpoint["channel_versions"] = {"messages": version}
+    return checkpoint
+
+async def put(saver, config: dict, version: int, messages: list) -> dict:
+    return await saver.aput(config, make_checkpoint(version, messages), {"step": version}, {"messages": version})
+
+async def hot_tier_checkpointer() -> SessionCheckpointer:
+    """A checkpointer with the hot tier of postgres mode in front of an in-memory backend."""
+    saver = SessionCheckpointer("memory")
+    await saver.open()
+    saver._use_hot_tier = True
+
+    async def latest_version(thread_id):
+        stored = await saver.backend.aget_tuple(thread_config(thread_id))
+        return (get_checkpoint_id(stored.config), len(stored.pending_writes)) if stored else None
+
+    saver._latest_version = latest_version
+    return saver
+
+def test_hot_tier_matches_backend_after_puts_and_writes():
+    async def run():
+        saver = await hot_tier_checkpointer()
+        first = await put(saver, thread_config("t1"), 1, ["Hallo"])
+        second = await put(saver, first, 2, ["Hallo", "Guten Tag"])
+        await saver.aput_writes(second, [("messages", "Wie geht es?")], "task-1")
+        hits = saver.stats()["hot_tier"]["hits"]
+        cached = await saver.aget_tuple(thread_config("t1"))
+        stored = await saver.backend.aget_tuple(thread_config("t1"))
+        return saver.stats()["hot_tier"]["hits"] - hits, cached, stored
+
+    served_from_hot_tier, cached, stored = asyncio.run(run())
+    assert get_checkpoint_id(cached.config) == get_checkpoint_id(stored.config)
+    assert cached.checkpoint["channel_values"] == stored.checkpoint["channel_values"]
+    assert cached.pending_writes == stored.pending_writes
+    assert get_checkpoint_id(cached.parent_config) == get_checkpoint_id(stored.parent_config)
+    assert served_from_hot_tier == 1
+
+def test_hot_tier_is_refreshed_when_another_worker_advanced_the_thread():
+    async def run():
+        saver = await hot_tier_checkpointer()
+        first = await put(saver, thread_config("t1"), 1, ["Hallo"])
+        # Written by another worker, bypassing this worker's hot tier
+        await put(saver.backend, first, 2, ["Hallo", "Guten Tag"])
+        return saver, await saver.aget_tuple(thread_config("t1"))
+
+    saver, current = asyncio.run(run())
+    assert current.checkpoint["channel_values"]["messages"] == ["Hallo", "Guten Tag"]
+    assert saver.stats()["hot_tier"]["stale"] == 1
+
+def test_delete_thread_drops_cached_and_stored_state():
+    async def run():
+        saver = await hot_tier_checkpointer()
+        await put(saver, thread_config("t1"), 1, ["Hallo"])
+        await put(saver, thread_config("t2"), 1, ["Hallo"])
+        await saver.adelete_thread("t1")
+        stats = saver.stats()
+        return stats, await saver.aget_tuple(thread_config("t1")), await saver.aget_tuple(thread_config("t2"))
+
+    stats, deleted, other = asyncio.run(run())
+    assert stats["threads"] == 1
+    assert stats["hot_tier"]["size"] == 1
+    assert deleted is None
+    assert other is not None
+
+def test_prune_in_memory_mode_drops_least_recently_used_threads(monkeypatch):
+    monkeypatch.setattr(checkpointer_module, "CHECKPOINT_MAX_THREADS", 2)
+
+    async def run():
+        saver = SessionCheckpointer("memory")
+        await saver.open()
+        for thread_id in ("t1", "t2", "t3"):
+            await put(saver, thread_config(thread_id), 1, [thread_id])
+        # t1 becomes the most recently used thread
+        await saver.aget_tuple(thread_config("t1"))
+        pruned = await saver.prune()
+        remaining = {thread_id: await saver.aget_tuple(thread_config(thread_id)) for thread_id in ("t1", "t2", "t3")}
+        return pruned, remaining
+
+    pruned, remaining = asyncio.run(run())
+    assert pruned == {"idle_threads": 1}
+    assert remaining["t2"] is None
+    assert remaining["t1"] is not None and remaining["t3"] is not None
+
+def test_prune_drops_threads_idle_longer_than_ttl(monkeypatch):
+    monkeypatch.setattr(checkpointer_module, "CHECKPOINT_THREAD_TTL", -1)
+
+    async def run():
+        saver = SessionCheckpointer("memory")
+        await saver.open()
+        await put(saver, thread_config("t1"), 1, ["Hallo"])
+        pruned = await saver.prune()
+        return pruned, await saver.backend.aget_tuple(thread_config("t1"))
+
+    pruned, stored = asyncio.run(run())
+    assert pruned == {"idle_threads": 1}
+    assert stored is None
+
+def test_prune_in_memory_mode_keeps_latest_checkpoints_of_active_threads(monkeypatch):
+    monkeypatch.setattr(checkpointer_module, "CHECKPOINT_KEEP_LATEST", 2)
+
+    async def run():
+        saver = SessionCheckpointer("memory")
+        await saver.open()
+        config = thread_config("t1")
+        messages = []
+        for turn in range(1, 6):
+            messages = messages + [f"Frage {turn}", f"Antwort {turn}"]
+            config = await put(saver, config, turn, messages)
+            await saver.aput_writes(config, [("messages", f"Frage {turn + 1}")], f"task-{turn}")
+        pruned = await saver.prune()
+        return pruned, saver.backend, await saver.aget_tuple(thread_config("t1"))
+
+    pruned, backend, latest = asyncio.run(run())
+    assert pruned == {"idle_threads": 0}
+    kept = sorted(backend.storage["t1"][""], reverse=True)
+    assert len(kept) == 2
+    assert get_checkpoint_id(latest.config) == kept[0]
+    assert latest.checkpoint["channel_values"]["messages"][-1] == "Antwort 5"
+    assert latest.pending_writes == [("task-5", "messages", "Frage 6")]
+    assert {checkpoint_id for _, _, checkpoint_id in backend.writes} == set(kept)
+    # Only the channel values of the kept checkpoints remain
+    assert {version for _, _, _, version in backend.blobs} == {4, 5}
@@ -0,0 +1,72 @@
+from chains import eval_chain
+from app.db.models import ChatMessage, ChatSession, Evaluation
+
+
+def fake_evaluation(monkeypatch) -> list:
+    """Replace the rating calls, returns the list of evaluated transcripts."""
+    evaluated = []
+
+    async def stream_evaluation(messages):
+        evaluated.append([msg.content for msg in messages])
+        yield "**Gesamtbewertung: "
+        yield f"{len(evaluated)}/5**"
+
+    monkeypatch.setattr(eval_chain, "stream_evaluation", stream_evaluation)
+    return evaluated
+
+async def add_session(sessionmaker, session_id: str, contents: list):
+    async with sessionmaker() as db:
+        db.add(ChatSession(id=session_id))
+        for index, content in enumerate(contents):
+            db.add(ChatMessage(session_id=session_id, role="user" if index % 2 == 0 else "patient", content=content))
+        await db.commit()
+
+async def evaluate(client, session_id: str):
+    response = await client.post(f"/api/v1/eval/{session_id}")
+    return response.headers["X-Evaluation-Cache"], response.text
+
+def test_unchanged_session_is_served_from_stored_evaluation(run_api, monkeypatch):
+    evaluated = fake_evaluation(monkeypatch)
+
+    async def test(client, sessionmaker):
+        await add_session(sessionmaker, "s1", ["Was führt Sie zu mir?", "Kopfschmerzen."])
+        return await evaluate(client, "s1"), await evaluate(client, "s1")
+
+    first, second = run_api(test)
+    assert first == ("miss", "**Gesamtbewertung: 1/5**")
+    assert second == ("hit", "**Gesamtbewertung: 1/5**")
+    assert len(evaluated) == 1
+
+def test_new_message_invalidates_stored_evaluation(run_api, monkeypatch):
+    evaluated = fake_evaluation(monkeypatch)
+
+    async def test(client, sessionmaker):
+        await add_session(sessionmaker, "s1", ["Was führt Sie zu mir?", "Kopfschmerzen."])
+        first = await evaluate(client, "s1")
+        async with sessionmaker() as db:
+            db.add(ChatMessage(session_id="s1", role="user", content="Seit wann?"))
+            await db.commit()
+        return first, await evaluate(client, "s1")
+
+    first, second = run_api(test)
+    assert first[0] == "miss"
+    assert second == ("miss", "**Gesamtbewertung: 2/5**")
+    assert evaluated[-1][-1] == "Seit wann?"
+
+def test_new_eval_version_invalidates_stored_evaluation(run_api, monkeypatch):
+    evaluated = fake_evaluation(monkeypatch)
+
+    async def test(client, sessionmaker):
+        await add_session(sessionmaker, "s1", ["Was führt Sie zu mir?", "Kopfschmerzen."])
+        first = await evaluate(client, "s1")
+        monkeypatch.setattr(eval_chain, "EVAL_VERSION", eval_chain.EVAL_VERSION + "-next")
+        second = await evaluate(client, "s1")
+        async with sessionmaker() as db:
+            stored = (await db.execute(Evaluation.__table__.select())).all()
+        return first, second, stored
+
+    first, second, stored = run_api(test)
+    assert first[0] == "miss"
+    assert second == ("miss", "**Gesamtbewertung: 2/5**")
+    assert len(stored) == 2
+    assert len(evaluated) == 2
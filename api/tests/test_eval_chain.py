@@ -0,0 +1,68 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+
+from chains import eval_chain
+
+
+def dialogue(turns: int, words: int = 10) -> list:
+    messages = []
+    for turn in range(turns):
+        messages.append(HumanMessage(f"Frage {turn} " + "wort " * words))
+        messages.append(AIMessage(f"Antwort {turn} " + "wort " * words))
+    return messages
+
+def test_criteria_are_streamed_in_order_when_rated_out_of_order(monkeypatch):
+    count = len(eval_chain.CRITERIA)
+
+    async def invoke(semaphore, prompt, inputs):
+        # Later criteria finish first
+        await asyncio.sleep(0.001 * (count - inputs["index"]))
+        return f"{inputs['index']}. **{inputs['title']}: 3/5**"
+
+    monkeypatch.setattr(eval_chain, "_invoke", invoke)
+    monkeypatch.setattr(eval_chain, "get_rating_llm", lambda: FakeListChatModel(responses=["Stärken"]))
+
+    async def run():
+        return [chunk async for chunk in eval_chain.stream_evaluation(dialogue(2))]
+
+    chunks = asyncio.run(run())
+    ratings = chunks[1:1 + count]
+    assert [int(rating.split(".")[0]) for rating in ratings] == list(range(1, count + 1))
+    assert chunks[1 + count] == "**Gesamtbewertung: 3/5**\n"
+
+def test_chunk_messages_respects_token_limit_and_order():
+    messages = dialogue(6, words=20)
+    per_message = eval_chain.estimate_tokens(str(messages[0].content))
+    chunks = eval_chain.chunk_messages(messages, per_message * 3)
+    assert [msg for chunk in chunks for msg in chunk] == messages
+    assert all(len(chunk) <= 3 for chunk in chunks)
+
+def test_chunk_messages_keeps_oversized_message_in_own_chunk():
+    messages = dialogue(1, words=100)
+    chunks = eval_chain.chunk_messages(messages, 5)
+    assert chunks == [[messages[0]], [messages[1]]]
+
+def test_short_transcript_is_rated_without_condensing(monkeypatch):
+    async def invoke(semaphore, prompt, inputs):
+        raise AssertionError("short transcripts are not condensed")
+
+    monkeypatch.setattr(eval_chain, "_invoke", invoke)
+    messages = dialogue(2)
+    transcript = asyncio.run(eval_chain.condense_transcript(messages, asyncio.Semaphore(1)))
+    assert transcript == eval_chain.format_transcript(messages)
+
+def test_long_transcript_is_condensed_chunk_wise(monkeypatch):
+    calls = []
+
+    async def invoke(semaphore, prompt, inputs):
+        calls.append((inputs["index"], inputs["count"]))
+        return f"Abschnitt {inputs['index']}"
+
+    monkeypatch.setattr(eval_chain, "_invoke", invoke)
+    monkeypatch.setattr(eval_chain, "EVAL_CHUNK_TOKENS", 40)
+    transcript = asyncio.run(eval_chain.condense_transcript(dialogue(4, words=20), asyncio.Semaphore(2)))
+    assert len(calls) > 1
+    assert sorted(calls) == [(index, len(calls)) for index in range(1, len(calls) + 1)]
+    assert transcript == "\n".join(f"Abschnitt {index}" for index in range(1, len(calls) + 1))
@@ -0,0 +1,89 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from chains import chat_chain, history
+from chains.prompts import get_prompt
+
+
+def dialogue(turns: int, words: int = 10, open_question: bool = True) -> list:
+    messages = []
+    for turn in range(turns):
+        messages.append(HumanMessage(f"Frage {turn} " + "wort " * words, id=f"h{turn}"))
+        messages.append(AIMessage(f"Antwort {turn} " + "wort " * words, id=f"a{turn}"))
+    if open_question:
+        messages.append(HumanMessage("Und jetzt?", id="current"))
+    return messages
+
+def test_split_history_keeps_last_turns():
+    messages = dialogue(5)
+    older, kept = history.split_history(messages, keep_turns=3)
+    assert older == messages[:6]
+    assert kept == messages[6:]
+
+def test_split_history_keeps_everything_when_there_are_few_turns():
+    messages = dialogue(1)
+    assert history.split_history(messages, keep_turns=3) == ([], messages)
+
+def test_split_history_keeps_fewer_turns_when_they_exceed_max_tokens():
+    messages = dialogue(5, words=40)
+    turn_tokens = history.count_history_tokens(messages[:2])
+    current_tokens = history.estimate_tokens(str(messages[-1].content))
+    older, kept = history.split_history(messages, keep_turns=6, max_tokens=turn_tokens * 2 + current_tokens)
+    assert kept == messages[-5:]
+    assert older + kept == messages
+
+def test_split_history_always_keeps_current_turn():
+    messages = dialogue(2, words=40)
+    older, kept = history.split_history(messages, keep_turns=6, max_tokens=1)
+    assert kept == [messages[-1]]
+    assert older == messages[:-1]
+
+def test_summary_is_prefixed_to_first_doctor_message_so_roles_alternate():
+    messages = dialogue(2)
+    prompt_messages = get_prompt("default", "ausgewogen", "Name: Test").format_messages(
+        messages=history.with_summary("Kopfschmerzen seit gestern", messages)
+    )
+    assert isinstance(prompt_messages[0], SystemMessage)
+    roles = [type(msg) for msg in prompt_messages[1:]]
+    assert SystemMessage not in roles
+    assert all(first is not second for first, second in zip(roles, roles[1:]))
+    summarized = prompt_messages[-len(messages)]
+    assert summarized.content.startswith(history.SUMMARY_PREFIX + "Kopfschmerzen seit gestern")
+    assert summarized.content.endswith(str(messages[0].content))
+
+def run_manage_history(monkeypatch, messages, summary="", budget=200):
+    folded = []
+
+    async def summarize(llm, old_summary, older):
+        folded.append(older)
+        return "Zusammenfassung"
+
+    monkeypatch.setattr(chat_chain, "summarize_history", summarize)
+    monkeypatch.setattr(chat_chain, "get_summary_llm", lambda model: FakeListChatModel(responses=["-"]))
+    monkeypatch.setitem(history.HISTORY_TOKEN_BUDGETS, "test-model", budget)
+    result = asyncio.run(chat_chain.manage_history(
+        {"model": "test-model", "messages": messages, "summary": summary}
+    ))
+    return result, folded
+
+def test_manage_history_does_nothing_within_budget(monkeypatch):
+    result, folded = run_manage_history(monkeypatch, dialogue(2), budget=10000)
+    assert folded == []
+    assert result == {"summary": ""}
+
+def test_manage_history_folds_down_to_low_water_mark(monkeypatch):
+    messages = dialogue(8, words=20)
+    budget = history.count_history_tokens(messages) - 10
+    result, folded = run_manage_history(monkeypatch, messages, budget=budget)
+    assert len(folded) == 1
+    removed = {msg.id for msg in result["messages"]}
+    kept = [msg for msg in messages if msg.id not in removed]
+    assert history.count_history_tokens(kept, result["summary"]) <= budget * history.HISTORY_LOW_WATER
+    assert result["summarized_count"] == len(folded[0])
+
+    # The next turn fits below the budget without another summary call
+    next_turn = kept + [AIMessage("Antwort " + "wort " * 20), HumanMessage("Noch eine Frage?")]
+    _, folded_again = run_manage_history(monkeypatch, next_turn, summary=result["summary"], budget=budget)
+    assert folded_again == []
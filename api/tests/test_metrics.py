@@ -0,0 +1,41 @@
+import asyncio
+import uuid
+
+from app.llm_metrics import UPSTREAM_CANCELLED, UPSTREAM_ERRORS, UpstreamMetricsHandler
+from app.metrics import counter, histogram, render_prometheus
+
+
+def test_render_prometheus_histogram_and_counter():
+    latency = histogram("test_render_seconds", "Test latency", ("model",), buckets=(0.1, 1.0))
+    latency.observe(0.05, model="a")
+    latency.observe(0.5, model="a")
+    latency.observe(5, model="a")
+    errors = counter("test_render_errors", "Test errors", ("reason",))
+    errors.inc(reason='say "hi"')
+
+    text = render_prometheus()
+    assert "# TYPE test_render_seconds histogram" in text
+    assert 'test_render_seconds_bucket{model="a",le="0.1"} 1' in text
+    assert 'test_render_seconds_bucket{model="a",le="1.0"} 2' in text
+    assert 'test_render_seconds_bucket{model="a",le="+Inf"} 3' in text
+    assert 'test_render_seconds_count{model="a"} 3' in text
+    assert "# TYPE test_render_errors_total counter" in text
+    assert 'test_render_errors_total{reason="say \\"hi\\""} 1' in text
+
+def test_upstream_handler_counts_errors_with_run_metadata():
+    handler = UpstreamMetricsHandler()
+    metadata = {"ls_provider": "openai", "ls_model_name": "test-upstream", "condition": "alzheimer", "talkativeness": "kurz angebunden"}
+    failed, cancelled, wrapper = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+
+    handler.on_chat_model_start({}, [], run_id=failed, metadata=metadata)
+    handler.on_chat_model_start({}, [], run_id=cancelled, metadata=metadata)
+    # Runs of wrapper models are not counted
+    handler.on_chat_model_start({}, [], run_id=wrapper, metadata={"ls_provider": "routedchatmodel"})
+    assert handler.in_flight() == 2
+
+    handler.on_llm_error(RuntimeError("500"), run_id=failed)
+    handler.on_llm_error(asyncio.CancelledError(), run_id=cancelled)
+    handler.on_llm_error(RuntimeError("500"), run_id=wrapper)
+    assert handler.in_flight() == 0
+    assert UPSTREAM_ERRORS.samples()[("test-upstream", "alzheimer", "kurz angebunden")] == 1
+    assert UPSTREAM_CANCELLED.samples()[("test-upstream",)] == 1
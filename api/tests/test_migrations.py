@@ -0,0 +1,93 @@
+import asyncio
+import re
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app.db import migrations
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalars(self):
+        return iter(self.rows)
+
+
+class FakePostgres:
+    """Records executed statements and applied versions, like an engine connected to Postgres."""
+
+    class dialect:
+        name = "postgresql"
+
+    def __init__(self):
+        self.versions = []
+        self.executed = []
+        self.fail_on = None
+
+    @asynccontextmanager
+    async def connect(self):
+        yield self
+
+    async def execution_options(self, **options):
+        return self
+
+    async def execute(self, statement, parameters=None):
+        sql = str(statement)
+        if self.fail_on and self.fail_on in sql:
+            self.fail_on = None
+            raise ConnectionError("connection lost")
+        self.executed.append(sql)
+        if sql.startswith("SELECT version FROM schema_migrations"):
+            return FakeResult(list(self.versions))
+        if sql.startswith("INSERT INTO schema_migrations"):
+            self.versions.append(parameters["version"])
+        return FakeResult([])
+
+
+def migration_statements(database: FakePostgres) -> list:
+    return [sql for sql in database.executed if "schema_migrations" not in sql]
+
+def test_applied_migrations_are_not_run_again():
+    database = FakePostgres()
+    first = asyncio.run(migrations.run_migrations(database))
+    database.executed.clear()
+    second = asyncio.run(migrations.run_migrations(database))
+    assert first == [version for version, _ in migrations.MIGRATIONS]
+    assert second == []
+    assert migration_statements(database) == []
+
+def test_interrupted_migration_is_run_again_from_the_start():
+    database = FakePostgres()
+    database.fail_on = "ADD CONSTRAINT chat_summaries_session_id_fkey"
+    with pytest.raises(ConnectionError):
+        asyncio.run(migrations.run_migrations(database))
+    assert database.versions == ["0001_timestamptz", "0002_chat_messages_session_timestamp_index"]
+
+    database.executed.clear()
+    applied = asyncio.run(migrations.run_migrations(database))
+    assert applied == ["0003_session_fk_on_delete_cascade", "0004_chat_messages_truncated"]
+    # The statements 0003 already ran before the interruption are run again
+    statements = dict(migrations.MIGRATIONS)
+    assert migration_statements(database) == [
+        *statements["0003_session_fk_on_delete_cascade"], *statements["0004_chat_messages_truncated"]
+    ]
+
+@pytest.mark.parametrize("version, statements", migrations.MIGRATIONS)
+def test_migration_statements_are_idempotent(version, statements):
+    dropped = set()
+    for statement in statements:
+        if "DROP CONSTRAINT IF EXISTS" in statement:
+            dropped.add(re.search(r"DROP CONSTRAINT IF EXISTS (\w+)", statement).group(1))
+        elif "ADD CONSTRAINT" in statement:
+            # Only added after it was dropped, if it existed
+            assert re.search(r"ADD CONSTRAINT (\w+)", statement).group(1) in dropped
+        else:
+            assert "IF NOT EXISTS" in statement or "IF EXISTS" in statement
+
+def test_migrations_are_skipped_for_other_databases():
+    database = FakePostgres()
+    database.dialect = type("dialect", (), {"name": "sqlite"})
+    assert asyncio.run(migrations.run_migrations(database)) == []
+    assert database.executed == []
@@ -0,0 +1,43 @@
+import asyncio
+import json
+
+import httpx
+
+from tests.load.mock_backend import create_app
+
+
+def post(app, body):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://mock") as client:
+            return await client.post("/v1/chat/completions", json=body)
+    return asyncio.run(run())
+
+def stream_frames(response):
+    return [json.loads(line[len("data: "):]) for line in response.text.splitlines()
+            if line.startswith("data: ") and line != "data: [DONE]"]
+
+def test_mock_stream_respects_max_tokens_and_reports_usage():
+    app = create_app(token_rate=10000, first_token_delay=0)
+    body = {
+        "model": "mock",
+        "messages": [{"role": "system", "content": "Du bist Anna Zank."}, {"role": "user", "content": "Hallo"}],
+        "stream": True,
+        "stream_options": {"include_usage": True},
+        "max_completion_tokens": 5,
+    }
+    frames = stream_frames(post(app, body))
+    tokens = [frame["choices"][0]["delta"]["content"] for frame in frames[1:] if frame["choices"] and frame["choices"][0]["delta"]]
+    assert len(tokens) == 5
+    assert frames[-2]["choices"][0]["finish_reason"] == "length"
+    assert frames[-1]["usage"]["completion_tokens"] == 5
+    assert frames[-1]["usage"]["prompt_tokens_details"]["cached_tokens"] == 0
+
+    # The same system prompt is reported as cached on the next request
+    frames = stream_frames(post(app, body))
+    assert frames[-1]["usage"]["prompt_tokens_details"]["cached_tokens"] > 0
+
+def test_mock_injects_errors():
+    app = create_app(first_token_delay=0, error_rate=1.0)
+    response = post(app, {"model": "mock", "messages": [{"role": "user", "content": "Hallo"}]})
+    assert response.status_code == 500
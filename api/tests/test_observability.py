@@ -0,0 +1,62 @@
+import logging
+
+from chains import observability
+
+
+class Expensive:
+    """Counts how often it is converted to a string."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __str__(self):
+        self.calls += 1
+        return "x" * 1000
+
+
+def test_truncate_formats_only_emitted_records(caplog):
+    value = Expensive()
+    logger = logging.getLogger("test_observability")
+    logger.setLevel(logging.INFO)
+    logger.debug("Value: %s", observability.truncate(value))
+    assert value.calls == 0
+
+    with caplog.at_level(logging.DEBUG, logger="test_observability"):
+        logger.debug("Value: %s", observability.truncate(value, 10))
+    assert value.calls > 0
+    assert caplog.records[-1].getMessage() == "Value: xxxxxxxxxx... (1000 chars)"
+
+def test_configure_logging_keeps_request_timings_at_default_level(monkeypatch):
+    root, timing = logging.getLogger(), logging.getLogger("timing")
+    levels = root.level, timing.level
+    monkeypatch.setattr(observability, "LOG_LEVEL", "WARNING")
+    monkeypatch.setattr(observability, "TIMING_LOG_LEVEL", "INFO")
+    try:
+        monkeypatch.setattr(observability, "LOG_LEVELS", {})
+        observability.configure_logging()
+        assert timing.isEnabledFor(logging.INFO)
+        assert not logging.getLogger("chat").isEnabledFor(logging.INFO)
+
+        monkeypatch.setattr(observability, "LOG_LEVELS", {"timing": "WARNING"})
+        observability.configure_logging()
+        assert not timing.isEnabledFor(logging.INFO)
+    finally:
+        root.setLevel(levels[0])
+        timing.setLevel(levels[1])
+
+def test_traceable_is_a_no_op_without_tracing(monkeypatch):
+    for name in observability._TRACING_ENV_VARS:
+        monkeypatch.delenv(name, raising=False)
+
+    async def call_model(state):
+        return state
+
+    assert observability.traceable(run_type="llm", name="Test")(call_model) is call_model
+    assert observability.sample_trace() is False
+
+def test_trace_sampling_rate(monkeypatch):
+    monkeypatch.setenv("LANGCHAIN_TRACING_V2", "true")
+    monkeypatch.setattr(observability, "TRACE_SAMPLE_RATE", 0.0)
+    assert not any(observability.sample_trace() for _ in range(100))
+    monkeypatch.setattr(observability, "TRACE_SAMPLE_RATE", 1.0)
+    assert all(observability.sample_trace() for _ in range(100))
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+pytest.importorskip("aiosqlite")
+
+from app.db import persistence
+from app.db.db import Base
+from app.db.models import ChatMessage, ChatSession
+
+
+def run_with_database(tmp_path, monkeypatch, test):
+    """Run test(writer, sessionmaker) against a SQLite database that enforces foreign keys."""
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'messages.db'}")
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def enable_foreign_keys(dbapi_connection, connection_record):
+            dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessionmaker = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        async with sessionmaker() as db:
+            db.add_all([ChatSession(id="s1"), ChatSession(id="s2")])
+            await db.commit()
+        monkeypatch.setattr(persistence, "SessionLocal", sessionmaker)
+        monkeypatch.setattr(persistence, "MESSAGE_FLUSH_RETRY_DELAY", 0)
+        try:
+            return await test(sessionmaker)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+async def stored(sessionmaker, session_id=None) -> list:
+    query = select(ChatMessage.session_id, ChatMessage.content).order_by(ChatMessage.id)
+    if session_id:
+        query = query.where(ChatMessage.session_id == session_id)
+    async with sessionmaker() as db:
+        return [tuple(row) for row in (await db.execute(query)).all()]
+
+def test_messages_keep_their_order_per_session(tmp_path, monkeypatch):
+    async def test(sessionmaker):
+        writer = persistence.MessageWriter(flush_interval_ms=1, max_rows=3)
+        writer.start()
+        for index in range(10):
+            await writer.put("s1" if index % 2 else "s2", "user", f"m{index}")
+        await writer.close()
+        return await stored(sessionmaker, "s1"), await stored(sessionmaker, "s2")
+
+    s1, s2 = run_with_database(tmp_path, monkeypatch, test)
+    assert [content for _, content in s1] == ["m1", "m3", "m5", "m7", "m9"]
+    assert [content for _, content in s2] == ["m0", "m2", "m4", "m6", "m8"]
+
+def test_wait_flushed_returns_once_session_messages_are_stored(tmp_path, monkeypatch):
+    async def test(sessionmaker):
+        writer = persistence.MessageWriter(flush_interval_ms=20)
+        writer.start()
+        await writer.put("s1", "user", "Hallo")
+        await writer.put("s1", "patient", "Guten Tag")
+        await writer.wait_flushed("s1")
+        rows = await stored(sessionmaker)
+        await writer.close()
+        return rows
+
+    assert run_with_database(tmp_path, monkeypatch, test) == [("s1", "Hallo"), ("s1", "Guten Tag")]
+
+def test_close_drains_queued_messages(tmp_path, monkeypatch):
+    async def test(sessionmaker):
+        # Nothing is flushed on its own within the test
+        writer = persistence.MessageWriter(flush_interval_ms=60000, max_rows=1000)
+        writer.start()
+        for index in range(5):
+            await writer.put("s1", "user", f"m{index}")
+        await writer.close()
+        return await stored(sessionmaker), writer.stats()
+
+    rows, stats = run_with_database(tmp_path, monkeypatch, test)
+    assert len(rows) == 5
+    assert stats["queued"] == 0
+    assert stats["flushed"] == 5
+
+def test_integrity_error_stores_other_messages_one_by_one(tmp_path, monkeypatch):
+    async def test(sessionmaker):
+        writer = persistence.MessageWriter(flush_interval_ms=60000)
+        writer.start()
+        await writer.put("s1", "user", "vorher")
+        # The session does not exist, the batched insert fails on the foreign key
+        await writer.put("deleted", "user", "verloren")
+        await writer.put("s2", "user", "nachher")
+        await writer.close()
+        return await stored(sessionmaker), writer.stats()
+
+    rows, stats = run_with_database(tmp_path, monkeypatch, test)
+    assert rows == [("s1", "vorher"), ("s2", "nachher")]
+    assert stats["dropped"] == 1
+    assert stats["queued"] == 0
+
+def test_failure_during_one_by_one_inserts_does_not_duplicate_rows(tmp_path, monkeypatch):
+    async def test(sessionmaker):
+        calls = 0
+
+        def flaky_sessionmaker():
+            nonlocal calls
+            calls += 1
+            # Batch insert, first single insert, then the connection is lost once
+            if calls == 3:
+                raise ConnectionError("connection lost")
+            return sessionmaker()
+
+        monkeypatch.setattr(persistence, "SessionLocal", flaky_sessionmaker)
+        writer = persistence.MessageWriter(flush_interval_ms=60000)
+        writer.start()
+        await writer.put("s1", "user", "eins")
+        await writer.put("deleted", "user", "verloren")
+        await writer.put("s2", "user", "zwei")
+        await writer.close()
+        return await stored(sessionmaker), writer.stats()
+
+    rows, stats = run_with_database(tmp_path, monkeypatch, test)
+    assert rows == [("s1", "eins"), ("s2", "zwei")]
+    assert stats["errors"] == 1
+    assert stats["dropped"] == 1
@@ -0,0 +1,19 @@
+from langchain_core.messages import HumanMessage
+
+from chains.prompts import build_prompt, canonicalize_prompt, normalize_text
+
+
+def test_normalize_text_is_stable():
+    text = "\n    /nothink\r\n    Zeile eins  \n\n\n\n    Zeile zwei\n    "
+    assert normalize_text(text) == "/nothink\nZeile eins\n\nZeile zwei"
+    assert normalize_text(normalize_text(text)) == normalize_text(text)
+
+def test_canonical_prompt_keeps_static_prefix_and_literal_details():
+    details = "Name: Max {Mustermann}\n    Allergien: keine"
+    prompt = canonicalize_prompt(build_prompt("default", "ausgewogen", details))
+    first = prompt.format_messages(messages=[HumanMessage("Guten Tag")])
+    second = prompt.format_messages(messages=[HumanMessage("Guten Tag"), HumanMessage("Was führt Sie her?")])
+
+    # Everything before the history is identical between turns
+    assert [m.content for m in first[:-1]] == [m.content for m in second[:-2]]
+    assert "Name: Max {Mustermann}\nAllergien: keine" in first[0].content
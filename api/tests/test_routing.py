@@ -0,0 +1,65 @@
+import asyncio
+
+from langchain_core.messages import HumanMessage
+
+from chains import routing
+from conftest import FakeChatModel
+
+
+def run_routed(models, model, monkeypatch, **settings):
+    monkeypatch.setattr(routing, "_health", {})
+    for name, value in settings.items():
+        monkeypatch.setattr(routing, name, value)
+    llm = routing.RoutedChatModel(model=model, llm_factory=lambda name: models[name])
+    return asyncio.run(llm.ainvoke([HumanMessage("Wie geht es Ihnen?")])).content.strip()
+
+
+def test_hedged_request_wins_when_first_token_is_late(monkeypatch):
+    models = {
+        "slow": FakeChatModel(answer="langsam", delay=1.0),
+        "fast": FakeChatModel(answer="Mir geht es gut"),
+    }
+    answer = run_routed(models, "slow", monkeypatch, ROUTING_FALLBACKS={"slow": "fast"}, HEDGE_DEFAULT_DELAY=0.05)
+    assert answer == "Mir geht es gut"
+    assert routing.get_model_health("slow").hedge_wins == 1
+
+def test_hedge_delay_does_not_drop_when_hedges_win(monkeypatch):
+    monkeypatch.setattr(routing, "_health", {})
+    monkeypatch.setattr(routing, "ROUTING_FALLBACKS", {"primary": "fallback"})
+    monkeypatch.setattr(routing, "ROUTING_WINDOW", 4)
+    monkeypatch.setattr(routing, "ROUTING_MIN_SAMPLES", 4)
+    monkeypatch.setattr(routing, "HEDGE_MIN_DELAY", 0)
+    health = routing.get_model_health("primary")
+    health.ttft.extend([0.1] * 4)
+    # Every other call of the primary is slow and beaten by the hedge
+    primaries = iter([FakeChatModel(answer="schnell"), FakeChatModel(answer="langsam", delay=1.0)] * 5)
+    models = {"fallback": FakeChatModel(answer="Gut")}
+    llm = routing.RoutedChatModel(
+        model="primary", llm_factory=lambda name: next(primaries) if name == "primary" else models[name]
+    )
+
+    async def run():
+        for _ in range(10):
+            await llm.ainvoke([HumanMessage("Wie geht es Ihnen?")])
+
+    asyncio.run(run())
+    assert health.hedge_wins == 5
+    assert health.hedge_delay() >= 0.1
+
+def test_failed_call_fails_over_to_fallback(monkeypatch):
+    models = {
+        "broken": FakeChatModel(answer="", fail=True),
+        "fast": FakeChatModel(answer="Gut"),
+    }
+    answer = run_routed(models, "broken", monkeypatch, ROUTING_FALLBACKS={"broken": "fast"}, HEDGE_DEFAULT_DELAY=5)
+    assert answer == "Gut"
+    assert routing.get_model_health("broken").error_rate() == 1.0
+
+def test_circuit_opens_after_consecutive_failures(monkeypatch):
+    monkeypatch.setattr(routing, "CIRCUIT_FAILURE_THRESHOLD", 2)
+    health = routing.ModelHealth("broken")
+    health.record_failure()
+    assert health.state == "closed"
+    health.record_failure()
+    assert health.state == "open"
+    assert not health.allow_request()
@@ -0,0 +1,75 @@
+import datetime
+
+from app.db.models import ChatMessage, ChatSession
+
+
+START = datetime.datetime(2025, 5, 1, 9, 0, tzinfo=datetime.timezone.utc)
+
+async def add_session(sessionmaker, session_id: str, count: int):
+    """Store a session with count messages, every pair of messages shares a timestamp."""
+    async with sessionmaker() as db:
+        db.add(ChatSession(id=session_id))
+        for index in range(count):
+            db.add(ChatMessage(
+                session_id=session_id,
+                role="user" if index % 2 == 0 else "patient",
+                content=f"m{index}",
+                timestamp=START + datetime.timedelta(seconds=index // 2),
+            ))
+        await db.commit()
+
+async def read_all_pages(client, session_id: str, limit: int) -> list:
+    pages = []
+    params = {"limit": limit}
+    while True:
+        response = await client.get(f"/api/v1/sessions/{session_id}/messages", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        pages.append(page)
+        if page["next_after_id"] is None:
+            return pages
+        params = {"limit": limit, "after_timestamp": page["next_after_timestamp"], "after_id": page["next_after_id"]}
+
+def test_pages_follow_each_other_across_equal_timestamps(run_api):
+    async def test(client, sessionmaker):
+        await add_session(sessionmaker, "s1", 7)
+        await add_session(sessionmaker, "s2", 2)
+        return await read_all_pages(client, "s1", limit=3)
+
+    pages = run_api(test)
+    # The first page ends within a pair of messages with the same timestamp
+    assert [[msg["content"] for msg in page["messages"]] for page in pages] == [
+        ["m0", "m1", "m2"], ["m3", "m4", "m5"], ["m6"]
+    ]
+
+def test_exactly_full_last_page_is_followed_by_an_empty_page(run_api):
+    async def test(client, sessionmaker):
+        await add_session(sessionmaker, "s1", 4)
+        return await read_all_pages(client, "s1", limit=2)
+
+    pages = run_api(test)
+    assert [len(page["messages"]) for page in pages] == [2, 2, 0]
+    assert pages[-1]["next_after_timestamp"] is None
+
+def test_cursor_needs_timestamp_and_id(run_api):
+    async def test(client, sessionmaker):
+        await add_session(sessionmaker, "s1", 2)
+        response = await client.get("/api/v1/sessions/s1/messages", params={"after_id": 1})
+        return response.status_code
+
+    assert run_api(test) == 400
+
+def test_messages_of_reset_session_are_not_found(run_api):
+    async def test(client, sessionmaker):
+        await add_session(sessionmaker, "s1", 2)
+        before = await client.get("/api/v1/sessions/s1/messages")
+        reset = await client.post("/api/v1/reset/s1")
+        after = await client.get("/api/v1/sessions/s1/messages")
+        async with sessionmaker() as db:
+            # The messages were deleted with the session
+            remaining = await db.get(ChatMessage, before.json()["messages"][0]["id"])
+        return before.status_code, reset.status_code, after.status_code, remaining
+
+    before, reset, after, remaining = run_api(test)
+    assert (before, reset, after) == (200, 200, 404)
+    assert remaining is None
@@ -0,0 +1,55 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app import startup
+
+
+def test_app_imports_without_chatai_env_and_heavy_chain_modules():
+    env = {k: v for k, v in os.environ.items() if not k.startswith("CHATAI_") and k != "CHECKPOINTER_MODE"}
+    code = (
+        "import sys, app.main; "
+        "print(','.join(m for m in ('langchain_openai', 'langgraph', 'chains.chat_chain', 'chains.eval_chain') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(__file__)),
+        env=env, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
+
+def test_schema_setup_retries_until_database_is_available(monkeypatch):
+    failures = [ConnectionRefusedError("db starting"), ConnectionRefusedError("db starting")]
+
+    async def init_db():
+        if failures:
+            raise failures.pop(0)
+
+    async def run_migrations(engine):
+        return []
+
+    monkeypatch.setattr(startup, "init_db", init_db)
+    monkeypatch.setattr(startup, "run_migrations", run_migrations)
+    monkeypatch.setattr(startup, "DB_STARTUP_RETRY_DELAY", 0)
+    monkeypatch.setattr(startup, "_schema_ready", False)
+    asyncio.run(startup.setup_schema())
+    stats = startup.startup_stats()
+    assert stats["schema_attempts"] == 3
+    assert stats["schema_ready"]
+    assert "schema" in stats["phases_seconds"]
+
+def test_schema_setup_fails_after_retries(monkeypatch):
+    async def init_db():
+        raise ConnectionRefusedError("db down")
+
+    monkeypatch.setattr(startup, "init_db", init_db)
+    monkeypatch.setattr(startup, "DB_STARTUP_RETRIES", 1)
+    monkeypatch.setattr(startup, "DB_STARTUP_RETRY_DELAY", 0)
+    monkeypatch.setattr(startup, "_schema_ready", False)
+    with pytest.raises(ConnectionRefusedError):
+        asyncio.run(startup.setup_schema())
+    assert startup.startup_stats()["schema_attempts"] == 2
+    assert not startup.startup_stats()["schema_ready"]
@@ -0,0 +1,120 @@
+import asyncio
+
+from app.streaming import ResponseBuffer, ThinkTagFilter, cancel_on_disconnect, coalesce_chunks, start_response_buffer
+
+
+def run_filter(chunks):
+    think_filter = ThinkTagFilter()
+    visible = "".join(think_filter.feed(chunk) for chunk in chunks) + think_filter.flush()
+    return visible, think_filter
+
+def test_think_filter_removes_think_block():
+    visible, think_filter = run_filter(["<think>", "Hmm, ", "ich bin", "</think>\n\n", "Guten ", "Tag."])
+    assert visible == "Guten Tag."
+    assert think_filter.hidden_chars == len("Hmm, ich bin")
+
+def test_think_filter_handles_tags_split_across_chunks():
+    visible, _ = run_filter(["<th", "ink>geheim</th", "in", "k>", "Hallo"])
+    assert visible == "Hallo"
+
+def test_think_filter_passes_text_without_tags():
+    visible, think_filter = run_filter(["Ich ", "weiß es ", "nicht <"])
+    assert visible == "Ich weiß es nicht <"
+    assert think_filter.hidden_chunks == 0
+
+def test_think_filter_drops_unclosed_think_block():
+    visible, _ = run_filter(["Antwort", "<think>", "abgebrochen"])
+    assert visible == "Antwort"
+
+def test_response_buffer_resumes_after_sequence_number():
+    async def run():
+        buffer = ResponseBuffer()
+        for text in ["Guten ", "Tag, ", "Herr ", "Doktor."]:
+            await buffer.append(text)
+        await buffer.finish({"hidden_tokens": 0})
+        return [item async for item in buffer.follow(after=2)], buffer.summary()
+
+    frames, summary = asyncio.run(run())
+    assert frames == [(3, "Herr "), (4, "Doktor.")]
+    assert summary["chunks"] == 4
+    assert summary["hidden_tokens"] == 0
+
+def test_response_buffer_duration_ends_when_finished():
+    async def run():
+        buffer = ResponseBuffer()
+        await buffer.append("Guten Tag.")
+        await asyncio.sleep(0.01)
+        await buffer.finish()
+        first = buffer.summary()["duration_ms"]
+        # A later resume reports the same duration
+        await asyncio.sleep(0.05)
+        return first, buffer.summary()["duration_ms"]
+
+    first, resumed = asyncio.run(run())
+    assert first >= 10
+    assert resumed == first
+
+def test_new_response_buffer_cancels_unfinished_response():
+    async def run():
+        previous = start_response_buffer("replaced-session")
+        previous.task = asyncio.create_task(asyncio.sleep(60))
+        await asyncio.sleep(0)
+        current = start_response_buffer("replaced-session")
+        current.task = asyncio.create_task(asyncio.sleep(0))
+        await asyncio.sleep(0.01)
+        # A finished response is not cancelled
+        start_response_buffer("replaced-session")
+        return previous.task.cancelled(), current.task.cancelled()
+
+    previous_cancelled, finished_cancelled = asyncio.run(run())
+    assert previous_cancelled
+    assert not finished_cancelled
+
+def test_coalesce_chunks_merges_until_byte_threshold():
+    async def tokens():
+        for text in ["Guten", " Tag", ",", " Herr", " Doktor", "."]:
+            yield text
+
+    async def run():
+        return [chunk async for chunk in coalesce_chunks(tokens(), max_bytes=8, window_ms=1000)]
+
+    chunks = asyncio.run(run())
+    assert chunks == ["Guten", " Tag, Herr", " Doktor."]
+
+def test_coalesce_chunks_flushes_after_window():
+    async def tokens():
+        yield "Hallo"
+        yield " Herr"
+        await asyncio.sleep(0.05)
+        yield " Doktor"
+
+    async def run():
+        return [chunk async for chunk in coalesce_chunks(tokens(), max_bytes=1000, window_ms=10)]
+
+    chunks = asyncio.run(run())
+    assert chunks == ["Hallo", " Herr", " Doktor"]
+
+def test_cancel_on_disconnect_cancels_source():
+    cancelled = []
+
+    async def tokens():
+        try:
+            yield "Hallo"
+            await asyncio.sleep(10)
+            yield " Doktor"
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        received = []
+
+        async def is_disconnected():
+            return bool(received)
+
+        async for chunk in cancel_on_disconnect(tokens(), is_disconnected, poll_interval=0.01):
+            received.append(chunk)
+        return received
+
+    assert asyncio.run(run()) == ["Hallo"]
+    assert cancelled == [True]
@@ -0,0 +1,30 @@
+import json
+import logging
+
+from app import timing
+
+
+def test_server_timing_header_sums_phases():
+    timer = timing.RequestTimer("chat", "s1", "test-model")
+    timer.add("profile", 0.0125)
+    timer.add("persist", 0.002)
+    timer.add("persist", 0.003)
+    assert timer.server_timing() == "profile;dur=12.5, persist;dur=5.0"
+
+def test_slow_turn_is_logged_with_session_and_model(monkeypatch, caplog):
+    timer = timing.RequestTimer("chat", "s1", "test-model")
+    timer.upstream_connects.extend([0.02, 0.05])
+    monkeypatch.setattr(timing, "SLOW_TURN_THRESHOLD", 0.000001)
+    with caplog.at_level(logging.WARNING, logger="slow_turns"):
+        record = timer.finish(tokens=12)
+    assert record["phases_ms"]["connect"] == 50.0
+    logged = json.loads(caplog.records[-1].getMessage())
+    assert logged["session_id"] == "s1"
+    assert logged["model"] == "test-model"
+    assert logged["tokens"] == 12
+
+def test_fast_turn_is_not_logged_as_slow(monkeypatch, caplog):
+    monkeypatch.setattr(timing, "SLOW_TURN_THRESHOLD", 60)
+    with caplog.at_level(logging.WARNING, logger="slow_turns"):
+        timing.RequestTimer("eval").finish()
+    assert not caplog.records
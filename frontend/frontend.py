@@ -2,9 +2,9 @@ import requests
 import streamlit as st
 import logging
 import uuid
+import time
 import base64
 from pathlib import Path
-import re
 
 # Constants
 API_URL = "http://host.docker.internal:8000/api/v1"
@@ -18,6 +18,8 @@ AVAILABLE_MODELS = [
 ]
 PATIENT_ROLES = ["default", "alzheimer", "schwerhörig", "verdrängung"]
 TALKATIVENESS_LEVELS = ["kurz angebunden", "ausgewogen", "ausschweifend"]
+# Min. seconds between re-renders of a streamed response, each re-render converts the whole text again
+RENDER_INTERVAL = 0.1
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -124,15 +126,12 @@ def handle_chat_eval() -> None:
         return
 
     try:
-        messages = [
-            {"role": msg["role"], "output": msg["output"]} for msg in st.session_state.messages
-        ]
-
         # Create placeholder for evaluation response
         response_placeholder = st.chat_message("patient").markdown("")
 
+        # The API reads the transcript of the session from the database
         with st.spinner("Anamnese Feedback wird erstellt..."):
-            with requests.post(f"{API_URL}/eval", json={"messages": messages}, stream=True) as response:
+            with requests.post(f"{API_URL}/eval/{st.session_state.session_id}", stream=True) as response:
                 if response.status_code == 200:
                     evaluation_text = process_llm_response(response, response_placeholder)
                     st.session_state.messages.append({
@@ -147,36 +146,21 @@ def handle_chat_eval() -> None:
         st.error(f"Fehler bei der Bewertung: {str(e)}")
 
 def process_llm_response(response: requests.Response, response_placeholder: st.delta_generator.DeltaGenerator) -> str:
-    """Process streaming response from LLM"""
-    streamed_text = ""
-    buffer = ""
-    think_tags_removed = False
-
-    for chunk in response.iter_content(chunk_size=None):
-        chunk_text = chunk.decode()
-        buffer += chunk_text
-        
-        # Check for think tags
-        if not think_tags_removed and "<think>" in buffer:
-            # Wait for closing tag
-            if "</think>\n" in buffer:
-                # Remove tags
-                buffer = re.sub(r'^<think>[\s\S]*?</think>\n\n?', '', buffer)
-                think_tags_removed = True
-            else:
-                # Don't display anything yet, wait for closing tag
-                continue
-        
-        # Add processed text to stream
-        if think_tags_removed or not "<think>" in buffer:
-            streamed_text += buffer
-            buffer = ""
-            think_tags_removed = True if not think_tags_removed else think_tags_removed
-
-        # Update display
-        response_placeholder.markdown(streamed_text)
-    
-    return streamed_text
+    """Process streaming response from LLM, think blocks are already removed by the API"""
+    text = ""
+    rendered_at = 0.0
+
+    for chunk_text in response.iter_content(chunk_size=None, decode_unicode=True):
+        text += chunk_text
+        # Update display at most every RENDER_INTERVAL seconds instead of for every chunk
+        now = time.monotonic()
+        if now - rendered_at >= RENDER_INTERVAL:
+            response_placeholder.markdown(text)
+            rendered_at = now
+
+    # Show the complete response
+    response_placeholder.markdown(text)
+    return text
 
 def main() -> None:
     """Main application function"""